@@ -2,3 +2,8 @@
 #OPENAI_API_KEY="sk-*"
 #OPENAI_ORGID="org-*5uQ"
 #
+#OPENAI_BASE_URL="http://127.0.0.1:8085/v1"   # local fake endpoint, see src/fake_openai_server.py
+#AI_MAX_IN_FLIGHT=4
+#AI_RPM=500                                  # requests per minute of the API tier
+#AI_TPM=30000                                # tokens per minute of the API tier
+#
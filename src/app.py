@@ -1,13 +1,52 @@
 import os
+import json
+import hashlib
 import argparse
+import itertools
 import re
+import time
+import shutil
+import signal
 import logging
 from dotenv import load_dotenv
-from classes.ai_image_processor       import AIImageProcessor
+from classes.ai_image_processor       import AIImageProcessor, MODEL, MAX_TOKENS, INSTRUCTIONS
+from classes.ai_result_cache          import AIResultCache
+from classes.image_upload_optimizer   import ImageUploadOptimizer
+from classes.ai_batch                 import AIBatch
+from classes.processing_manifest      import ProcessingManifest, file_sha256
+from classes.hybrid_ocr_router        import HybridOCRRouter
+from classes.ocr_engine               import create_ocr_engine, close_engine, process_jobs, ENGINE_NAMES
 from classes.pdf_to_text_and_images   import PDFToTextAndImages
-from classes.mhtml_to_text_and_images import MHTMLToTextAndImages
+from classes.mhtml_to_text_and_images import MHTMLToTextAndImages, HTML_BACKENDS
+from classes.run_metrics              import RunMetrics
+from classes.budget_scheduler         import BudgetScheduler, BudgetExhausted, FileOrder, ORDER_POLICIES
+from classes.rate_limiter             import RateLimiter
+from classes.image_triage             import ImageTriage, TRIAGE_FILE
+from classes.perceptual_hash_index    import PerceptualHashIndex, PerceptualReuseEngine
+from classes.folder_watcher           import FolderWatcher
+from classes.job_journal              import JobJournal
+from classes.work_leases              import WorkLeases
 
 logger = None
+max_in_flight = 4  # max number of concurrent AI requests, see --max-in-flight
+ai_cache = None    # AIResultCache shared by all files in a run, see --cache-dir
+pdf_workers = 1    # processes used to extract PDF pages, see --pdf-workers
+upload_optimizer = None  # ImageUploadOptimizer, see --max-edge, --detail and --webp
+ai_batch = None    # AIBatch when --batch write collects requests instead of calling the AI
+manifest = None    # ProcessingManifest, unchanged files are skipped - see --manifest and --force
+html_backend = "html.parser"  # how the <body> of MHTML html parts is extracted, see --html-backend
+ocr_settings = {"engine": "ai", "min_confidence": 70.0, "min_words": 5, "tesseract_workers": os.cpu_count() or 1,
+                "fingerprint": None}  # see --engine, fingerprint: see ocr_fingerprint()
+ocr_processor = None  # created on first use and kept for the whole run, see get_ocr_processor()
+metrics = RunMetrics()  # stage times, bytes, images, tokens of this run - see --report and --metrics-file
+metrics_file = None   # Prometheus text file, rewritten after every file
+budget = None         # BudgetScheduler: the token/cost budget, only with --budget-tokens or --budget-cost
+file_order = FileOrder()  # the order of the files in --path, see --order
+rate_limiter = None   # RateLimiter shared by all AI requests of the run, see --rpm, --tpm and --max-retries
+image_triage = None   # ImageTriage, tiny, blank and decorative images are not sent to OCR - see --no-triage
+phash_index = None    # PerceptualHashIndex, near duplicate images reuse earlier OCR results - see --phash-index
+journal = None        # JobJournal, the extracted pages and OCR'd images of every document - see --journal
+resume = False        # continue documents where the journal says an earlier run stopped, see --resume
 
 def setup_logger(log_level: int) -> logging.Logger:
     logger = logging.getLogger("file_to_html_converter")
@@ -19,71 +58,283 @@ def setup_logger(log_level: int) -> logging.Logger:
     return logger
 
 
-def pdf_to_html_jpeg(pdf_path, output_folder):
+def pdf_to_html_jpeg(pdf_path, output_folder, listener=None):
     global logger
-    converter = PDFToTextAndImages(logger)
+    converter = PDFToTextAndImages(logger, metrics=metrics)
 
     logger.info(f"Starting PDF to HTML conversion of {pdf_path} in folder: {os.getcwd()}")
-    pages_elements = converter.extract_images_and_text(pdf_path, output_folder)
-    output_html_path = os.path.join(output_folder, f"{output_folder}.html")
-
-    converter.generate_html(pages_elements, output_html_path)
+    done_pages = journal.pages(pdf_path) if journal is not None else []
+    if done_pages:
+        logger.info(f"Resuming the extraction of {pdf_path} at page {len(done_pages) + 1}")
+    pages_elements = converter.iter_pages_elements(pdf_path, output_folder, workers=pdf_workers, start_page=len(done_pages))
+    if journal is not None:
+        pages_elements = itertools.chain(done_pages, journal_pages(pdf_path, pages_elements, len(done_pages)))
+    output_html_path = os.path.join(output_folder, f"{os.path.basename(output_folder)}.html")
+
+    on_page = None
+    if listener is not None:
+        on_page = lambda page_num, html: listener({"event": "page", "page": page_num, "html": html})
+    converter.generate_html(pages_elements, output_html_path, on_page=on_page)
     logger.info(f"HTML file created at: {output_html_path}")
     return output_html_path
 
 
-def mhtml_to_html_jpeg(mhtml_path, output_folder):
+def journal_pages(pdf_path, pages_elements, start_page):
+    """records every page in the journal as it is extracted, a resumed run starts after the last one"""
+    for page_num, elements in enumerate(pages_elements, start_page):
+        journal.record_page(pdf_path, page_num, elements)
+        yield elements
+
+
+def mhtml_to_html_jpeg(mhtml_path, output_folder, listener=None):
     global logger
-    mhtml_to_html_converter = MHTMLToTextAndImages(logger)
+    mhtml_to_html_converter = MHTMLToTextAndImages(logger, html_backend=html_backend, metrics=metrics)
 
     logger.info(f"Starting MHTML to HTML conversion of {mhtml_path} in folder: {os.getcwd()}")
     output_html_path, _ = mhtml_to_html_converter.convert(mhtml_path, output_folder)
-    
+    if listener is not None:
+        with open(output_html_path, "r") as html_file:
+            listener({"event": "html", "file": output_html_path, "html": html_file.read()})
+
     logger.info(f"HTML file created at: {output_html_path}")
     return output_html_path
 
 
-def jpeg_to_markdown(jpeg_directory):
-    global logger
-    processor = AIImageProcessor()
+def find_jpeg_images(jpeg_directory):
     jpeg_pattern = re.compile(r'^.*\.jpe?g$', re.IGNORECASE)
+    source_images = []
 
-    for root, _, files in os.walk(jpeg_directory):
-        for file in files:
+    for root, dirs, files in os.walk(jpeg_directory):
+        dirs.sort()  # walk in a stable order so results are logged in the same order every run
+        for file in sorted(files):
             if jpeg_pattern.match(file):
-                source_image = os.path.join(root, file)
-                output_file = os.path.splitext(source_image)[0] + '.md'
-                processor.process_image(source_image, output_file)
-                logger.info(f"AI-analyzing {source_image} - result is in {output_file}")
+                source_images.append(os.path.join(root, file))
+
+    return source_images
+
+
+def create_ai_processor():
+    return AIImageProcessor(cache=ai_cache, optimizer=upload_optimizer, metrics=metrics, budget=budget,
+                            limiter=rate_limiter, logger=logger)
 
 
-def process_file(file_path):
-    output_folder = os.path.splitext(os.path.basename(file_path))[0]
+def get_ocr_processor():
+    global ocr_processor
+    if ocr_processor is None:
+        ocr_processor = create_ocr_engine(ocr_settings["engine"], logger, ai_factory=create_ai_processor,
+                                          tesseract_workers=ocr_settings["tesseract_workers"],
+                                          min_confidence=ocr_settings["min_confidence"],
+                                          min_words=ocr_settings["min_words"])
+        if phash_index is not None:
+            ocr_processor = PerceptualReuseEngine(ocr_processor, phash_index, logger, scope=ocr_settings["fingerprint"])
+    return ocr_processor
+
+
+def close_ocr_processor():
+    """stops the worker pools of the engine (tesseract runner) - the next get_ocr_processor() creates a new one"""
+    global ocr_processor
+    if ocr_processor is not None:
+        close_engine(ocr_processor)
+        ocr_processor = None
+
+
+def triage_images(jpeg_directory, source_images):
+    if image_triage is None:
+        return source_images
+
+    with metrics.stage("triage"):
+        keep, decisions = image_triage.triage(source_images)
+    image_triage.write_decisions(jpeg_directory, decisions)
+    for decision in decisions:
+        if decision["skip"]:
+            metrics.add(f"images_skipped_{decision['reason']}")
+    if len(keep) < len(source_images):
+        logger.info(f"Triage of {jpeg_directory}: {len(source_images) - len(keep)} of {len(source_images)} images skipped, "
+                    f"see {os.path.join(jpeg_directory, TRIAGE_FILE)}")
+    return keep
+
+
+def jpeg_to_markdown(jpeg_directory, listener=None, document=None):
+    """document: the input file, for the journal and the batch - the images are in jpeg_directory"""
+    global logger
+    source_images = triage_images(jpeg_directory, find_jpeg_images(jpeg_directory))
+
+    if ai_batch is not None:
+        ai_batch.add_requests([(source_image, os.path.splitext(source_image)[0] + '.md') for source_image in source_images],
+                              document=document)
+        return
+
+    processor = get_ocr_processor()
+    jobs = [(source_image, os.path.splitext(source_image)[0] + '.md') for source_image in source_images]
+
+    if journal is not None and document is not None:
+        done_images = journal.done_images(document)
+        if done_images:
+            logger.info(f"Resuming the OCR of {document}: {len(done_images)} of {len(jobs)} images are already done")
+            metrics.add("images_resumed", len(done_images))
+            jobs = [job for job in jobs if job[0] not in done_images]
+
+    def on_done(job, output_file):
+        if journal is not None and document is not None:
+            journal.record_image(document, job[0], output_file)
+        if listener is not None:
+            with open(output_file, "r") as file:
+                listener({"event": "image", "image": job[0], "file": output_file, "markdown": file.read()})
+
+    with metrics.stage("ocr"):
+        output_files = process_jobs(processor, jobs, max_workers=max_in_flight, on_done=on_done)
+
+    metrics.add("images_ocr", len(jobs))
+    metrics.add("bytes_written", sum(os.path.getsize(output_file) for output_file in output_files))
+
+    for (source_image, _), output_file in zip(jobs, output_files):
+        logger.info(f"OCR of {source_image} - result is in {output_file}")
+
+
+def is_supported_file(file_path):
+    return file_path.lower().endswith(('.pdf', '.mhtml', '.mht'))
+
+
+def process_file(file_path, output_folder=None, listener=None, sha256=None):
+    """listener: called with an event dict per written page (PDF), html (MHTML) and image markdown - see conversion_server.py"""
+    if not is_supported_file(file_path):
+        return False
+    if output_folder is None:
+        output_folder = os.path.splitext(os.path.basename(file_path))[0]
+
+    if journal is not None or ai_batch is not None:
+        sha256 = sha256 or file_sha256(file_path)
+
+    progress = {"state": "extracting"}
+    if journal is not None:
+        progress = journal.begin(file_path, sha256, output_folder, resume=resume)
+        if progress["state"] == "done":
+            logger.info(f"Resuming: {file_path} is already done - outputs are in {output_folder}")
+            return True
 
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    if file_path.lower().endswith('.pdf'):
-        pdf_to_html_jpeg(file_path, output_folder)
-    elif file_path.lower().endswith('.mhtml') or file_path.lower().endswith('.mht'):
-        mhtml_to_html_jpeg(file_path, output_folder)
-    else:
+    with metrics.stage("process_file"):
+        if progress["state"] == "extracted":
+            logger.info(f"Resuming {file_path}: the extraction is done, {progress['images']} images have their OCR result")
+        elif file_path.lower().endswith('.pdf'):
+            pdf_to_html_jpeg(file_path, output_folder, listener)
+        else:
+            mhtml_to_html_jpeg(file_path, output_folder, listener)
+        if journal is not None:
+            journal.set_state(file_path, "extracted")
+
+        if ai_batch is not None:
+            ai_batch.add_document(file_path, sha256, output_folder)
+        jpeg_to_markdown(output_folder, listener, document=file_path)
+
+    if journal is not None and ai_batch is None:  # --batch write: done when the results are ingested
+        journal.set_state(file_path, "done")
+    metrics.add("files_processed")
+    return True
+
+
+def reuse_outputs(source_folder, output_folder):
+    shutil.copytree(source_folder, output_folder, dirs_exist_ok=True)
+
+    # the HTML of a PDF is named after its folder
+    source_html = os.path.join(output_folder, f"{os.path.basename(source_folder)}.html")
+    if os.path.exists(source_html) and source_folder != output_folder:
+        os.replace(source_html, os.path.join(output_folder, f"{os.path.basename(output_folder)}.html"))
+
+
+def fingerprint(settings) -> str:
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def ocr_fingerprint(args) -> str:
+    """what decides the OCR answer for an image - the scope of the phash index"""
+    settings = {"engine": args.engine}
+    if args.engine in ("tesseract", "hybrid"):
+        settings.update(min_confidence=args.min_confidence, min_words=args.min_words)
+    if args.engine in ("ai", "hybrid"):
+        settings.update(model=MODEL, max_tokens=MAX_TOKENS, prompt=hashlib.sha256(INSTRUCTIONS.encode("utf-8")).hexdigest(),
+                        upload=upload_optimizer.signature() if upload_optimizer is not None else None)
+    return fingerprint(settings)
+
+
+def settings_fingerprint(args) -> str:
+    """what decides the content of the outputs - a manifest entry recorded with other settings is redone"""
+    settings = {"ocr": ocr_fingerprint(args), "html_backend": args.html_backend, "triage": not args.no_triage}
+    if args.triage_overrides:
+        settings["triage_overrides"] = file_sha256(args.triage_overrides)
+    return fingerprint(settings)
+
+
+def process_file_incremental(file_path):
+    """process_file, but skips unchanged files and copies the outputs of byte identical files - uses the manifest"""
+    if not is_supported_file(file_path):
         return False
 
-    jpeg_to_markdown(output_folder)
+    status, sha256, entry = manifest.check(file_path)
+    metrics.add(f"files_{status}")
+    if status == "unchanged":
+        logger.info(f"Skipping unchanged {file_path} - outputs are in {entry['output_folder']}")
+        return True
+
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    output_folder = manifest.claim_output_folder(file_path, base_name)
+
+    resuming = resume and journal is not None and journal.started(file_path, sha256)
+    if status in ("modified", "reconfigured") and entry["output_folder"] == output_folder and os.path.isdir(output_folder) and not resuming:
+        shutil.rmtree(output_folder)  # no stale images or markdown from the previous version
+
+    if status == "duplicate":
+        logger.info(f"{file_path} is identical to {entry['path']} - reusing the outputs in {entry['output_folder']}")
+        reuse_outputs(entry["output_folder"], output_folder)
+    else:
+        logger.info(f"Processing {status} file {file_path} into {output_folder}")
+        process_file(file_path, output_folder, sha256=sha256)
+
+    if ai_batch is None:  # --batch write: recorded when the results are ingested, see record_ingested_documents()
+        manifest.record(file_path, sha256, output_folder)
     return True
 
 
+def record_ingested_documents(batch):
+    """the documents whose batch answers are all written are done now - not at write time, so a failed request is retried"""
+    for document in batch.completed_documents():
+        if not os.path.exists(document["path"]):
+            continue
+        if journal is not None:
+            for source_image, result_file in document["results"]:
+                journal.record_image(document["path"], source_image, result_file)
+            journal.set_state(document["path"], "done")
+        if manifest is not None:
+            manifest.record(document["path"], document["sha256"], document["output_folder"])
+        logger.info(f"{document['path']} is complete, {len(document['results'])} batch results")
+
+
+def process_any_file(file_path):
+    if manifest is None:
+        return process_file(file_path)
+    return process_file_incremental(file_path)
+
+
 def process_directory(path):
     unprocessed_files = []
-    for file in os.listdir(path):
-        file_path = os.path.join(path, file)
-
-        if not os.path.isfile(file_path):
-            continue  # do not collect subfolders in unprocessed ... it's expected. NEXT
-        
-        if not process_file(file_path):
-            unprocessed_files.append(file_path)  # save to be able to inform user (last)
+    file_paths = [os.path.join(path, file) for file in os.listdir(path)]
+    file_paths = file_order.order([file_path for file_path in file_paths if os.path.isfile(file_path)])  # subfolders are expected, not unprocessed
+
+    for index, file_path in enumerate(file_paths):
+        try:
+            if not process_any_file(file_path):
+                unprocessed_files.append(file_path)  # save to be able to inform user (last)
+        except BudgetExhausted as e:
+            # the images done so far have their .md files, the rest of this file and the files after it are left
+            logger.warning(f"{e} - stopping before {file_path}, {len(file_paths) - index} files left")
+            budget.checkpoint(file_paths[:index], file_paths[index:])
+            return
+        if budget is not None:
+            budget.checkpoint(file_paths[:index + 1], file_paths[index + 1:])
+        if metrics_file:
+            metrics.write_prometheus(metrics_file)  # long runs can be scraped while they are running
 
     if not unprocessed_files:
         return
@@ -93,25 +344,340 @@ def process_directory(path):
         logger.info(file)
 
 
-def main() -> None:
-    global logger 
+def shared_output_folder(file_path, file_paths, output_dir):
+    """<output_dir>/<base name>, the same on every worker - with the extension when another document has the same base name"""
+    file_name = os.path.basename(file_path)
+    base_name, extension = os.path.splitext(file_name)
+    same_base = [os.path.basename(other) for other in file_paths if os.path.splitext(os.path.basename(other))[0] == base_name]
+    if len(same_base) > 1:
+        folder_name = f"{base_name}_{extension.lstrip('.').lower()}"
+        if sum(os.path.splitext(other)[1].lower() == extension.lower() for other in same_base) > 1:
+            # doc1.pdf and doc1.PDF - one folder on a case insensitive share, the name hash tells them apart
+            folder_name += "_" + hashlib.sha1(file_name.encode("utf-8")).hexdigest()[:8]
+        base_name = folder_name
+    return os.path.join(output_dir, base_name)
+
+
+def process_shared_directory(path, leases, output_dir):
+    """one of N workers on the same folder: every document is claimed with a lease, the first worker to claim it does it"""
+    file_paths = [os.path.join(path, file) for file in os.listdir(path)]
+    file_paths = file_order.order([file_path for file_path in file_paths if os.path.isfile(file_path) and is_supported_file(file_path)])
+    tried = set()  # a document that failed here is left to the other workers
+
+    while True:
+        pending = [file_path for file_path in file_paths if file_path not in tried and not leases.is_done(file_path)]
+        if not pending:
+            break
+
+        claimed = 0
+        for file_path in pending:
+            if not leases.claim(file_path):
+                continue  # done or being done by another worker
+            claimed += 1
+            tried.add(file_path)
+            output_folder = shared_output_folder(file_path, file_paths, output_dir)
+            logger.info(f"Worker {leases.worker_id} claimed {file_path}, outputs go to {output_folder}")
+            try:
+                process_file(file_path, output_folder)
+                leases.complete(file_path, output_folder)
+            except BudgetExhausted as e:
+                leases.release(file_path)
+                logger.warning(f"{e} - stopping before {file_path}, the other workers go on")
+                return
+            except Exception:  # one broken file must not stop the worker
+                logger.exception(f"Failed to process {file_path}")
+                metrics.add("files_failed")
+                leases.release(file_path)
+            if metrics_file:
+                metrics.write_prometheus(metrics_file)
+
+        if not claimed:
+            # the rest is leased by other workers - wait until they are done, or their leases expire when they died
+            logger.info(f"{len(pending)} documents are being processed by other workers, waiting")
+            time.sleep(min(5.0, leases.lease_seconds / 4))
+
+
+def watch_directories(folders, settle_seconds, poll_interval, use_inotify):
+    """processes new and changed files until SIGINT/SIGTERM - the OCR engine, caches and pools stay warm in between"""
+    get_ocr_processor()  # connect and start the workers now, not when the first file arrives
+    watcher = FolderWatcher(folders, logger, settle_seconds=settle_seconds, poll_interval=poll_interval,
+                            use_inotify=use_inotify, accept=is_supported_file)
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: watcher.stop())
+
+    for file_path in watcher.events():
+        logger.info(f"Picked up {file_path}")
+        start = time.perf_counter()
+        try:
+            process_any_file(file_path)
+        except BudgetExhausted as e:
+            logger.warning(f"{e} - {file_path} is not complete, stopping the watch")
+            break
+        except Exception:  # one broken file must not stop the daemon, the manifest retries it when it changes
+            logger.exception(f"Failed to process {file_path}")
+            metrics.add("files_failed")
+        logger.info(f"Done with {file_path} in {time.perf_counter() - start:.1f}s")
+        if metrics_file:
+            metrics.write_prometheus(metrics_file)
+
+
+def write_run_report(report_path):
+    if budget is not None:
+        metrics.set_info("budget", budget.summary())
+    if ai_cache is not None:
+        metrics.set_info("ai_cache", ai_cache.stats())
+    engine = getattr(ocr_processor, "engine", ocr_processor)  # inside the PerceptualReuseEngine
+    if isinstance(engine, HybridOCRRouter):
+        metrics.set_info("images_per_engine", engine.report())
+    if isinstance(ocr_processor, PerceptualReuseEngine):
+        metrics.add("images_phash_reused", ocr_processor.reused)
+
+    if report_path:
+        metrics.write_json(report_path)
+        logger.info(f"Run report written to {report_path}")
+    if metrics_file:
+        metrics.write_prometheus(metrics_file)
+
+
+def init_logger() -> logging.Logger:
+    global logger
     load_dotenv()  # Load variables from .env file
 
     # init setup logging - read level from .env. Level "warning" is fallback
     log_level_str = os.getenv('LOG_LEVEL', 'WARNING').upper()
     log_level = getattr(logging, log_level_str, logging.WARNING)
     logger = setup_logger(log_level)
+    return logger
 
-    # parse arguments, there is a default file set
-    parser = argparse.ArgumentParser(description="Convert PDF or MHTML to HTML with extracted images.")
+
+def build_parser(description="Convert PDF or MHTML to HTML with extracted images.") -> argparse.ArgumentParser:
+    """the options of a run - conversion_server.py adds its own to the same parser"""
+    parser = argparse.ArgumentParser(description=description)
     parser.add_argument("--pdf", help="Path to the PDF file.")
     parser.add_argument("--path", help="Path to the directory containing PDF or MHTML files.")
-    args = parser.parse_args()
+    parser.add_argument("--watch", nargs="+", metavar="DIR",
+                        help="Keep running and process new or changed PDF/MHTML files in these folders as they arrive.")
+    parser.add_argument("--settle-seconds", type=float, default=float(os.getenv('WATCH_SETTLE_SECONDS', 0.5)),
+                        help="--watch: a file is processed when its size and mtime did not change for this long.")
+    parser.add_argument("--poll-interval", type=float, default=float(os.getenv('WATCH_POLL_INTERVAL', 1.0)),
+                        help="--watch: seconds between scans when inotify is not available.")
+    parser.add_argument("--no-inotify", action="store_true", help="--watch: always poll, e.g. for network shares.")
+    parser.add_argument("--max-in-flight", type=int, default=int(os.getenv('AI_MAX_IN_FLIGHT', max_in_flight)),
+                        help="Max number of concurrent AI requests (env AI_MAX_IN_FLIGHT). 1 = sequential.")
+    parser.add_argument("--cache-dir", default=os.getenv('AI_CACHE_DIR', '.ai_cache'),
+                        help="Folder for the persistent AI result cache (env AI_CACHE_DIR).")
+    parser.add_argument("--cache-max-mb", type=int, default=int(os.getenv('AI_CACHE_MAX_MB', 500)),
+                        help="Max size of the AI result cache in MB, least recently used entries are evicted first.")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the AI, do not read or write the cache.")
+    parser.add_argument("--pdf-workers", type=int, default=int(os.getenv('PDF_WORKERS', pdf_workers)),
+                        help="Number of processes extracting PDF pages (env PDF_WORKERS). 1 = serial.")
+    parser.add_argument("--max-edge", type=int, default=int(os.getenv('AI_MAX_EDGE', 2048)),
+                        help="Downscale larger images to this longest edge before upload (env AI_MAX_EDGE), 0 = send the "
+                             "original file. This saves upload bytes, not tokens: with detail high the API scales every "
+                             "image to 2048 and the short side to 768 itself. Tokens only drop when the short side ends "
+                             "below 768, e.g. 1024 for 16:9 screenshots (1105 -> 765), at the cost of smaller text.")
+    parser.add_argument("--detail", choices=["low", "high", "auto"], default=os.getenv('AI_DETAIL'),
+                        help="The image detail level sent to the model (env AI_DETAIL). Default: the API default.")
+    parser.add_argument("--webp", action="store_true", default=os.getenv('AI_WEBP', '').lower() in ("1", "true", "yes"),
+                        help="Send downscaled photo like images as WebP instead of JPEG (env AI_WEBP).")
+    parser.add_argument("--batch", choices=["write", "submit", "fetch", "ingest"],
+                        help="OpenAI Batch API mode: write requests to --batch-file instead of calling the AI, "
+                             "submit the file, fetch the results or ingest them into .md files. Cached images are "
+                             "written from the AI result cache and not sent again.")
+    parser.add_argument("--batch-file", default="ocr_batch.jsonl",
+                        help="The Batch API request file, see --batch. Continued in ocr_batch.2.jsonl ... after 50 000 "
+                             "requests or 200 MB, every file is its own batch.")
+    parser.add_argument("--batch-results", help="Result JSONL to ingest. Default: the files downloaded by --batch fetch.")
+    parser.add_argument("--manifest", default=os.getenv('OCR_MANIFEST', '.ocr_manifest.sqlite'),
+                        help="Manifest of processed files (env OCR_MANIFEST), unchanged files are skipped on the next run.")
+    parser.add_argument("--force", action="store_true", help="Process every file, do not use the manifest.")
+    parser.add_argument("--journal", default=os.getenv('OCR_JOURNAL', '.ocr_journal.sqlite'),
+                        help="Journal of the extracted pages and OCR'd images of every document (env OCR_JOURNAL), "
+                             "see --resume. Empty = no journal.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the documents of an interrupted run at the first page that was not extracted "
+                             "and the first image without an OCR result, instead of starting them over.")
+    parser.add_argument("--html-backend", choices=HTML_BACKENDS, default=os.getenv('MHTML_HTML_BACKEND', html_backend),
+                        help="How the body of MHTML html parts is extracted (env MHTML_HTML_BACKEND). slice is the fastest.")
+    parser.add_argument("--engine", choices=ENGINE_NAMES, default=os.getenv('OCR_ENGINE', ocr_settings["engine"]),
+                        help="ai: every image to the AI. tesseract: local only. "
+                             "hybrid: Tesseract first, the AI only when Tesseract is unsure. "
+                             "fake: deterministic local stub for tests (env OCR_ENGINE).")
+    parser.add_argument("--tesseract-workers", type=int, default=int(os.getenv('TESSERACT_WORKERS', ocr_settings["tesseract_workers"])),
+                        help="Parallel tesseract processes, each handling a batch of images (env TESSERACT_WORKERS). "
+                             "0 = one pytesseract call per image.")
+    parser.add_argument("--min-confidence", type=float, default=float(os.getenv('OCR_MIN_CONFIDENCE', ocr_settings["min_confidence"])),
+                        help="hybrid: images with a lower mean Tesseract word confidence (0-100) go to the AI.")
+    parser.add_argument("--min-words", type=int, default=int(os.getenv('OCR_MIN_WORDS', ocr_settings["min_words"])),
+                        help="hybrid: images where Tesseract finds fewer words go to the AI.")
+    parser.add_argument("--report", default=os.getenv('RUN_REPORT', 'run_report.json'),
+                        help="JSON report of the run: time per stage, bytes, images, API latency, tokens, cache hits "
+                             "(env RUN_REPORT). Empty = no report.")
+    parser.add_argument("--metrics-file", default=os.getenv('OCR_METRICS_FILE'),
+                        help="Also write the metrics in Prometheus text format to this file, after every file "
+                             "(env OCR_METRICS_FILE) - e.g. for the node exporter textfile collector.")
+    parser.add_argument("--rpm", type=float, default=os.getenv('AI_RPM'),
+                        help="Max AI requests per minute (env AI_RPM). Default: no limit, only retries on 429.")
+    parser.add_argument("--tpm", type=float, default=os.getenv('AI_TPM'),
+                        help="Max AI tokens per minute (env AI_TPM). Default: no limit, only retries on 429.")
+    parser.add_argument("--max-retries", type=int, default=int(os.getenv('AI_MAX_RETRIES', 6)),
+                        help="Retries of a throttled (429) or failed (5xx, connection) AI request, with exponential backoff.")
+    parser.add_argument("--no-triage", action="store_true", help="Send every image to OCR, also tiny, blank and decorative ones.")
+    parser.add_argument("--triage-overrides", default=os.getenv('OCR_TRIAGE_OVERRIDES'),
+                        help="File with 'ocr <pattern>' and 'skip <pattern>' lines that win over the triage scores "
+                             "(env OCR_TRIAGE_OVERRIDES).")
+    parser.add_argument("--phash-index", default=os.getenv('OCR_PHASH_INDEX'),
+                        help="Reuse OCR results of near duplicate images (recompressed, rescaled), with an index of the "
+                             "perceptual hashes of processed images in this file (env OCR_PHASH_INDEX). Default: off.")
+    parser.add_argument("--phash-distance", type=int, default=int(os.getenv('OCR_PHASH_DISTANCE', 6)),
+                        help="Max Hamming distance (of 64 bits) between near duplicates. 0 = identical hashes only.")
+    parser.add_argument("--phash-pixel-difference", type=int, default=int(os.getenv('OCR_PHASH_PIXEL_DIFFERENCE', 32)),
+                        help="A near duplicate is only reused when no pixel (gray 0-255, lightly blurred) differs by "
+                             "more than this from the original - the hash alone does not see changed text.")
+    parser.add_argument("--no-phash", action="store_true", help="Do not reuse OCR results of near duplicate images, also when OCR_PHASH_INDEX is set.")
+    parser.add_argument("--budget-tokens", type=int, default=os.getenv('AI_BUDGET_TOKENS'),
+                        help="Stop the run cleanly before the AI tokens (prompt + completion) go above this (env AI_BUDGET_TOKENS).")
+    parser.add_argument("--budget-cost", type=float, default=os.getenv('AI_BUDGET_COST'),
+                        help="Stop the run cleanly before the AI cost goes above this, see --price-prompt (env AI_BUDGET_COST).")
+    parser.add_argument("--price-prompt", type=float, default=float(os.getenv('AI_PRICE_PROMPT', 2.50)),
+                        help="Price per 1M prompt tokens (env AI_PRICE_PROMPT).")
+    parser.add_argument("--price-completion", type=float, default=float(os.getenv('AI_PRICE_COMPLETION', 10.00)),
+                        help="Price per 1M completion tokens (env AI_PRICE_COMPLETION).")
+    parser.add_argument("--budget-checkpoint", default=os.getenv('AI_BUDGET_CHECKPOINT', 'budget_checkpoint.json'),
+                        help="With a budget: the spend and the files left are saved here after every file.")
+    parser.add_argument("--budget-resume", action="store_true",
+                        help="Start with the spend saved in --budget-checkpoint instead of at zero, e.g. a monthly "
+                             "budget over several runs.")
+    parser.add_argument("--order", choices=ORDER_POLICIES, default=os.getenv('OCR_ORDER', 'name'),
+                        help="Order of the files in --path: name, smallest first, newest first or --priority-file first.")
+    parser.add_argument("--priority-file", help="--order priority: file with one file name or glob pattern per line.")
+    parser.add_argument("--lease-dir", default=os.getenv('OCR_LEASE_DIR'),
+                        help="Share --path with other workers, on this host or others that mount the same folders: every "
+                             "document is claimed with a lease file in this folder (env OCR_LEASE_DIR).")
+    parser.add_argument("--output-dir", default=os.getenv('OCR_OUTPUT_DIR', '.'),
+                        help="--lease-dir: the folder for the output folders of all workers, on the same share (env OCR_OUTPUT_DIR).")
+    parser.add_argument("--worker-id", default=os.getenv('OCR_WORKER_ID'),
+                        help="--lease-dir: the name of this worker in the leases and in its own journal and phash index files, "
+                             "give it a stable one to keep them across runs. Default: <host name>-<pid>, without them.")
+    parser.add_argument("--lease-seconds", type=float, default=float(os.getenv('OCR_LEASE_SECONDS', 300)),
+                        help="--lease-dir: a lease that was not renewed for this long belongs to a dead worker and is taken "
+                             "over. Must be well above the clock difference between the hosts.")
+    return parser
+
+
+def worker_state_file(path, worker_id):
+    """.ocr_phash.sqlite -> .ocr_phash_<worker_id>.sqlite - SQLite files are not shared between --lease-dir workers"""
+    root, extension = os.path.splitext(path)
+    return f"{root}_{worker_id}{extension}"
+
+
+def configure(args) -> None:
+    """creates the shared state of the run (engine settings, caches, manifest, limiter, budget) from the arguments"""
+    global max_in_flight, ai_cache, pdf_workers, upload_optimizer, manifest, html_backend, metrics_file, budget, rate_limiter, \
+           image_triage, phash_index, journal, resume, file_order
+    metrics_file = args.metrics_file
+    max_in_flight = args.max_in_flight
+    ocr_settings.update(engine=args.engine, min_confidence=args.min_confidence, min_words=args.min_words,
+                        tesseract_workers=args.tesseract_workers)
+    html_backend = args.html_backend
+    pdf_workers = args.pdf_workers
+
+    if args.max_edge or args.detail or args.webp:
+        upload_optimizer = ImageUploadOptimizer(max_edge=args.max_edge, detail=args.detail, use_webp=args.webp)
+
+    # the concurrency starts at --max-in-flight, is halved on throttling and grows back while the API is healthy
+    rate_limiter = RateLimiter(requests_per_minute=args.rpm, tokens_per_minute=args.tpm, max_in_flight=max_in_flight,
+                               max_retries=args.max_retries, metrics=metrics)
+
+    if not args.no_triage:
+        overrides = ImageTriage.load_overrides(args.triage_overrides) if args.triage_overrides else None
+        image_triage = ImageTriage(logger, overrides=overrides)
+
+    ocr_settings["fingerprint"] = ocr_fingerprint(args)
+    # --lease-dir workers may share the cwd on NFS/SMB, where SQLite locking is not reliable: every worker gets
+    # its own journal and phash index, kept across runs with a stable --worker-id and left out without one
+    phash_path, journal_path = args.phash_index, args.journal
+    if args.lease_dir:
+        phash_path = worker_state_file(phash_path, args.worker_id) if args.worker_id and phash_path else None
+        journal_path = worker_state_file(journal_path, args.worker_id) if args.worker_id and journal_path else None
+        if not args.worker_id:
+            logger.info("--lease-dir without --worker-id: no phash index and no journal for this worker")
+
+    if not args.no_phash and phash_path:
+        phash_index = PerceptualHashIndex(phash_path, max_distance=args.phash_distance,
+                                          max_pixel_difference=args.phash_pixel_difference)
+
+    if not args.no_cache:
+        ai_cache = AIResultCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+
+    if not args.force and not args.lease_dir:  # the leases' .done files are the manifest of a shared run
+        manifest = ProcessingManifest(args.manifest, settings=settings_fingerprint(args))
+
+    if args.resume and not journal_path:
+        raise ValueError("--resume needs the --journal of the interrupted run (and a --worker-id with --lease-dir).")
+    if journal_path:
+        journal = JobJournal(journal_path)
+    resume = args.resume
+
+    priorities = None
+    if args.priority_file:
+        with open(args.priority_file, "r", encoding="utf-8") as f:
+            priorities = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    file_order = FileOrder(args.order, priorities)
+    if args.budget_tokens is not None or args.budget_cost is not None:
+        budget = BudgetScheduler(max_tokens=args.budget_tokens, max_cost=args.budget_cost, price_prompt=args.price_prompt,
+                                 price_completion=args.price_completion, checkpoint_path=args.budget_checkpoint,
+                                 resume=args.budget_resume)
+    elif args.budget_resume:
+        raise ValueError("--budget-resume continues the spend of a --budget-tokens or --budget-cost run, give the budget too.")
 
+
+def main() -> None:
+    init_logger()
+
+    # parse arguments, there is a default file set
+    args = build_parser().parse_args()
+    configure(args)
+    try:
+        run(args)
+    finally:
+        close_ocr_processor()
+
+
+def run(args) -> None:
+    global ai_batch
     logger.info(f"Current working dir is: {os.getcwd()}")
 
+    if args.batch:
+        processor = AIImageProcessor(cache=ai_cache, optimizer=upload_optimizer, connect=args.batch in ("submit", "fetch"))
+        batch = AIBatch(processor, args.batch_file, logger)
+        if args.batch == "submit":
+            batch.submit()
+            return
+        if args.batch == "fetch":
+            logger.warning(f"Batch status: {', '.join(batch.fetch())}")
+            return
+        if args.batch == "ingest":
+            failed = batch.ingest_results(args.batch_results)
+            record_ingested_documents(batch)
+            if failed:
+                logger.warning(f"{len(failed)} requests had no usable answer: {failed}")
+            return
+        ai_batch = batch  # "write" - run the extraction as usual, the images are collected in the batch file
+
     if args.pdf and args.path:
         raise ValueError("Both --pdf and --path cannot be specified at the same time.")
+    if args.pdf and args.lease_dir:
+        raise ValueError("--lease-dir shares the documents of a --path between workers, not a single --pdf.")
+
+    if args.watch:
+        metrics.set_info("engine", args.engine)
+        metrics.set_info("watch", args.watch)
+        try:
+            watch_directories(args.watch, args.settle_seconds, args.poll_interval, not args.no_inotify)
+        finally:
+            write_run_report(args.report)
+        return
 
     if not args.path:
         args.path = 'Handdatorer'
@@ -120,13 +686,39 @@ def main() -> None:
         logger.error("Either --pdf or --path must be specified.")
         return
 
-    if args.path:
-        debug = f"{os.path.join(os.getcwd(), args.path)}"
-        logger.info(f"Processing {debug}")
-        process_directory(args.path)
+    metrics.set_info("engine", args.engine)
+    metrics.set_info("path", args.pdf or args.path)
+    if args.lease_dir:
+        leases = WorkLeases(args.lease_dir, logger, worker_id=args.worker_id, lease_seconds=args.lease_seconds, metrics=metrics)
+        metrics.set_info("worker", leases.worker_id)
+        report_root, report_extension = os.path.splitext(args.report)
+        try:
+            process_shared_directory(args.path, leases, args.output_dir)
+        finally:
+            leases.close()
+            write_run_report(f"{report_root}_{leases.worker_id}{report_extension}" if args.report else None)  # one per worker
         return
 
-    process_file(args.pdf)
+    try:
+        if args.path:
+            debug = f"{os.path.join(os.getcwd(), args.path)}"
+            logger.info(f"Processing {debug}")
+            process_directory(args.path)
+        else:
+            try:
+                process_any_file(args.pdf)
+            except BudgetExhausted as e:
+                logger.warning(f"{e} - {args.pdf} is not complete")
+    finally:
+        write_run_report(args.report)  # also after a failure, to see how far it got
+
+    if ai_cache is not None:
+        logger.info(f"AI result cache: {ai_cache.stats()}")
+    engine = getattr(ocr_processor, "engine", ocr_processor)
+    if isinstance(engine, HybridOCRRouter):
+        logger.info(f"Images handled per OCR engine: {engine.report()}")
+    if isinstance(ocr_processor, PerceptualReuseEngine):
+        logger.info(f"OCR results reused from near duplicate images: {ocr_processor.reused}")
 
 
 if __name__ == "__main__":
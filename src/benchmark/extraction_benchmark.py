@@ -0,0 +1,206 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+import fitz  # PyMuPDF
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from classes.pdf_to_text_and_images import PDFToTextAndImages, _TextLineIndex
+from classes.mhtml_to_text_and_images import MHTMLToTextAndImages, HTML_BACKENDS, lxml
+
+"""
+Micro benchmarks of the extraction hot paths, every stage timed on its own:
+- text_dict:     page.get_text("dict")
+- span_merge:    _extract_text_elements_from_page over the text blocks
+- image_extract: _extract_image_elements_from_page, decoding and writing the images
+- vector_detect: page.get_drawings(), the vector graphics of every page
+- vector_export: _extract_vector_elements_from_page, the pipeline's SVG export, once per page with
+                 drawings. get_text("dict") returns text (0) and image (1) blocks only, so the
+                 pipeline itself never reaches it today - the benchmark builds the type 2 block from
+                 the drawings (their bbox) to time what the export would cost. The synthetic PDF has
+                 --drawings table lines per page, a fixture without drawings skips both stages
+- html_write:    generate_html
+- mhtml_convert: MHTMLToTextAndImages.convert, per html backend
+
+Fixtures are synthetic PDFs and MHTML archives of configurable scale, plus the shipped
+images/test1.pdf. The results go to a JSON file (with the git commit) so runs on different
+commits can be compared.
+
+usage (from src/):
+    python benchmark/extraction_benchmark.py --pages 50 --spans 400 --images 3 --image-size 800 --drawings 20 --out bench.json
+"""
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "images", "test1.pdf")
+
+
+def make_image_bytes(size, seed, image_format="PNG"):
+    random.seed(seed)
+    image = Image.new("RGB", (size, size * 3 // 4), (255, 255, 255))
+    # a screenshot like image: a few flat rectangles, compresses like real UI captures
+    for _ in range(12):
+        x0, y0 = random.randrange(size), random.randrange(size * 3 // 4)
+        color = tuple(random.randrange(256) for _ in range(3))
+        image.paste(color, (x0, y0, min(size, x0 + size // 4), min(size * 3 // 4, y0 + size // 8)))
+    buffer = io.BytesIO()
+    image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def build_pdf(path, pages, spans, images, image_size, drawings):
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page(width=595, height=842)
+        lines = max(1, spans // 4)
+        for line in range(lines):
+            y = 40 + (line * 760 / lines)
+            for column in range(4):
+                page.insert_text((40 + column * 130, y), f"span {page_num}.{line}.{column}", fontsize=6)
+        for image_num in range(images):
+            image_bytes = make_image_bytes(image_size, seed=page_num * 100 + image_num)
+            top = 100 + image_num * 200
+            page.insert_image(fitz.Rect(300, top, 550, top + 180), stream=image_bytes)
+        # a frame and the grid of a table, like the ruled tables of exported manuals
+        page.draw_rect(fitz.Rect(30, 30, 565, 812), color=(0, 0, 0))
+        for line in range(max(0, drawings - 1)):
+            y = 40 + line * 760 / max(1, drawings - 1)
+            page.draw_line(fitz.Point(30, y), fitz.Point(565, y), color=(0.5, 0.5, 0.5))
+    doc.save(path)
+
+
+def build_mhtml(path, images, image_size, paragraphs):
+    message = MIMEMultipart("related", type="text/html")
+    body = "".join(f'<p>Paragraph {i} with some text to parse.</p><img src="cid:image{i % max(1, images)}">' for i in range(paragraphs))
+    message.attach(MIMEText(f"<html><head><title>bench</title></head><body>{body}</body></html>", "html", "utf-8"))
+    for image_num in range(images):
+        part = MIMEImage(make_image_bytes(image_size, seed=image_num), "png")
+        part.add_header("Content-ID", f"<image{image_num}>")
+        part.add_header("Content-Location", f"https://intranet/images/image{image_num}.png")
+        message.attach(part)
+    with open(path, "wb") as f:
+        f.write(message.as_bytes())
+
+
+def timed(results, fixture, stage, units, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    results.append({"fixture": fixture, "stage": stage, "seconds": seconds, "units": units,
+                    "per_unit_ms": seconds * 1000 / units if units else None})
+    return result
+
+
+def benchmark_pdf(results, fixture, pdf_path, work_dir):
+    converter = PDFToTextAndImages(logging.getLogger("extraction_benchmark"))
+    output_folder = os.path.join(work_dir, f"{fixture}_out")
+    os.makedirs(output_folder)
+    doc = fitz.open(pdf_path)
+    pages = [doc.load_page(page_num) for page_num in range(len(doc))]
+
+    page_dicts = timed(results, fixture, "text_dict", len(pages), lambda: [page.get_text("dict") for page in pages])
+
+    def merge_spans():
+        pages_elements = []
+        for page_dict in page_dicts:
+            elements = []
+            line_index = _TextLineIndex(2)
+            for block in page_dict["blocks"]:
+                if block["type"] == 0:
+                    converter._extract_text_elements_from_page(block, elements, line_index)
+            pages_elements.append(elements)
+        return pages_elements
+    span_count = sum(len(line["spans"]) for page_dict in page_dicts for block in page_dict["blocks"]
+                     if block["type"] == 0 for line in block["lines"])
+    pages_elements = timed(results, fixture, "span_merge", span_count, merge_spans)
+
+    image_owners = converter._find_image_owners(doc)
+    def extract_images():
+        for page_num, page in enumerate(pages):
+            converter._extract_image_elements_from_page(doc, page, page_num, output_folder, pages_elements[page_num], image_owners)
+    timed(results, fixture, "image_extract", len(image_owners), extract_images)
+
+    page_drawings = timed(results, fixture, "vector_detect", len(pages), lambda: [page.get_drawings() for page in pages])
+    vector_blocks = []
+    for page_num, drawings in enumerate(page_drawings):
+        if drawings:
+            bbox = fitz.Rect(drawings[0]["rect"])
+            for drawing in drawings[1:]:
+                bbox |= drawing["rect"]
+            vector_blocks.append((page_num, {"number": len(page_dicts[page_num]["blocks"]), "type": 2, "bbox": tuple(bbox)}))
+    if vector_blocks:
+        timed(results, fixture, "vector_export", len(vector_blocks), lambda: [
+            converter._extract_vector_elements_from_page(pages[page_num], block, page_num, output_folder, pages_elements[page_num])
+            for page_num, block in vector_blocks])
+    else:
+        results.pop()  # no drawings: nothing to compare between runs
+
+    for elements in pages_elements:
+        elements.sort(key=lambda element: element["bbox"][1])
+    timed(results, fixture, "html_write", len(pages), converter.generate_html, pages_elements,
+          os.path.join(output_folder, "output.html"))
+    doc.close()
+
+
+def benchmark_mhtml(results, fixture, mhtml_path, work_dir):
+    for backend in HTML_BACKENDS:
+        if backend == "lxml" and lxml is None:
+            continue
+        converter = MHTMLToTextAndImages(logging.getLogger("extraction_benchmark"), html_backend=backend)
+        output_folder = os.path.join(work_dir, f"{fixture}_{backend}_out")
+        size_mb = os.path.getsize(mhtml_path) / 1e6
+        timed(results, fixture, f"mhtml_convert[{backend}]", size_mb, converter.convert, mhtml_path, output_folder)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro benchmarks of the PDF and MHTML extraction stages.")
+    parser.add_argument("--pages", type=int, default=50, help="Pages in the synthetic PDF.")
+    parser.add_argument("--spans", type=int, default=400, help="Text spans per page.")
+    parser.add_argument("--images", type=int, default=3, help="Images per page (and in the synthetic MHTML).")
+    parser.add_argument("--image-size", type=int, default=800, help="Width in pixels of the synthetic images.")
+    parser.add_argument("--drawings", type=int, default=20, help="Vector lines per page of the synthetic PDF.")
+    parser.add_argument("--paragraphs", type=int, default=20000, help="Paragraphs in the synthetic MHTML html part.")
+    parser.add_argument("--out", default="extraction_benchmark.json", help="Where the JSON results are written.")
+    args = parser.parse_args()
+
+    logging.getLogger("extraction_benchmark").setLevel(logging.ERROR)  # the SVG export warns on every call
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="extraction_benchmark_")
+    try:
+        synthetic_pdf = os.path.join(work_dir, "synthetic.pdf")
+        build_pdf(synthetic_pdf, args.pages, args.spans, args.images, args.image_size, args.drawings)
+        benchmark_pdf(results, "synthetic_pdf", synthetic_pdf, work_dir)
+        benchmark_pdf(results, "test1_pdf", SAMPLE_PDF, work_dir)
+
+        synthetic_mhtml = os.path.join(work_dir, "synthetic.mhtml")
+        build_mhtml(synthetic_mhtml, args.images * 10, args.image_size, args.paragraphs)
+        benchmark_mhtml(results, "synthetic_mhtml", synthetic_mhtml, work_dir)
+    finally:
+        shutil.rmtree(work_dir)
+
+    for result in results:
+        per_unit = f"{result['per_unit_ms']:10.3f} ms/unit" if result["per_unit_ms"] is not None else ""
+        print(f"{result['fixture']:16s} {result['stage']:28s} {result['seconds'] * 1000:10.1f} ms  {per_unit}")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"commit": git_commit(), "timestamp": time.time(), "config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import io
+import os
+import sys
+import time
+import shutil
+import argparse
+import logging
+import tempfile
+from email import policy
+from email.parser import BytesParser
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from classes.mhtml_to_text_and_images import MHTMLToTextAndImages, HTML_BACKENDS, lxml
+
+"""
+Benchmark of the html body extraction backends in MHTMLToTextAndImages.
+
+The html part of the example MHTML is scaled up by repeating its body --scale times, then
+every backend extracts the body and rewrites the image references. A full convert() of the
+original archive is timed per backend as well.
+
+Before timing, the streamed decoding of the archive is checked against the email package
+(BytesParser, what the converter used before): the same html parts and the same image files.
+
+usage (from src/):
+    python benchmark/mhtml_backend_benchmark.py --scale 50
+"""
+
+DEFAULT_MHTML = "../exempel/handheld/Instruktion återställning av Wi-Fi, mobildata och Bluetooth på modell EDA52.mhtml"
+
+
+def load_example(mhtml_path, converter):
+    with open(mhtml_path, "rb") as mhtml_file:
+        message = BytesParser(policy=policy.default).parse(mhtml_file)
+
+    html_part, local_names = None, {}
+    for part in message.walk():
+        if part.get_content_type() == "text/html" and html_part is None:
+            html_part = part.get_payload(decode=True).decode()
+        elif part.get_content_type().startswith("image/"):
+            converter._add_local_names(part, converter._get_identifier(part) or "image", local_names)
+    return html_part, local_names
+
+
+def check_against_email_parser(mhtml_path, converter, work_dir):
+    """raises AssertionError if the streamed html parts or images differ from the email package's"""
+    with open(mhtml_path, "rb") as mhtml_file:
+        message = BytesParser(policy=policy.default).parse(mhtml_file)
+    expected_html, expected_images = [], {}
+    for part in message.walk():
+        content_type = part.get_content_type()
+        if content_type == "text/html":
+            expected_html.append(part.get_payload(decode=True).decode())
+        elif content_type.startswith("image/") and converter._get_identifier(part):
+            expected_images[len(expected_images)] = (content_type, part.get_payload(decode=True))
+
+    folder_name = os.path.join(work_dir, "check")
+    os.makedirs(folder_name)
+    with open(mhtml_path, "rb") as mhtml_file:
+        html_parts, resources, _ = converter._decode_parts(mhtml_file, folder_name)
+
+    assert html_parts == expected_html, "the html parts differ from the email package's"
+    assert len(resources) == len(expected_images), f"{len(resources)} images instead of {len(expected_images)}"
+    for index, image_name in enumerate(resources):
+        content_type, payload = expected_images[index]
+        if content_type != "image/jpeg":
+            buffer = io.BytesIO()
+            Image.open(io.BytesIO(payload)).convert('RGB').save(buffer, 'JPEG')
+            payload = buffer.getvalue()
+        with open(os.path.join(folder_name, image_name), "rb") as image_file:
+            assert image_file.read() == payload, f"{image_name} differs from the email package's"
+    print(f"streamed decoding = email package: {len(html_parts)} html parts, {len(resources)} images")
+
+
+def scale_html(html_part, scale):
+    lower = html_part.lower()
+    start = lower.index(">", lower.index("<body")) + 1
+    end = lower.rindex("</body")
+    return html_part[:start] + html_part[start:end] * scale + html_part[end:]
+
+
+def time_it(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MHTML html body extraction backends.")
+    parser.add_argument("--file", default=DEFAULT_MHTML, help="Path to the MHTML file.")
+    parser.add_argument("--scale", type=int, default=50, help="How many times the html body is repeated.")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("mhtml_backend_benchmark")
+    backends = [backend for backend in HTML_BACKENDS if backend != "lxml" or lxml is not None]
+
+    html_part, local_names = load_example(args.file, MHTMLToTextAndImages(logger))
+    big_html = scale_html(html_part, args.scale)
+    print(f"html part {len(html_part)} chars, scaled x{args.scale} to {len(big_html)} chars, {len(local_names)} image references")
+
+    work_dir = tempfile.mkdtemp(prefix="mhtml_backend_benchmark_")
+    try:
+        check_against_email_parser(args.file, MHTMLToTextAndImages(logger), work_dir)
+        for backend in backends:
+            converter = MHTMLToTextAndImages(logger, html_backend=backend)
+            extract_time, body = time_it(converter._extract_body, big_html)
+            rewrite_time, _ = time_it(converter._rewrite_references, body, local_names)
+            convert_time, _ = time_it(converter.convert, args.file, os.path.join(work_dir, backend))
+            print(f"{backend:12s} body {extract_time * 1000:9.1f} ms  rewrite {rewrite_time * 1000:7.1f} ms  "
+                  f"{len(big_html) / 1e6 / extract_time:7.1f} MB/s  full convert {convert_time * 1000:8.1f} ms")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import logging
+import tempfile
+import fitz  # PyMuPDF
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from classes.pdf_to_text_and_images import PDFToTextAndImages
+
+"""
+Benchmark of the parallel page extraction in PDFToTextAndImages.
+
+The source PDF is repeated --repeat times into one big PDF, which is then converted with
+1, 2, 4 ... processes. Every run is checked to be byte identical to the serial run.
+
+usage (from src/):
+    python benchmark/pdf_parallel_benchmark.py --pdf ../images/test1.pdf --repeat 100
+"""
+
+
+def build_big_pdf(pdf_path, repeat, big_pdf_path):
+    source = fitz.open(pdf_path)
+    big = fitz.open()
+    for _ in range(repeat):
+        big.insert_pdf(source)
+    big.save(big_pdf_path)
+    return len(big)
+
+
+def folder_digest(folder):
+    digest = hashlib.sha256()
+    for file in sorted(os.listdir(folder)):
+        digest.update(file.encode("utf-8"))
+        with open(os.path.join(folder, file), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def run(converter, pdf_path, output_folder, workers):
+    os.makedirs(output_folder)
+    start = time.perf_counter()
+    pages_elements = converter.extract_images_and_text(pdf_path, output_folder, workers=workers)
+    elapsed = time.perf_counter() - start
+    converter.generate_html(pages_elements, os.path.join(output_folder, "output.html"))
+    return elapsed, folder_digest(output_folder)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serial vs parallel PDF page extraction.")
+    parser.add_argument("--pdf", default="../images/test1.pdf", help="Path to the PDF file to repeat.")
+    parser.add_argument("--repeat", type=int, default=100, help="How many times the PDF is repeated.")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count(), help="Highest number of processes to try.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    converter = PDFToTextAndImages(logging.getLogger("pdf_parallel_benchmark"))
+
+    work_dir = tempfile.mkdtemp(prefix="pdf_parallel_benchmark_")
+    try:
+        big_pdf_path = os.path.join(work_dir, "big.pdf")
+        page_count = build_big_pdf(args.pdf, args.repeat, big_pdf_path)
+        print(f"{page_count} pages, {os.cpu_count()} cpus")
+
+        workers_list = [1]
+        while workers_list[-1] * 2 <= args.max_workers:
+            workers_list.append(workers_list[-1] * 2)
+
+        serial_time, serial_digest = None, None
+        for workers in workers_list:
+            elapsed, digest = run(converter, big_pdf_path, os.path.join(work_dir, f"out_{workers}"), workers)
+            if serial_time is None:
+                serial_time, serial_digest = elapsed, digest
+            identical = "identical" if digest == serial_digest else "DIFFERS FROM SERIAL"
+            print(f"workers={workers:3d}  {elapsed:8.2f}s  {page_count / elapsed:8.1f} pages/s  "
+                  f"speedup {serial_time / elapsed:5.2f}x  {identical}")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
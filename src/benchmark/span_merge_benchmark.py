@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import random
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from classes.pdf_to_text_and_images import PDFToTextAndImages, _TextLineIndex
+
+"""
+Micro benchmark of the span merge step in PDFToTextAndImages._extract_text_elements_from_page.
+
+Builds synthetic get_text("dict") text blocks and compares a linear scan over all collected
+elements with the y-bucketed _TextLineIndex - both merge per line, and the results are checked
+to be identical before the times are reported.
+
+usage (from src/):
+    python benchmark/span_merge_benchmark.py --spans 5000
+"""
+
+
+def build_blocks(span_count, spans_per_line, lines_per_block, seed=42):
+    random.seed(seed)
+    blocks = []
+    spans_left = span_count
+    while spans_left > 0:
+        lines = []
+        for _ in range(lines_per_block):
+            y0 = random.uniform(0, 20000)  # a very tall page, so most lines get their own element
+            text = " " if random.random() < 0.05 else "word{} "  # some whitespace only lines, like real pages have
+            spans = [{"text": text.format(i), "size": 10.0, "font": "Helvetica"} for i in range(min(spans_per_line, spans_left))]
+            spans_left -= len(spans)
+            lines.append({"bbox": (50.0, y0, 500.0, y0 + 10), "spans": spans})
+            if spans_left <= 0:
+                break
+        blocks.append({"type": 0, "bbox": lines[0]["bbox"], "lines": lines})
+    return blocks
+
+
+def merge_linear(blocks, y_tolerance):
+    """the same line merge without the index: a scan over all elements for every line"""
+    elements = []
+    for block in blocks:
+        for line in block["lines"]:
+            spans = line["spans"]
+            line_text = "".join(span["text"] for span in spans)
+            if not spans or not line_text.strip():
+                continue
+            y_pos = line["bbox"][1]
+            matching_element = None
+            for element in elements:
+                if element["type"] == "text" and abs(element["bbox"][1] - y_pos) <= y_tolerance:
+                    matching_element = element
+                    break
+            if matching_element:
+                matching_element["content"] += " " + line_text
+            else:
+                elements.append({"type": "text", "content": line_text, "bbox": line["bbox"],
+                                 "font_size": spans[0]["size"], "font": spans[0]["font"]})
+    return elements
+
+
+def merge_indexed(converter, blocks, y_tolerance):
+    elements = []
+    line_index = _TextLineIndex(y_tolerance)
+    for block in blocks:
+        converter._extract_text_elements_from_page(block, elements, line_index)
+    return elements
+
+
+def best_of(repeat, function, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the span merge step on a synthetic page.")
+    parser.add_argument("--spans", type=int, default=5000, help="Number of spans on the page.")
+    parser.add_argument("--spans-per-line", type=int, default=1, help="Spans in every line.")
+    parser.add_argument("--lines-per-block", type=int, default=5, help="Lines in every block.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per variant, the best is reported.")
+    args = parser.parse_args()
+
+    converter = PDFToTextAndImages(logging.getLogger("span_merge_benchmark"))
+    blocks = build_blocks(args.spans, args.spans_per_line, args.lines_per_block)
+    y_tolerance = 2
+
+    linear_time, linear_elements = best_of(args.repeat, merge_linear, blocks, y_tolerance)
+    indexed_time, indexed_elements = best_of(args.repeat, merge_indexed, converter, blocks, y_tolerance)
+
+    if linear_elements != indexed_elements:
+        raise AssertionError("the linear scan and the y-index merged the lines differently")
+
+    print(f"{args.spans} spans in {len(blocks)} blocks")
+    print(f"linear scan : {linear_time * 1000:9.2f} ms  {len(linear_elements)} elements")
+    print(f"y-index     : {indexed_time * 1000:9.2f} ms  {len(indexed_elements)} elements")
+    print(f"speedup     : {linear_time / indexed_time:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
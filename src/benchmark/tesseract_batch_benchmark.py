@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from classes.tesseract_image_processor import TesseractImageProcessor
+from classes.tesseract_batch_runner import TesseractBatchRunner
+
+"""
+Benchmark of one pytesseract call per image against the batched TesseractBatchRunner.
+
+The sample images are repeated --repeat times so the run is long enough to measure. No numbers are
+recorded for it yet: run it on a machine with tesseract and the language data installed.
+
+usage (from src/):
+    python benchmark/tesseract_batch_benchmark.py --images ../test1 --repeat 20
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pytesseract per image vs batches of images per tesseract process.")
+    parser.add_argument("--images", default="../test1", help="Folder with sample images.")
+    parser.add_argument("--repeat", type=int, default=20, help="How many times every image is processed.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Parallel tesseract processes.")
+    parser.add_argument("--lang", default=os.getenv("TESSERACT_LANG", "swe+eng"), help="Tesseract language(s).")
+    args = parser.parse_args()
+
+    images = sorted(os.path.join(args.images, file) for file in os.listdir(args.images)
+                    if file.lower().endswith((".jpg", ".jpeg", ".png")))
+    paths = images * args.repeat
+    print(f"{len(paths)} images ({len(images)} unique), {args.workers} workers")
+
+    single = TesseractImageProcessor(lang=args.lang)
+    start = time.perf_counter()
+    single_results = [single.analyze_image(path) for path in paths]
+    single_time = time.perf_counter() - start
+    print(f"pytesseract per image : {single_time:7.2f}s  {len(paths) / single_time:7.1f} images/s")
+
+    batched = TesseractImageProcessor(lang=args.lang, runner=TesseractBatchRunner(args.lang, workers=args.workers))
+    try:
+        start = time.perf_counter()
+        batched_results = batched.analyze_images(paths)
+        batched_time = time.perf_counter() - start
+    finally:
+        batched.close()
+    print(f"batch runner          : {batched_time:7.2f}s  {len(paths) / batched_time:7.1f} images/s  "
+          f"speedup {single_time / batched_time:.1f}x")
+
+    same_text = sum(a["text"] == b["text"] for a, b in zip(single_results, batched_results))
+    print(f"identical text        : {same_text}/{len(paths)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import os
+import json
+import hashlib
+import logging
+from typing import List, Tuple, Dict, Any, Optional
+from classes.ai_image_processor import INSTRUCTIONS
+
+"""
+OpenAI Batch API mode for bulk OCR - half the token price, results within 24h.
+
+Flow:
+1. add_requests(jobs): every (source_image, output_file) becomes one line in the request JSONL,
+   the custom_id -> source_image/output_file mapping is kept in <batch_file>.map.json. An image the
+   AI result cache already has is written right away from the cache and not sent again.
+2. submit(): uploads every request file and creates a batch per file, the batch ids are stored in the map file
+3. fetch(): checks the batches, the result JSONL of every completed one is downloaded
+4. ingest_results(): writes every answer to its .md file, with the same generate_infix naming as
+   AIImageProcessor.process_image - and into the AI result cache, if the processor has one
+5. completed_documents(): the documents (see add_document) that have all their answers now - only
+   those are done, a document with a failed request is processed again on the next run
+
+The Batch API accepts max 50 000 requests and 200 MB per file. A file that is full is continued in
+the next part: ocr_batch.jsonl, ocr_batch.2.jsonl, ... - each part is its own batch. With base64
+images of ~0.5 MB the size is the limit that is reached first, after a few hundred images.
+
+Writing and ingesting is fully offline (use AIImageProcessor(connect=False)), only submit()
+and fetch() need the network.
+"""
+
+MAX_REQUESTS_PER_FILE = 50_000
+MAX_BYTES_PER_FILE = 200 * 1024 * 1024
+
+
+class AIBatch:
+    def __init__(self, processor, batch_file: str, logger: logging.Logger,
+                 max_requests: int = MAX_REQUESTS_PER_FILE, max_bytes: int = MAX_BYTES_PER_FILE):
+        self._processor = processor
+        self._logger = logger
+        self.batch_file = batch_file
+        self.map_file = f"{batch_file}.map.json"
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self._batch_map = self._load_map()
+
+    def _load_map(self) -> Dict[str, Any]:
+        if not os.path.exists(self.map_file):
+            return {"parts": [], "requests": {}, "documents": {}}
+        with open(self.map_file, "r", encoding="utf-8") as map_file:
+            batch_map = json.load(map_file)
+        batch_map.setdefault("documents", {})
+        if "parts" not in batch_map:  # a map from before the split: one file, one batch
+            size = os.path.getsize(self.batch_file) if os.path.exists(self.batch_file) else 0
+            batch_map["parts"] = [{"file": self.batch_file, "requests": len(batch_map["requests"]), "bytes": size,
+                                   "batch_id": batch_map.pop("batch_id", None)}]
+        return batch_map
+
+    def _save_map(self) -> None:
+        tmp_file = f"{self.map_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as map_file:
+            json.dump(self._batch_map, map_file, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, self.map_file)
+
+    @property
+    def parts(self) -> List[Dict[str, Any]]:
+        return self._batch_map["parts"]
+
+    def _part_file(self, number: int) -> str:
+        """ocr_batch.jsonl, ocr_batch.2.jsonl, ocr_batch.3.jsonl ..."""
+        if number == 0:
+            return self.batch_file
+        root, extension = os.path.splitext(self.batch_file)
+        return f"{root}.{number + 1}{extension}"
+
+    def _results_file(self, part: Dict[str, Any]) -> str:
+        return f"{part['file']}.results.jsonl"
+
+    def _open_part(self, size: int) -> Dict[str, Any]:
+        """the part the next request of size bytes goes to - a new one when the last is full or already submitted"""
+        part = self.parts[-1] if self.parts else None
+        if part is None or part["batch_id"] or part["requests"] >= self.max_requests or \
+                (part["requests"] and part["bytes"] + size > self.max_bytes):
+            part = {"file": self._part_file(len(self.parts)), "requests": 0, "bytes": 0, "batch_id": None}
+            self.parts.append(part)
+        return part
+
+    def _make_custom_id(self, source_image: str) -> str:
+        return "img-" + hashlib.sha1(os.path.abspath(source_image).encode("utf-8")).hexdigest()[:20]
+
+    def add_document(self, file_path: str, sha256: Optional[str], output_folder: str) -> None:
+        """the input file the next add_requests(..., document=file_path) belong to"""
+        self._batch_map["documents"][file_path] = {"path": file_path, "sha256": sha256, "output_folder": output_folder}
+        self._save_map()
+
+    def add_requests(self, jobs: List[Tuple[str, str]], instructions: str = INSTRUCTIONS, document: Optional[str] = None) -> int:
+        """appends a request per (source_image, output_file) not already in the batch, returns the number added"""
+        added, cached = 0, 0
+        for source_image, output_file in jobs:
+            custom_id = self._make_custom_id(source_image)
+            if custom_id in self._batch_map["requests"]:
+                self._batch_map["requests"][custom_id]["document"] = document
+                continue
+
+            request = {
+                "source_image" : source_image,
+                "output_file"  : output_file,
+                "instructions" : instructions,
+                "document"     : document
+            }
+            if self._processor.is_cached(source_image, instructions):  # paid for already - written now, not sent again
+                request["result_file"] = self._processor.process_image(source_image, output_file)
+                request["cached"] = True
+                self._batch_map["requests"][custom_id] = request
+                cached += 1
+                continue
+
+            base64_image_url = self._processor.generate_image_url(source_image)
+            line = json.dumps({
+                "custom_id" : custom_id,
+                "method"    : "POST",
+                "url"       : "/v1/chat/completions",
+                "body"      : self._processor.build_request(base64_image_url, instructions)
+            }) + "\n"
+            part = self._open_part(len(line))
+            with open(part["file"], "a", encoding="utf-8") as batch_file:
+                batch_file.write(line)
+            part["requests"] += 1
+            part["bytes"] += len(line)
+            request["part"] = part["file"]
+            self._batch_map["requests"][custom_id] = request
+            added += 1
+
+        self._save_map()
+        self._logger.info(f"Added {added} requests to {self.batch_file} ({len(self.parts)} files), {cached} answered "
+                          f"from the cache, {len(self._batch_map['requests'])} in total")
+        return added
+
+    def submit(self) -> List[str]:
+        """creates a batch for every part that has none yet, returns the new batch ids"""
+        client = self._processor.client
+        batch_ids = []
+        for part in self.parts:
+            if part["batch_id"] or not part["requests"]:
+                continue
+            with open(part["file"], "rb") as batch_file:
+                uploaded = client.files.create(file=batch_file, purpose="batch")
+            batch = client.batches.create(input_file_id=uploaded.id, endpoint="/v1/chat/completions", completion_window="24h")
+
+            part["batch_id"] = batch.id
+            self._save_map()  # after every part - a failed upload of the next one does not lose this id
+            self._logger.info(f"Submitted {part['file']} as batch {batch.id}")
+            batch_ids.append(batch.id)
+        return batch_ids
+
+    def fetch(self) -> List[str]:
+        """returns the status of every batch - the results of a 'completed' one are downloaded next to its request file"""
+        submitted = [part for part in self.parts if part["batch_id"]]
+        if not submitted:
+            raise ValueError(f"No batch id in {self.map_file} - submit the batch first.")
+
+        client = self._processor.client
+        statuses = []
+        for part in submitted:
+            batch = client.batches.retrieve(part["batch_id"])
+            self._logger.info(f"Batch {part['batch_id']} is {batch.status}: {batch.request_counts}")
+
+            if batch.status == "completed" and batch.output_file_id:
+                results_file = self._results_file(part)
+                with open(results_file, "wb") as results:
+                    results.write(client.files.content(batch.output_file_id).read())
+                self._logger.info(f"Results of batch {part['batch_id']} saved to {results_file}")
+            statuses.append(batch.status)
+        return statuses
+
+    def ingest_results(self, results_file: Optional[str] = None) -> List[str]:
+        """writes the .md file of every successful answer, returns the custom_ids that failed.
+        results_file: one result JSONL, default: every one downloaded by fetch()"""
+        if results_file is not None:
+            results_files = [results_file]
+        else:
+            results_files = [self._results_file(part) for part in self.parts if os.path.exists(self._results_file(part))]
+
+        failed = []
+        for path in results_files:
+            failed += self._ingest_file(path)
+        self._save_map()
+        return failed
+
+    def _ingest_file(self, results_file: str) -> List[str]:
+        failed = []
+        with open(results_file, "r", encoding="utf-8") as results:
+            for line in results:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                custom_id = result["custom_id"]
+                request = self._batch_map["requests"].get(custom_id)
+                response = result.get("response") or {}
+
+                if request is None or result.get("error") or response.get("status_code") != 200:
+                    self._logger.warning(f"No usable answer for {custom_id}: {result.get('error') or response.get('status_code')}")
+                    failed.append(custom_id)
+                    continue
+
+                body = response["body"]
+                markdown_content = body["choices"][0]["message"]["content"]
+                model_name = body["model"]
+                tokens_used = body["usage"]["total_tokens"]
+
+                output_file = self._processor.make_output_filename(request["source_image"], request["output_file"], model_name, tokens_used)
+                self._processor.save_markdown_to_file(markdown_content, output_file)
+                request["result_file"] = output_file
+
+                if self._processor.cache is not None and os.path.exists(request["source_image"]):
+                    image_bytes = self._processor.read_image(request["source_image"])
+                    self._processor.cache.put(self._processor.make_cache_key(image_bytes, request["instructions"]), {
+                        "markdown"     : markdown_content,
+                        "model"        : model_name,
+                        "total_tokens" : tokens_used
+                    })
+        return failed
+
+    def completed_documents(self) -> List[Dict[str, Any]]:
+        """the documents whose requests all have an ingested answer, each with "results": [(source_image, result_file)]"""
+        results: Dict[str, List[Tuple[str, Optional[str]]]] = {path: [] for path in self._batch_map["documents"]}
+        for request in self._batch_map["requests"].values():
+            if request.get("document") in results:
+                results[request["document"]].append((request["source_image"], request.get("result_file")))
+
+        completed = []
+        for path, document_results in results.items():
+            if all(result_file for _, result_file in document_results):
+                completed.append(dict(self._batch_map["documents"][path], results=document_results))
+        return completed
@@ -1,14 +1,45 @@
 import os
+import time
 import base64
 import argparse
+import logging
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 from openai import OpenAI
+from classes.run_metrics import RunMetrics
+
+MODEL = 'gpt-4o'
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")  # OPENAI_BASE_URL hosts that skip the organization check
+MAX_TOKENS = 4096
+INSTRUCTIONS = """Return a markdown with the texts in the image.
+        Create a table with the layout, and each word at the approximate place in the table.
+        If any word is highlighted in the image with a square make it bold in the markdown text.
+        Only return the markdown. 
+        Please do not include any ```markdown or other other indications that this is markdown.
+        """
 
 class AIImageProcessor:
-    def __init__(self):
+    name = "ai"
+
+    def __init__(self, cache=None, model=MODEL, max_tokens=MAX_TOKENS, optimizer=None, connect=True, metrics=None, budget=None, limiter=None,
+                 logger=None):
         load_dotenv(override=True)
+        self._logger = logger or logging.getLogger("ai_image_processor")
+        self.metrics = metrics or RunMetrics()  # API latency, tokens and cache hits, see run_metrics.py
+        self.budget = budget  # optional BudgetScheduler, raises BudgetExhausted before a request that does not fit
+        self.limiter = limiter  # optional RateLimiter: rate limits, retries with backoff, adaptive concurrency
+        self.cache = cache  # optional AIResultCache, see ai_result_cache.py
+        self.optimizer = optimizer  # optional ImageUploadOptimizer, see image_upload_optimizer.py
+        self.model = model
+        self.max_tokens = max_tokens
+        self.client = None
+
+        if not connect:  # offline use, e.g. writing Batch API files - building requests and naming works, calling does not
+            return
+
         self.api_key, self.org_id = self.get_api_details()
-        self.client = self.create_client(self.api_key, self.org_id)
+        self.base_url = os.getenv("OPENAI_BASE_URL")  # e.g. http://127.0.0.1:8085/v1 for a local fake endpoint
+        self.client = self.create_client(self.api_key, self.org_id, self.base_url)
 
     def get_api_details(self):
         api_key = os.getenv("OPENAI_API_KEY")
@@ -22,37 +53,76 @@ class AIImageProcessor:
         
         return api_key, org_id
 
-    def encode_image(self, image_path):
+    def read_image(self, image_path):
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            return image_file.read()
 
-    def create_client(self, api_key, org_id):
-        print(f"Connecting to OpenAI with api-key: ...{api_key[-5:]} and orgid: ...{org_id[-5:]}")
+    def encode_image(self, image_path):
+        return base64.b64encode(self.read_image(image_path)).decode('utf-8')
+
+    def create_client(self, api_key, org_id, base_url=None):
+        # with a limiter the retries are done there, the client would otherwise retry each attempt twice more
+        max_retries = 0 if self.limiter is not None else 2
+        if base_url and urlparse(base_url).hostname in LOOPBACK_HOSTS:
+            # a local endpoint (fake_openai_server.py) - no real organization to check
+            print(f"Connecting to local OpenAI-compatible endpoint {base_url}")
+            return OpenAI(api_key=api_key, organization=org_id, base_url=base_url, max_retries=max_retries)
+
+        print(f"Connecting to {base_url or 'OpenAI'} with api-key: ...{api_key[-5:]} and orgid: ...{org_id[-5:]}")
         if org_id[-5:] != "7v5uQ":
             raise Exception(f"Error: using the wrong orgid: {org_id}")
         
-        return OpenAI(api_key=api_key, organization=org_id)
+        return OpenAI(api_key=api_key, organization=org_id, base_url=base_url, max_retries=max_retries)
 
-    def generate_image_url(self, image_path):
-        encoded_image = self.encode_image(image_path)
-        return f"data:image/jpeg;base64,{encoded_image}"
+    def generate_image_url(self, image_path, image_bytes=None):
+        if image_bytes is None:
+            image_bytes = self.read_image(image_path)
 
-    def get_response(self, base64_image_url, instructions):
-        response = self.client.chat.completions.create(
-            model='gpt-4o',
-            messages=[
+        mime_type = "image/jpeg"
+        if self.optimizer is not None:
+            mime_type, image_bytes, stats = self.optimizer.prepare(image_bytes)
+            self._logger.debug(f"Upload of {image_path}: {stats['bytes_before']} -> {stats['bytes_after']} bytes, "
+                               f"~{stats['tokens_before']} -> ~{stats['tokens_after']} image tokens ({stats['mime_type']})")
+
+        encoded_image = base64.b64encode(image_bytes).decode('utf-8')
+        return f"data:{mime_type};base64,{encoded_image}"
+
+    def build_request(self, base64_image_url, instructions):
+        """the chat completion request as a dict - used for direct calls and for Batch API files"""
+        image_url = {"url": base64_image_url}
+        if self.optimizer is not None and self.optimizer.detail:
+            image_url["detail"] = self.optimizer.detail
+
+        return {
+            "model": self.model,
+            "messages": [
                 {
                     "role": "user",
                     "content": [
                         {"type": "text", "text": instructions},
-                        {"type": "image_url", "image_url": {"url": base64_image_url}}
+                        {"type": "image_url", "image_url": image_url}
                     ]
                 }
             ],
-            max_tokens=4096,
-        )
+            "max_tokens": self.max_tokens,
+        }
+
+    def get_response(self, base64_image_url, instructions):
+        request = self.build_request(base64_image_url, instructions)
+        if self.limiter is not None:
+            return self.limiter.call(lambda: self.client.chat.completions.create(**request),
+                                     usage=lambda response: response.usage.total_tokens)
+
+        response = self.client.chat.completions.create(**request)
         return response
 
+    def record_usage(self, response, latency, bytes_uploaded):
+        self.metrics.observe("ai_api_latency_seconds", latency)
+        self.metrics.add("ai_requests")
+        self.metrics.add("ai_bytes_uploaded", bytes_uploaded)
+        self.metrics.add("ai_prompt_tokens", response.usage.prompt_tokens)
+        self.metrics.add("ai_completion_tokens", response.usage.completion_tokens)
+
     def extract_markdown(self, response):
         markdown_content = response.choices[0].message.content
         return markdown_content
@@ -63,31 +133,75 @@ class AIImageProcessor:
         print(f"Markdown content saved to {output_file}")
 
     def generate_infix(self, response):
-        model_name = response.model
-        tokens_used = response.usage.total_tokens
+        return self.format_infix(response.model, response.usage.total_tokens)
+
+    def format_infix(self, model_name, tokens_used):
         return f"_model_{model_name}_tokens_{tokens_used}"
 
-    def process_image(self, source_image, output_file):
-        base64_image_url = self.generate_image_url(source_image)
-        
-        instructions = """Return a markdown with the texts in the image.
-        Create a table with the layout, and each word at the approximate place in the table.
-        If any word is highlighted in the image with a square make it bold in the markdown text.
-        Only return the markdown. 
-        Please do not include any ```markdown or other other indications that this is markdown.
-        """
-        
-        response = self.get_response(base64_image_url, instructions)
+    def make_cache_key(self, image_bytes, instructions):
+        upload_settings = (self.optimizer.signature(),) if self.optimizer is not None else ()
+        return self.cache.make_key(image_bytes, instructions, self.model, self.max_tokens, *upload_settings)
+
+    def is_cached(self, source_image, instructions=INSTRUCTIONS):
+        """True when recognize() answers from the exact byte cache - PerceptualReuseEngine asks before its lookup"""
+        return self.cache is not None and self.make_cache_key(self.read_image(source_image), instructions) in self.cache
+
+    def recognize(self, source_image, instructions=INSTRUCTIONS):
+        """the OCREngine interface (see ocr_engine.py) - from the cache when possible"""
+        image_bytes = self.read_image(source_image)
+        cache_key = None
+
+        if self.cache is not None:
+            cache_key = self.make_cache_key(image_bytes, instructions)
+            entry = self.cache.get(cache_key)
+            self.metrics.add("ai_cache_hits" if entry else "ai_cache_misses")
+            if entry:
+                return {"markdown": entry["markdown"], "model": entry["model"], "tokens": entry["total_tokens"],
+                        "bytes_uploaded": 0, "cached": True}
+
+        reserved = self.budget.acquire() if self.budget is not None else 0
+        try:
+            base64_image_url = self.generate_image_url(source_image, image_bytes)
+            start = time.perf_counter()
+            response = self.get_response(base64_image_url, instructions)
+        except Exception:
+            if self.budget is not None:
+                self.budget.release(reserved)
+            raise
+        self.record_usage(response, time.perf_counter() - start, len(base64_image_url))
+        if self.budget is not None:
+            self.budget.charge(response.usage.prompt_tokens, response.usage.completion_tokens, reserved)
         markdown_content = self.extract_markdown(response)
 
+        if cache_key is not None:
+            self.cache.put(cache_key, {
+                "markdown"     : markdown_content,
+                "model"        : response.model,
+                "total_tokens" : response.usage.total_tokens
+            })
+
+        return {"markdown": markdown_content, "model": response.model, "tokens": response.usage.total_tokens,
+                "bytes_uploaded": len(base64_image_url), "cached": False}
+
+    def analyze_image(self, source_image, instructions=INSTRUCTIONS):
+        """returns (markdown_content, model_name, tokens_used) - from the cache when possible"""
+        result = self.recognize(source_image, instructions)
+        return result["markdown"], result["model"], result["tokens"]
+
+    def make_output_filename(self, source_image, output_file, model_name, tokens_used):
         if output_file:
             base_output_file = output_file
         else:
             filename_without_extension = os.path.splitext(os.path.basename(source_image))[0]
             base_output_file = f"{filename_without_extension}.md"
 
-        infix = self.generate_infix(response)
+        infix = self.format_infix(model_name, tokens_used)
         name, ext = os.path.splitext(base_output_file)
-        output_file = f"{name}__{infix}{ext}"
+        return f"{name}__{infix}{ext}"
+
+    def process_image(self, source_image, output_file):
+        markdown_content, model_name, tokens_used = self.analyze_image(source_image)
+        output_file = self.make_output_filename(source_image, output_file, model_name, tokens_used)
 
         self.save_markdown_to_file(markdown_content, output_file)
+        return output_file
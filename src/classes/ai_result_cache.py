@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+"""
+A persistent, content addressed cache for AI OCR results.
+
+The key is a sha256 over the image bytes, the instructions, the model and max_tokens - so
+the same image sent with the same prompt to the same model is only paid for once, whatever
+the file is named and wherever it is stored.
+
+Every entry is a small json file in <cache_dir>/<key[:2]>/<key>.json. The file mtime is
+used as "last used" and is touched on every hit. In memory the entries are kept in the order
+they were last used (sorted by mtime once, when the cache is opened), so eviction takes the
+least recently used ones from the front without sorting. When the total size goes above
+max_bytes, entries are evicted down to low_water (90%) of it - the next eviction is then some
+writes away instead of on every put.
+
+main methods:
+- make_key(image_bytes, instructions, model, max_tokens, *extra): key for a request
+- get(key): the cached entry (dict) or None
+- key in cache: is there an entry, without counting a hit or a miss
+- put(key, entry): store an entry, evicts old entries if needed
+"""
+class AIResultCache:
+    def __init__(self, cache_dir: str, max_bytes: int = 500 * 1024 * 1024, low_water: float = 0.9):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.hits      = 0
+        self.misses    = 0
+        self.evicted   = 0
+        self._lock     = threading.Lock()
+        self._entries: "OrderedDict[str, list]" = OrderedDict()  # key -> [size, last_used], least recently used first
+        self._total_bytes = 0
+        self._load_index()
+
+    @staticmethod
+    def make_key(image_bytes: bytes, instructions: str, model: str, max_tokens: int, *extra: Any) -> str:
+        digest = hashlib.sha256()
+        digest.update(hashlib.sha256(image_bytes).digest())
+        for part in (instructions, model, max_tokens) + extra:
+            digest.update(b"\0")
+            digest.update(str(part).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _load_index(self) -> None:
+        if not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if not file.endswith(".json"):
+                    continue
+                stat = os.stat(os.path.join(root, file))
+                entries.append((file[:-len(".json")], [stat.st_size, stat.st_mtime]))
+                self._total_bytes += stat.st_size
+        entries.sort(key=lambda item: item[1][1])
+        self._entries.update(entries)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._entry_path(key)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                with open(path, "r", encoding="utf-8") as entry_file:
+                    entry = json.load(entry_file)
+            except (OSError, ValueError):
+                self._forget(key)  # removed or broken behind our back, treat as a miss
+                self.misses += 1
+                return None
+
+            now = time.time()
+            os.utime(path, (now, now))
+            self._entries[key][1] = now
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        path = self._entry_path(key)
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as entry_file:
+            entry_file.write(data)
+        os.replace(tmp_path, path)  # atomic - readers never see half an entry
+
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries[key][0]
+            self._entries[key] = [len(data), time.time()]
+            self._entries.move_to_end(key)
+            self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _forget(self, key: str) -> None:
+        size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+
+    def _evict(self) -> None:
+        """least recently used first, down to low_water of max_bytes"""
+        target = self.max_bytes * self.low_water
+        while self._total_bytes > target and self._entries:
+            key = next(iter(self._entries))
+            try:
+                os.remove(self._entry_path(key))
+            except FileNotFoundError:
+                pass
+            self._forget(key)
+            self.evicted += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits"    : self.hits,
+                "misses"  : self.misses,
+                "evicted" : self.evicted,
+                "entries" : len(self._entries),
+                "bytes"   : self._total_bytes
+            }
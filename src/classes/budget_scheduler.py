@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import fnmatch
+import threading
+from typing import Dict, Any, List, Optional
+
+"""
+Orders the files of a corpus run and keeps the AI spend of the run below a token and/or cost budget.
+
+Spend is tracked live from the `usage` of every response (prompt and completion tokens, priced per
+1M tokens). Before a request is sent a slot is acquired: the expected tokens of the request (the
+mean of the requests so far) are reserved. When the spend plus the reservations of the requests in
+flight would go above the budget the request waits for those to finish, and when the spend alone
+leaves no room BudgetExhausted is raised - so the run stops cleanly instead of overshooting by
+max_in_flight requests. The very first request is sent alone, to learn what a request costs.
+Without a max_tokens and a max_cost nothing is reserved or waited for, the spend is only counted.
+
+The spend is saved in a JSON checkpoint, with the files that were done and the files that are left.
+A run starts at zero; with resume=True (--budget-resume) it continues with the spend of the
+checkpoint instead, e.g. a monthly budget over several runs.
+
+Order policies (FileOrder, also without a budget):
+- "name":     alphabetical (the default, same order every run)
+- "smallest": smallest files first, the most documents per token
+- "newest":   most recently modified first
+- "priority": files matching the patterns of the priority list first (in list order), then by name
+
+main methods:
+- FileOrder.order(file_paths): the files in policy order
+- acquire() / charge(prompt_tokens, completion_tokens, reserved): around every AI request
+- checkpoint(done, remaining): save the spend and the progress
+"""
+
+ORDER_POLICIES = ("name", "smallest", "newest", "priority")
+
+
+class BudgetExhausted(Exception):
+    pass
+
+
+class FileOrder:
+    def __init__(self, policy: str = "name", priorities: Optional[List[str]] = None):
+        if policy not in ORDER_POLICIES:
+            raise ValueError(f"Unknown order policy {policy}, use one of {ORDER_POLICIES}")
+        if policy == "priority" and not priorities:
+            raise ValueError("Order policy priority needs a priority list")
+        self.policy     = policy
+        self.priorities = priorities or []
+
+    def order(self, file_paths: List[str]) -> List[str]:
+        by_name = sorted(file_paths)
+        if self.policy == "smallest":
+            return sorted(by_name, key=os.path.getsize)
+        if self.policy == "newest":
+            return sorted(by_name, key=os.path.getmtime, reverse=True)
+        if self.policy == "priority":
+            def rank(file_path):
+                name = os.path.basename(file_path)
+                for index, pattern in enumerate(self.priorities):
+                    if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(file_path, pattern):
+                        return index
+                return len(self.priorities)
+            return sorted(by_name, key=rank)
+        return by_name
+
+
+class BudgetScheduler:
+    def __init__(self, max_tokens: Optional[int] = None, max_cost: Optional[float] = None,
+                 price_prompt: float = 2.50, price_completion: float = 10.00,
+                 checkpoint_path: Optional[str] = None, resume: bool = False):
+        self.max_tokens       = max_tokens
+        self.max_cost         = max_cost
+        self.price_prompt     = price_prompt  # per 1M tokens
+        self.price_completion = price_completion
+        self.checkpoint_path  = checkpoint_path
+
+        self.prompt_tokens     = 0
+        self.completion_tokens = 0
+        self.requests          = 0
+        self.exhausted         = False
+        self._reserved         = 0
+        self._lock             = threading.Condition()
+        if resume:
+            self._load_checkpoint()
+
+    def _load_checkpoint(self) -> None:
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        self.prompt_tokens     = checkpoint["prompt_tokens"]
+        self.completion_tokens = checkpoint["completion_tokens"]
+        self.requests          = checkpoint["requests"]
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (prompt_tokens * self.price_prompt + completion_tokens * self.price_completion) / 1_000_000
+
+    def _expected_tokens(self) -> int:
+        if self.requests == 0:
+            return 0
+        return -(-(self.prompt_tokens + self.completion_tokens) // self.requests)
+
+    def _over_budget(self, extra_tokens: int) -> bool:
+        if self.max_tokens is not None and self.prompt_tokens + self.completion_tokens + extra_tokens > self.max_tokens:
+            return True
+        # the extra tokens are priced as completion tokens, the expensive side
+        return self.max_cost is not None and self.cost(self.prompt_tokens, self.completion_tokens + extra_tokens) > self.max_cost
+
+    def acquire(self) -> int:
+        """reserve the expected tokens of one request, returns the reservation to pass to charge()"""
+        if self.max_tokens is None and self.max_cost is None:
+            return 0  # only counting - nothing to wait for
+        with self._lock:
+            while True:
+                if self.requests == 0 and self._reserved > 0:
+                    self._lock.wait()  # the first request is still out, its cost is not known yet
+                    continue
+                expected = max(1, self._expected_tokens())
+                if self.exhausted or self._over_budget(expected):
+                    self.exhausted = True
+                    raise BudgetExhausted(f"Budget exhausted: {self.summary()}")
+                if self._over_budget(self._reserved + expected):
+                    self._lock.wait()  # may fit when the requests in flight cost less than expected
+                    continue
+                self._reserved += expected
+                return expected
+
+    def charge(self, prompt_tokens: int, completion_tokens: int, reserved: int = 0) -> None:
+        with self._lock:
+            self._reserved          -= reserved
+            self.prompt_tokens      += prompt_tokens
+            self.completion_tokens  += completion_tokens
+            self.requests           += 1
+            self._lock.notify_all()
+
+    def release(self, reserved: int) -> None:
+        """a request that failed - nothing to charge"""
+        with self._lock:
+            self._reserved -= reserved
+            self._lock.notify_all()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "requests"          : self.requests,
+            "prompt_tokens"     : self.prompt_tokens,
+            "completion_tokens" : self.completion_tokens,
+            "cost"              : round(self.cost(self.prompt_tokens, self.completion_tokens), 4),
+            "max_tokens"        : self.max_tokens,
+            "max_cost"          : self.max_cost,
+            "exhausted"         : self.exhausted
+        }
+
+    def checkpoint(self, done: List[str], remaining: List[str]) -> None:
+        if not self.checkpoint_path:
+            return
+        with self._lock:
+            checkpoint = self.summary()
+        checkpoint.update(done=done, remaining=remaining, saved_at=time.time())
+
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, indent=2)
+        os.replace(tmp_path, self.checkpoint_path)
@@ -0,0 +1,173 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+"""
+Watches one or more folders and yields the files that were added or changed, once they are complete.
+
+Changes are picked up with inotify on Linux (through libc, no extra package) and by polling the
+folders everywhere else - or when inotify is not available, e.g. on some network shares, where
+polling is the only thing that works. Both only point out candidates: a file is yielded when its
+size and mtime have not changed for settle_seconds, so a manual that is still being copied to the
+share is not picked up half written.
+
+Files that are already in the folders when the watcher starts are yielded too, the manifest
+(processing_manifest.py) skips the unchanged ones.
+
+main methods:
+- events(): generator of complete files, runs until stop()
+- stop(): from another thread or a signal handler
+"""
+
+IN_MODIFY      = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+_EVENT_HEADER  = struct.Struct("iIII")  # wd, mask, cookie, len - followed by len bytes of name
+
+
+class _InotifySource:
+    def __init__(self, folders: List[str]):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._folders: Dict[int, str] = {}
+        for folder in folders:
+            wd = libc.inotify_add_watch(self._fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY)
+            if wd < 0:
+                os.close(self._fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {folder}")
+            self._folders[wd] = folder
+
+    def changed(self, timeout: float) -> Set[str]:
+        paths = set()
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return paths
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return paths
+            raise
+        offset = 0
+        while offset < len(data):
+            wd, _, _, name_length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if name and wd in self._folders:
+                paths.add(os.path.join(self._folders[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class _PollingSource:
+    def __init__(self, folders: List[str], interval: float):
+        self._folders = folders
+        self._interval = interval
+        self._snapshot = self._scan()  # what is there at the start is handled by the initial scan of the watcher
+
+    def _scan(self) -> Dict[str, Tuple[int, float]]:
+        snapshot = {}
+        for folder in self._folders:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        snapshot[entry.path] = (stat.st_size, stat.st_mtime)
+        return snapshot
+
+    def changed(self, timeout: float) -> Set[str]:
+        time.sleep(min(timeout, self._interval))
+        snapshot = self._scan()
+        paths = {path for path, state in snapshot.items() if self._snapshot.get(path) != state}
+        self._snapshot = snapshot
+        return paths
+
+    def close(self) -> None:
+        pass
+
+
+class FolderWatcher:
+    def __init__(self, folders: List[str], logger: logging.Logger, settle_seconds: float = 0.5,
+                 poll_interval: float = 1.0, use_inotify: bool = True, accept: Optional[Callable[[str], bool]] = None):
+        self.folders = folders
+        self.settle_seconds = settle_seconds
+        self._logger = logger
+        self._accept = accept or (lambda path: True)
+        self._stopped = threading.Event()
+        self._pending: Dict[str, Tuple[int, float, float]] = {}  # path -> (size, mtime, time of the last change)
+        self._source = None
+
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self._source = _InotifySource(folders)
+                logger.info(f"Watching {folders} with inotify")
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify not available ({e}), polling every {poll_interval}s instead")
+        if self._source is None:
+            self._source = _PollingSource(folders, poll_interval)
+            logger.info(f"Watching {folders} by polling every {poll_interval}s")
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _note(self, path: str, now: float) -> None:
+        if not self._accept(path):
+            return
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._pending.pop(path, None)  # moved away or deleted again
+            return
+        self._pending[path] = (stat.st_size, stat.st_mtime, now)
+
+    def _settled(self, now: float) -> List[str]:
+        ready = []
+        for path, (size, mtime, changed_at) in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self._pending[path] = (stat.st_size, stat.st_mtime, now)  # still being written
+            elif now - changed_at >= self.settle_seconds:
+                del self._pending[path]
+                ready.append(path)
+        return sorted(ready)
+
+    def events(self) -> Iterator[str]:
+        now = time.monotonic()
+        for folder in self.folders:
+            for file in sorted(os.listdir(folder)):
+                if os.path.isfile(os.path.join(folder, file)):
+                    # already complete unless it changes in the first moments, no need to wait
+                    self._note(os.path.join(folder, file), now - self.settle_seconds)
+
+        try:
+            while not self._stopped.is_set():
+                # wake up often enough to see files settle, but sleep while nothing is pending
+                timeout = self.settle_seconds / 4 if self._pending else 1.0
+                changed = self._source.changed(timeout)
+                now = time.monotonic()
+                for path in changed:
+                    self._note(path, now)
+                for path in self._settled(now):
+                    yield path
+        finally:
+            self._source.close()
@@ -0,0 +1,101 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Any
+
+"""
+Routes every image to Tesseract first, and only escalates to the AI when Tesseract is unsure.
+
+An image is escalated when the mean word confidence is below min_confidence or Tesseract
+found fewer than min_words words (icons, photos, layouts Tesseract can not read). The AI
+processor is created on the first escalation, so a run that never escalates needs no API key.
+
+main methods:
+- process_image(source_image, output_file): same interface as AIImageProcessor.process_image
+- process_images(jobs, max_workers): Tesseract on all images in one batch, then the escalated ones
+  to the AI with at most max_workers requests in flight
+- report(): how many images each engine handled
+- close(): stops the tesseract runner
+"""
+class HybridOCRRouter:
+    name = "hybrid"
+
+    def __init__(self, tesseract, ai_factory: Callable, logger: logging.Logger, min_confidence: float = 70.0, min_words: int = 5):
+        self._tesseract = tesseract
+        self._ai_factory = ai_factory
+        self._ai = None
+        self._logger = logger
+        self.min_confidence = min_confidence
+        self.min_words = min_words
+        self._lock = threading.Lock()
+        self._counts = {"tesseract": 0, "ai": 0}
+
+    def _get_ai(self):
+        with self._lock:
+            if self._ai is None:
+                self._ai = self._ai_factory()
+            return self._ai
+
+    def _count(self, engine: str) -> None:
+        with self._lock:
+            self._counts[engine] += 1
+
+    def is_good_enough(self, result) -> bool:
+        return result["mean_confidence"] >= self.min_confidence and result["word_count"] >= self.min_words
+
+    def recognize(self, source_image: str) -> Dict[str, Any]:
+        """the OCREngine interface (see ocr_engine.py)"""
+        result = self._tesseract.analyze_image(source_image)
+        if self.is_good_enough(result):
+            self._count("tesseract")
+            return {"markdown": result["text"], "model": "tesseract", "tokens": 0, "bytes_uploaded": 0}
+
+        self._count("ai")
+        return self._get_ai().recognize(source_image)
+
+    def process_image(self, source_image: str, output_file: str) -> str:
+        result = self._tesseract.analyze_image(source_image)
+
+        if self.is_good_enough(result):
+            self._count("tesseract")
+            return self._tesseract.save_result(source_image, output_file, result)
+
+        self._logger.info(f"Escalating {source_image} to the AI: confidence {result['mean_confidence']:.0f}, "
+                          f"{result['word_count']} words")
+        self._count("ai")
+        return self._get_ai().process_image(source_image, output_file)
+
+    def process_images(self, jobs: List[Tuple[str, str]], max_workers: int = 4,
+                       on_done: Optional[Callable[[Tuple[str, str], str], None]] = None) -> List[str]:
+        results = self._tesseract.analyze_images([source_image for source_image, _ in jobs])
+        output_files = [None] * len(jobs)
+        escalated = []
+
+        for index, ((source_image, output_file), result) in enumerate(zip(jobs, results)):
+            if self.is_good_enough(result):
+                self._count("tesseract")
+                output_files[index] = self._tesseract.save_result(source_image, output_file, result)
+                if on_done is not None:
+                    on_done(jobs[index], output_files[index])
+            else:
+                self._logger.info(f"Escalating {source_image} to the AI: confidence {result['mean_confidence']:.0f}, "
+                                  f"{result['word_count']} words")
+                self._count("ai")
+                escalated.append(index)
+
+        if escalated:
+            ai = self._get_ai()
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                for index, output_file in zip(escalated, executor.map(lambda index: ai.process_image(*jobs[index]), escalated)):
+                    output_files[index] = output_file
+                    if on_done is not None:
+                        on_done(jobs[index], output_file)
+
+        return output_files
+
+    def report(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def close(self) -> None:
+        self._tesseract.close()
@@ -0,0 +1,138 @@
+import os
+import json
+import fnmatch
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+
+"""
+Decides before OCR which images are worth sending: bullet icons, spacers, solid color banners
+and smooth decorative graphics are skipped, everything that may contain text is kept.
+
+Every image is downsampled to at most 256px (grayscale) and scored with NumPy:
+- size:            the original width and height
+- entropy:         Shannon entropy of the gray level histogram, in bits (0 = one color)
+- edge_density:    fraction of pixels where the gradient is stronger than edge_threshold
+- text_likelihood: fraction of rows with many light/dark transitions, like a line of text has
+
+An image is skipped as
+- "tiny":       shorter edge below min_edge or fewer than min_area pixels
+- "blank":      entropy below min_entropy (solid colors, spacers)
+- "decorative": hardly any edges and no text like rows (gradients, banners, soft photos)
+The thresholds are conservative - when in doubt the image is kept.
+
+Overrides win over the scores. The overrides file has one rule per line:
+    ocr  image_1_*.jpeg       always OCR the matching images
+    skip logo*.jpeg           never OCR them
+matched against the file name and the path. The decisions of a folder are written to triage.json.
+
+main methods:
+- score(image_path): the scores of one image
+- triage(image_paths): (images to OCR, decisions of all images)
+"""
+
+TRIAGE_FILE = "triage.json"
+
+
+class ImageTriage:
+    def __init__(self, logger: logging.Logger, min_edge: int = 24, min_area: int = 48 * 48, min_entropy: float = 0.5,
+                 min_edge_density: float = 0.004, min_text_likelihood: float = 0.02, edge_threshold: float = 24.0,
+                 sample_edge: int = 256, overrides: Optional[List[Tuple[str, str]]] = None):
+        self._logger = logger
+        self.min_edge = min_edge
+        self.min_area = min_area
+        self.min_entropy = min_entropy
+        self.min_edge_density = min_edge_density
+        self.min_text_likelihood = min_text_likelihood
+        self.edge_threshold = edge_threshold
+        self.sample_edge = sample_edge
+        self.overrides = overrides or []
+
+    @staticmethod
+    def load_overrides(path: str) -> List[Tuple[str, str]]:
+        overrides = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                action, _, pattern = line.partition(" ")
+                if action not in ("ocr", "skip") or not pattern.strip():
+                    raise ValueError(f"Bad triage override '{line}' in {path}, use 'ocr <pattern>' or 'skip <pattern>'")
+                overrides.append((action, pattern.strip()))
+        return overrides
+
+    def _override(self, image_path: str) -> Optional[str]:
+        name = os.path.basename(image_path)
+        for action, pattern in self.overrides:
+            if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(image_path, pattern):
+                return action
+        return None
+
+    def score(self, image_path: str) -> Dict[str, Any]:
+        with Image.open(image_path) as image:
+            width, height = image.size
+            image.draft("L", (self.sample_edge, self.sample_edge))  # JPEG: decode at reduced scale, much faster
+            gray = image.convert("L")
+            gray.thumbnail((self.sample_edge, self.sample_edge))
+        pixels = np.asarray(gray, dtype=np.float32)
+
+        histogram = np.bincount(pixels.astype(np.uint8).ravel(), minlength=256) / pixels.size
+        histogram = histogram[histogram > 0]
+        entropy = max(0.0, float(-(histogram * np.log2(histogram)).sum()))
+
+        edge_density = 0.0
+        text_likelihood = 0.0
+        if pixels.shape[0] > 1 and pixels.shape[1] > 1:
+            dx = np.abs(np.diff(pixels, axis=1))[:-1, :]
+            dy = np.abs(np.diff(pixels, axis=0))[:, :-1]
+            edge_density = float(((dx + dy) > self.edge_threshold).mean())
+
+            # text: rows crossing many dark/light boundaries, but not noise on every pixel
+            binary = pixels < (pixels.mean() - pixels.std() * 0.5)
+            transitions = np.count_nonzero(binary[:, 1:] != binary[:, :-1], axis=1) / pixels.shape[1]
+            text_likelihood = float(((transitions >= 0.04) & (transitions <= 0.6)).mean())
+
+        return {"width": width, "height": height, "entropy": round(entropy, 3),
+                "edge_density": round(edge_density, 4), "text_likelihood": round(text_likelihood, 4)}
+
+    def decide(self, scores: Dict[str, Any]) -> Optional[str]:
+        """the reason to skip, or None to OCR the image"""
+        if min(scores["width"], scores["height"]) < self.min_edge or scores["width"] * scores["height"] < self.min_area:
+            return "tiny"
+        if scores["entropy"] < self.min_entropy:
+            return "blank"
+        if scores["edge_density"] < self.min_edge_density and scores["text_likelihood"] < self.min_text_likelihood:
+            return "decorative"
+        return None
+
+    def triage(self, image_paths: List[str]) -> Tuple[List[str], List[Dict[str, Any]]]:
+        keep, decisions = [], []
+        for image_path in image_paths:
+            override = self._override(image_path)
+            try:
+                scores = self.score(image_path)
+                reason = self.decide(scores)
+            except OSError as e:  # not readable by PIL - let the OCR engine decide
+                scores, reason = {"error": str(e)}, None
+
+            if override == "ocr":
+                skip = False
+            elif override == "skip":
+                skip, reason = True, reason or "override"
+            else:
+                skip = reason is not None
+
+            decisions.append({"image": image_path, "skip": skip, "reason": reason, "override": override, **scores})
+            if skip:
+                self._logger.info(f"Triage: skipping {image_path} ({reason}) {scores}")
+            else:
+                keep.append(image_path)
+        return keep, decisions
+
+    def write_decisions(self, folder: str, decisions: List[Dict[str, Any]]) -> str:
+        path = os.path.join(folder, TRIAGE_FILE)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(decisions, f, indent=2)
+        return path
@@ -0,0 +1,104 @@
+import io
+import math
+from typing import Dict, Any, Tuple, Optional
+from PIL import Image
+
+"""
+Prepares images before they are sent to the AI: downscales to a max edge and re-encodes in
+the format that is smallest for the content. Flat UI screenshots (few colors) become PNG,
+photos become JPEG (or WebP). An image the API accepts as it is and that is not larger than
+max_edge is sent unchanged - re-encoding a JPEG as JPEG loses quality for ~1% fewer bytes and
+no tokens.
+
+estimate_image_tokens() is an offline estimate of what an image costs in input tokens, using
+the published tiling rules for gpt-4o: detail "low" is a flat 85 tokens, "high" fits the image
+in 2048x2048, scales the shortest side down to 768 and costs 170 tokens per 512px tile + 85.
+
+So the default max_edge of 2048 saves upload bytes and time, not tokens - the API does the same
+downscaling. A 16:9 screenshot costs 1105 tokens at any max_edge down to ~1365, only a max_edge
+that puts the short side below 768 (1024: 765 tokens) saves tokens, and makes the text smaller
+than what the model sees otherwise.
+
+main method:
+- prepare(image_bytes): returns (mime_type, bytes, stats) where stats has bytes and estimated tokens before/after
+
+see also:
+- estimate_upload_savings.py - offline report of bytes and tokens saved for a folder of images
+"""
+
+PASSTHROUGH_FORMATS = ("JPEG", "PNG", "WEBP", "GIF")  # accepted by the API as they are
+LOW_DETAIL_TOKENS = 85
+TILE_TOKENS       = 170
+TILE_SIZE         = 512
+
+
+def estimate_image_tokens(width: int, height: int, detail: Optional[str] = "high") -> int:
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+
+    # "high" and "auto" (auto picks high for anything but tiny images)
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return LOW_DETAIL_TOKENS + TILE_TOKENS * tiles
+
+
+class ImageUploadOptimizer:
+    def __init__(self, max_edge: int = 2048, detail: Optional[str] = None, jpeg_quality: int = 85,
+                 use_webp: bool = False, flat_color_limit: int = 256):
+        self.max_edge = max_edge                  # 0 = never downscale
+        self.detail = detail                      # None = let the API decide ("auto")
+        self.jpeg_quality = jpeg_quality
+        self.use_webp = use_webp                  # WebP instead of JPEG for photo like content
+        self.flat_color_limit = flat_color_limit  # at most this many colors = flat UI content, sent as PNG
+
+    def signature(self) -> str:
+        """the settings that change what is sent - part of the AI result cache key"""
+        return f"edge={self.max_edge};detail={self.detail};q={self.jpeg_quality};webp={self.use_webp};flat={self.flat_color_limit}"
+
+    def _downscale(self, image: Image.Image) -> Image.Image:
+        if not self.max_edge or max(image.size) <= self.max_edge:
+            return image
+        scale = self.max_edge / max(image.size)
+        new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        return image.resize(new_size, Image.LANCZOS)
+
+    def _is_flat(self, image: Image.Image) -> bool:
+        # getcolors() gives up (None) as soon as there are more colors than the limit, so this is cheap for photos
+        return image.getcolors(maxcolors=self.flat_color_limit) is not None
+
+    def _encode(self, image: Image.Image) -> Tuple[str, bytes]:
+        buffer = io.BytesIO()
+        if self._is_flat(image):
+            image.quantize(colors=self.flat_color_limit).save(buffer, "PNG", optimize=True)
+            return "image/png", buffer.getvalue()
+        if self.use_webp:
+            image.save(buffer, "WEBP", quality=self.jpeg_quality)
+            return "image/webp", buffer.getvalue()
+        image.save(buffer, "JPEG", quality=self.jpeg_quality, optimize=True)
+        return "image/jpeg", buffer.getvalue()
+
+    def prepare(self, image_bytes: bytes) -> Tuple[str, bytes, Dict[str, Any]]:
+        image = Image.open(io.BytesIO(image_bytes))  # only the header is read until the pixels are needed
+        original_size = image.size
+        original_mime = Image.MIME.get(image.format, "image/jpeg")
+
+        if image.format in PASSTHROUGH_FORMATS and (not self.max_edge or max(original_size) <= self.max_edge):
+            mime_type, data, resized = original_mime, image_bytes, image  # nothing to gain, not even decoded
+        else:
+            resized = self._downscale(image.convert("RGB"))
+            mime_type, data = self._encode(resized)  # larger than max_edge, or a format the API does not take
+
+        stats = {
+            "bytes_before"  : len(image_bytes),
+            "bytes_after"   : len(data),
+            "size_before"   : original_size,
+            "size_after"    : resized.size,
+            "mime_type"     : mime_type,
+            "tokens_before" : estimate_image_tokens(*original_size, detail="high"),
+            "tokens_after"  : estimate_image_tokens(*resized.size, detail=self.detail or "high")
+        }
+        return mime_type, data, stats
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Dict, Any, List
+
+"""
+A durable journal of the work done on every document, so an interrupted run (OOM, Ctrl-C, API
+outage) can continue where it stopped with --resume instead of starting over.
+
+Per document (path + sha256 of the content) it records:
+- documents: the output folder and the state "extracting" -> "extracted" -> "done"
+- pages:     the elements of every extracted PDF page, so the HTML is rebuilt without extracting
+             those pages again and the extraction continues at the first missing page
+- images:    every image whose OCR result is written, and the output file - those are not sent
+             to the OCR engine again, so completed AI calls are not paid twice
+
+The journal is SQLite in WAL mode: every page and image is committed on its own (cheap in WAL,
+and a crash loses at most the one in progress), and readers do not block the writer.
+
+It is always written. Without resume a document starts from scratch; with resume the recorded
+work is reused when the content is the same and the output folder still exists - else the
+document is reset.
+
+main methods:
+- begin(file_path, sha256, output_folder, resume): the recorded state of the document
+- record_page(file_path, page_num, elements), pages(file_path)
+- record_image(file_path, source_image, output_file), done_images(file_path)
+- set_state(file_path, state)
+- forget(file_path): removes the document, e.g. an upload of the conversion server that is finished
+"""
+
+STATES = ("extracting", "extracted", "done")
+
+
+class JobJournal:
+    def __init__(self, journal_path: str):
+        self.journal_path = journal_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(journal_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")  # WAL: durable on commit except on power loss, much faster
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                path          TEXT PRIMARY KEY,
+                sha256        TEXT NOT NULL,
+                output_folder TEXT NOT NULL,
+                state         TEXT NOT NULL,
+                started_at    REAL NOT NULL,
+                updated_at    REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                path      TEXT NOT NULL,
+                page_num  INTEGER NOT NULL,
+                elements  TEXT NOT NULL,
+                PRIMARY KEY (path, page_num)
+            );
+            CREATE TABLE IF NOT EXISTS images (
+                path         TEXT NOT NULL,
+                source_image TEXT NOT NULL,
+                output_file  TEXT NOT NULL,
+                done_at      REAL NOT NULL,
+                PRIMARY KEY (path, source_image)
+            );
+        """)
+
+    def _reset(self, path: str, sha256: str, output_folder: str) -> None:
+        now = time.time()
+        self._db.execute("DELETE FROM pages WHERE path = ?", (path,))
+        self._db.execute("DELETE FROM images WHERE path = ?", (path,))
+        self._db.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)",
+                         (path, sha256, output_folder, "extracting", now, now))
+
+    def begin(self, file_path: str, sha256: str, output_folder: str, resume: bool = False) -> Dict[str, Any]:
+        """
+        the state of the document: {"state", "pages" (number of extracted pages), "images" (number of done images)}.
+        A new, changed or moved document, or one without resume, starts as "extracting" with nothing done.
+        """
+        path = os.path.abspath(file_path)
+        with self._lock:
+            row = self._db.execute("SELECT * FROM documents WHERE path = ?", (path,)).fetchone()
+            if (not resume or row is None or row["sha256"] != sha256 or row["output_folder"] != output_folder
+                    or not os.path.isdir(output_folder)):
+                self._reset(path, sha256, output_folder)
+                self._db.commit()
+                return {"state": "extracting", "pages": 0, "images": 0}
+
+            pages = self._db.execute("SELECT COUNT(*) FROM pages WHERE path = ?", (path,)).fetchone()[0]
+            images = self._db.execute("SELECT COUNT(*) FROM images WHERE path = ?", (path,)).fetchone()[0]
+            return {"state": row["state"], "pages": pages, "images": images}
+
+    def started(self, file_path: str, sha256: str) -> bool:
+        """True when this content of the document is in the journal - its outputs belong to it"""
+        with self._lock:
+            row = self._db.execute("SELECT sha256 FROM documents WHERE path = ?", (os.path.abspath(file_path),)).fetchone()
+        return row is not None and row["sha256"] == sha256
+
+    def set_state(self, file_path: str, state: str) -> None:
+        if state not in STATES:
+            raise ValueError(f"Unknown journal state {state}, use one of {STATES}")
+        with self._lock:
+            self._db.execute("UPDATE documents SET state = ?, updated_at = ? WHERE path = ?",
+                             (state, time.time(), os.path.abspath(file_path)))
+            self._db.commit()
+
+    def record_page(self, file_path: str, page_num: int, elements: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+                             (os.path.abspath(file_path), page_num, json.dumps(elements)))
+            self._db.commit()
+
+    def pages(self, file_path: str) -> List[List[Dict[str, Any]]]:
+        """the elements of the extracted pages, in page order - only the pages before the first missing one"""
+        with self._lock:
+            rows = self._db.execute("SELECT page_num, elements FROM pages WHERE path = ? ORDER BY page_num",
+                                    (os.path.abspath(file_path),)).fetchall()
+        pages = []
+        for row in rows:
+            if row["page_num"] != len(pages):
+                break
+            pages.append(json.loads(row["elements"]))
+        return pages
+
+    def record_image(self, file_path: str, source_image: str, output_file: str) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)",
+                             (os.path.abspath(file_path), source_image, output_file, time.time()))
+            self._db.commit()
+
+    def done_images(self, file_path: str) -> Dict[str, str]:
+        """source_image -> output_file of the images with a result that still exists"""
+        with self._lock:
+            rows = self._db.execute("SELECT source_image, output_file FROM images WHERE path = ?",
+                                    (os.path.abspath(file_path),)).fetchall()
+        return {row["source_image"]: row["output_file"] for row in rows if os.path.exists(row["output_file"])}
+
+    def forget(self, file_path: str) -> None:
+        path = os.path.abspath(file_path)
+        with self._lock:
+            self._db.execute("DELETE FROM pages WHERE path = ?", (path,))
+            self._db.execute("DELETE FROM images WHERE path = ?", (path,))
+            self._db.execute("DELETE FROM documents WHERE path = ?", (path,))
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -1,10 +1,20 @@
 import os
+import re
+import html
 import logging
+import binascii
 from email import policy
-from email.parser import BytesParser
+from email.parser import BytesHeaderParser
 from bs4 import BeautifulSoup
 from PIL import Image
 import io
+from typing import Optional
+from classes.run_metrics import RunMetrics
+
+try:
+    import lxml.html
+except ImportError:  # optional, only needed for html_backend="lxml"
+    lxml = None
 
 """
 This class provides functionality to convert MHTML documents into HTML and JPEG images.
@@ -12,29 +22,46 @@ It parses the MHTML file, extracts HTML content and embedded images, and saves t
 the desired format. The extracted HTML content and images are processed and stored in
 specified output directories.
 
+The MHTML file is read as a stream, line by line: every part is decoded straight to disk
+(images) or to memory (html), so memory is bounded by the largest single part - not by
+the size of the archive. Parts that are neither html nor images are not even decoded.
+
+The <body> of the html parts is extracted with a selectable backend:
+- "html.parser": BeautifulSoup with the pure Python parser (default, the output is normalized html)
+- "lxml":        lxml.html, same idea but in C - needs the lxml package
+- "slice":       no parsing at all, the text between <body ...> and </body> is sliced out as it is
+In the same step src/href references to cid: and Content-Location urls of the saved images are
+rewritten to the local image file names.
+
+Pass a RunMetrics to get the "mhtml_convert" stage time, images and bytes in the run report.
+
 main method:
 - convert(mhtml_path, output_folder): Converts the MHTML document to HTML and JPEG images, saving them to the output folder.
 
 
 see also:
-- mhtml_to_text_and_images.py - similar class for MHTML conversion
+- pdf_to_text_and_images.py - similar class for PDF conversion
 """
+HTML_BACKENDS = ("html.parser", "lxml", "slice")
+
+_BODY_START = re.compile(r"<body\b[^>]*>", re.IGNORECASE)
+_REFERENCE  = re.compile(r"""(\b(?:src|href)\s*=\s*)(["'])(.*?)\2""", re.IGNORECASE | re.DOTALL)
+
+
 class MHTMLToTextAndImages:
-    def __init__(self, logger: logging.Logger):
+    def __init__(self, logger: logging.Logger, html_backend: str = "html.parser", metrics: Optional[RunMetrics] = None):
+        if html_backend not in HTML_BACKENDS:
+            raise ValueError(f"Unknown html backend {html_backend}, use one of {HTML_BACKENDS}")
+        if html_backend == "lxml" and lxml is None:
+            raise ValueError("html_backend lxml needs the lxml package: pip install lxml")
         self._logger = logger
+        self._html_backend = html_backend
+        self._metrics = metrics or RunMetrics()
 
     def _create_folder(self, folder_name):
         if not os.path.exists(folder_name):
             os.makedirs(folder_name)
 
-    def _generate_unique_filename(self, folder_name, base_name, extension):
-        counter = 1
-        new_name = base_name
-        while os.path.exists(os.path.join(folder_name, f"{new_name}.{extension}")):
-            new_name = f"{base_name}_{counter}"
-            counter += 1
-        return f"{new_name}.{extension}"
-
     def _get_identifier(self, part):
         content_id = part.get('Content-ID')
         content_location = part.get('Content-Location')
@@ -44,54 +71,249 @@ class MHTMLToTextAndImages:
             return content_location.split('/')[-1]
         return None
 
-    def _save_image(self, part, folder_name, image_name):
+    def _save_image(self, part, tmp_path, folder_name, image_name):
         image_path = os.path.join(folder_name, image_name)
         if part.get_content_type() == "image/jpeg":
-            with open(image_path, 'wb') as img_file:
-                img_file.write(part.get_payload(decode=True))
+            os.replace(tmp_path, image_path)
         else:
-            image = Image.open(io.BytesIO(part.get_payload(decode=True)))
-            image = image.convert('RGB')  # Konvertera till RGB om det behövs
-            image.save(image_path, 'JPEG')
+            with Image.open(tmp_path) as image:
+                image = image.convert('RGB')  # Konvertera till RGB om det behövs
+                image.save(image_path, 'JPEG')
+            os.remove(tmp_path)
         return image_name
 
-    def _save_resources(self, message, folder_name):
+    def _extract_body(self, html_part):
+        if self._html_backend == "slice":
+            start = _BODY_START.search(html_part)
+            if not start:
+                return None
+            end = html_part.lower().rfind("</body", start.end())
+            return html_part[start.end():end if end >= 0 else len(html_part)]
+
+        if self._html_backend == "lxml":
+            document = lxml.html.document_fromstring(html_part)
+            body = document.find("body")
+            if body is None:
+                return None
+            return (body.text or "") + "".join(lxml.html.tostring(child, encoding="unicode") for child in body)
+
+        soup = BeautifulSoup(html_part, 'html.parser')
+        body = soup.body
+        if body:
+            return "".join(str(tag) for tag in body.contents)
+        return None
+
+    def _rewrite_references(self, body, local_names):
+        def replace(match):
+            local_name = local_names.get(html.unescape(match.group(3)).strip())
+            if local_name is None:
+                return match.group(0)
+            return f"{match.group(1)}{match.group(2)}{local_name}{match.group(2)}"
+
+        return _REFERENCE.sub(replace, body)
+
+    def _add_local_names(self, headers, image_name, local_names):
+        content_id = headers.get('Content-ID')
+        content_location = headers.get('Content-Location')
+        if content_id:
+            local_names[f"cid:{content_id.strip('<>')}"] = image_name
+        if content_location:
+            local_names[content_location.strip()] = image_name
+
+    def _start_part(self, headers, folder_name, names):
+        """returns the _MimePart the body of this part is decoded into, or None if the part is not needed"""
+        content_type = headers.get_content_type()
+        encoding = str(headers.get('Content-Transfer-Encoding', '7bit')).strip().lower()
+
+        if content_type == "text/html":
+            return _MimePart(headers, encoding, io.BytesIO())
+
+        if not content_type.startswith("image/"):
+            return None
+
+        identifier = self._get_identifier(headers)
+        if not identifier:
+            return None
+
+        image_name = names.reserve(identifier, "jpeg")
+        tmp_path = os.path.join(folder_name, f".{image_name}.part")
+        return _MimePart(headers, encoding, open(tmp_path, 'wb'), tmp_path=tmp_path, image_name=image_name)
+
+    def _finish_part(self, part, folder_name, html_parts, resources, local_names):
+        part.close()
+        if part.tmp_path is None:
+            charset = part.headers.get_content_charset() or 'utf-8'
+            html_parts.append(part.output.getvalue().decode(charset, errors='replace'))
+            return
+
+        try:
+            resources.append(self._save_image(part.headers, part.tmp_path, folder_name, part.image_name))
+            self._add_local_names(part.headers, part.image_name, local_names)
+        except OSError as e:  # not an image PIL can read - skip it, like a part without identifier
+            self._logger.warning(f"Could not convert {part.image_name}: {e}")
+            if os.path.exists(part.tmp_path):
+                os.remove(part.tmp_path)
+
+    def _read_headers(self, mhtml_file, first_lines=()):
+        header_lines = list(first_lines)
+        for line in mhtml_file:
+            header_lines.append(line)
+            if not line.strip():
+                break
+        return BytesHeaderParser(policy=policy.default).parsebytes(b"".join(header_lines))
+
+    def _decode_parts(self, mhtml_file, folder_name):
+        """saves the images, returns (decoded html parts, image names, cid:/url -> image name)"""
         resources = []
-        body_parts = []
+        html_parts = []
+        local_names = {}  # cid:... and Content-Location url -> saved image name
+        names = _NameRegistry(folder_name)
 
-        for part in message.walk():
-            content_type = part.get_content_type()
+        top_headers = self._read_headers(mhtml_file)
+        boundaries = []
+        part = None
+        state = "skip"  # "headers" of a part, its "body" or "skip" (preamble, epilogue, unused parts)
 
-            if content_type == "text/html":
-                html_part = part.get_payload(decode=True).decode()
-                soup = BeautifulSoup(html_part, 'html.parser')
-                body = soup.body
-                if body:
-                    body_parts.append("".join(str(tag) for tag in body.contents))
-                continue
+        if top_headers.get_content_maintype() == "multipart":
+            boundaries.append(top_headers.get_boundary().encode())
+        else:
+            part = self._start_part(top_headers, folder_name, names)
+            state = "body" if part is not None else "skip"
 
-            if not content_type.startswith("image/"):
-                continue
+        header_lines = []
+        for line in mhtml_file:
+            if line.startswith(b"--") and boundaries:
+                delimiter = line.rstrip(b" \t\r\n")
+                matched = None
+                for depth, boundary in enumerate(boundaries):
+                    if delimiter == b"--" + boundary or delimiter == b"--" + boundary + b"--":
+                        matched = depth
+                        break
 
-            identifier = self._get_identifier(part)
-            if not identifier:
-                continue
+                if matched is not None:
+                    if part is not None:
+                        self._finish_part(part, folder_name, html_parts, resources, local_names)
+                        part = None
+                    del boundaries[matched + 1:]
+                    if delimiter.endswith(b"--") and delimiter != b"--" + boundaries[-1]:
+                        boundaries.pop()  # close delimiter, what follows is epilogue
+                        state = "skip"
+                    else:
+                        state = "headers"
+                        header_lines = []
+                    continue
 
-            image_name = self._generate_unique_filename(folder_name, identifier, "jpeg")
-            saved_image_name = self._save_image(part, folder_name, image_name)
-            resources.append(saved_image_name)
+            if state == "headers":
+                header_lines.append(line)
+                if line.strip():
+                    continue
+                headers = self._read_headers(iter(()), header_lines)
+                if headers.get_content_maintype() == "multipart":
+                    boundaries.append(headers.get_boundary().encode())
+                    state = "skip"  # preamble of the nested multipart
+                else:
+                    part = self._start_part(headers, folder_name, names)
+                    state = "body" if part is not None else "skip"
+
+            elif state == "body":
+                part.feed(line)
+
+        if part is not None:
+            self._finish_part(part, folder_name, html_parts, resources, local_names)
+        return html_parts, resources, local_names
+
+    def _save_resources(self, mhtml_file, folder_name):
+        html_parts, resources, local_names = self._decode_parts(mhtml_file, folder_name)
+
+        # the html usually comes before the images, so the body is extracted when all image names are known
+        body_parts = []
+        for html_part in html_parts:
+            body = self._extract_body(html_part)
+            if body:
+                body_parts.append(self._rewrite_references(body, local_names))
 
         html_content = "".join(body_parts)
         return html_content, resources
 
     def convert(self, mhtml_path, output_folder):
         self._create_folder(output_folder)
-        with open(mhtml_path, 'rb') as mhtml_file:
-            message = BytesParser(policy=policy.default).parse(mhtml_file)
+        with self._metrics.stage("mhtml_convert"):
+            with open(mhtml_path, 'rb') as mhtml_file:
+                html_content, resources = self._save_resources(mhtml_file, output_folder)
 
-        html_content, resources = self._save_resources(message, output_folder)
-        html_filename = os.path.join(output_folder, 'output.html')
-        with open(html_filename, 'w') as html_file:
-            html_file.write(html_content)
+            html_filename = os.path.join(output_folder, 'output.html')
+            with open(html_filename, 'w') as html_file:
+                html_file.write(html_content)
 
+        self._metrics.add("bytes_read", os.path.getsize(mhtml_path))
+        self._metrics.add("images_extracted", len(resources))
+        self._metrics.add("bytes_written", os.path.getsize(html_filename) +
+                          sum(os.path.getsize(os.path.join(output_folder, name)) for name in resources))
         return html_filename, resources
+
+
+class _NameRegistry:
+    """
+    Unique file names in a folder without probing the file system per name: the folder is listed
+    once, and the next free counter is remembered per base name.
+    """
+    def __init__(self, folder_name):
+        self._used = set(os.listdir(folder_name)) if os.path.isdir(folder_name) else set()
+        self._next_counter = {}
+
+    def reserve(self, base_name, extension):
+        new_name = f"{base_name}.{extension}"
+        counter = self._next_counter.get(base_name, 1)
+        while new_name in self._used:
+            new_name = f"{base_name}_{counter}.{extension}"
+            counter += 1
+        self._next_counter[base_name] = counter
+        self._used.add(new_name)
+        return new_name
+
+
+class _MimePart:
+    """decodes the body of one MIME part (base64, quoted-printable or as is) line by line into output"""
+    def __init__(self, headers, encoding, output, tmp_path=None, image_name=None):
+        self.headers = headers
+        self.output = output
+        self.tmp_path = tmp_path
+        self.image_name = image_name
+        self._encoding = encoding
+        self._base64_rest = b""
+        self._pending_eol = b""  # the line break before a delimiter belongs to the delimiter, not the body
+
+    def feed(self, line):
+        if self._encoding == "base64":
+            data = self._base64_rest + b"".join(line.split())
+            usable = len(data) - len(data) % 4
+            self._base64_rest = data[usable:]
+            if usable:
+                self.output.write(binascii.a2b_base64(data[:usable]))
+            return
+
+        content = line.rstrip(b"\r\n")
+        eol = line[len(content):]
+        self.output.write(self._pending_eol)
+
+        if self._encoding == "quoted-printable":
+            content = content.rstrip(b" \t")
+            if content.endswith(b"="):  # soft line break
+                self.output.write(binascii.a2b_qp(content[:-1]))
+                self._pending_eol = b""
+                return
+            content = binascii.a2b_qp(content)
+            eol = b"\n" if eol else b""  # a decoded line ends with \n, also in a \r\n archive - like the email package
+
+        self.output.write(content)
+        self._pending_eol = eol
+
+    def close(self):
+        if self._base64_rest:
+            rest = self._base64_rest + b"=" * (-len(self._base64_rest) % 4)
+            try:
+                self.output.write(binascii.a2b_base64(rest))
+            except binascii.Error:
+                pass  # garbage at the end of the part, the decoded data so far is what we have
+        if self.tmp_path is not None:
+            self.output.close()
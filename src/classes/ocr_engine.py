@@ -0,0 +1,122 @@
+import os
+import time
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, Callable, List, Optional, Protocol, Tuple
+
+from classes.ai_image_processor import AIImageProcessor
+from classes.tesseract_image_processor import TesseractImageProcessor
+from classes.tesseract_batch_runner import TesseractBatchRunner
+from classes.hybrid_ocr_router import HybridOCRRouter
+
+"""
+The common interface of the OCR engines, and a factory that creates them by name.
+
+Every engine has a name and two methods:
+- recognize(source_image): {"markdown", "model", "tokens", "bytes_uploaded", ...} - nothing is written
+- process_image(source_image, output_file): writes the result to <output_file>__<infix>.md, returns that path
+- close() (optional): stops the worker threads and processes of the engine, see close_engine()
+
+Engines:
+- "ai":        AIImageProcessor, every image to the OpenAI model
+- "tesseract": TesseractImageProcessor, local only
+- "hybrid":    HybridOCRRouter, Tesseract first and the AI when Tesseract is unsure
+- "fake":      FakeOCREngine, deterministic and local - for tests and benchmarks of the pipeline itself
+
+process_jobs(engine, jobs, max_workers, on_done) runs a list of (source_image, output_file) the fastest way the
+engine supports: batched through the tesseract pool, routed by the hybrid router or in a thread pool.
+"""
+
+ENGINE_NAMES = ("ai", "tesseract", "hybrid", "fake")
+
+
+class OCREngine(Protocol):
+    name: str
+
+    def recognize(self, source_image: str) -> Dict[str, Any]:
+        ...
+
+    def process_image(self, source_image: str, output_file: str) -> str:
+        ...
+
+
+class FakeOCREngine:
+    """returns a fixed markdown per image content, after an optional simulated latency"""
+    name = "fake"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def recognize(self, source_image: str) -> Dict[str, Any]:
+        with open(source_image, "rb") as image_file:
+            digest = hashlib.sha256(image_file.read()).hexdigest()[:16]
+        if self.latency:
+            time.sleep(self.latency)
+        markdown = f"| fake ocr |\n|---|\n| {os.path.basename(source_image)} {digest} |\n"
+        return {"markdown": markdown, "model": "fake", "tokens": 0, "bytes_uploaded": 0}
+
+    def process_image(self, source_image: str, output_file: str) -> str:
+        result = self.recognize(source_image)
+        if not output_file:
+            output_file = os.path.splitext(os.path.basename(source_image))[0] + ".md"
+        name, ext = os.path.splitext(output_file)
+        output_file = f"{name}___model_{result['model']}_tokens_{result['tokens']}{ext}"
+
+        with open(output_file, "w") as file:
+            file.write(result["markdown"])
+        return output_file
+
+
+def create_ocr_engine(name: str, logger: logging.Logger, ai_factory: Optional[Callable] = None, tesseract_workers: int = 0,
+                      min_confidence: float = 70.0, min_words: int = 5, fake_latency: float = 0.0):
+    if name not in ENGINE_NAMES:
+        raise ValueError(f"Unknown OCR engine {name}, use one of {ENGINE_NAMES}")
+
+    ai_factory = ai_factory or AIImageProcessor
+
+    def create_tesseract():
+        tesseract = TesseractImageProcessor()
+        if tesseract_workers > 0:
+            tesseract.runner = TesseractBatchRunner(tesseract.lang, workers=tesseract_workers, logger=logger)
+        return tesseract
+
+    if name == "ai":
+        return ai_factory()
+    if name == "tesseract":
+        return create_tesseract()
+    if name == "hybrid":
+        return HybridOCRRouter(create_tesseract(), ai_factory, logger, min_confidence=min_confidence, min_words=min_words)
+    return FakeOCREngine(latency=fake_latency)
+
+
+def close_engine(engine) -> None:
+    """stops the pools of an engine that has them (tesseract runner), a no-op for the others"""
+    close = getattr(engine, "close", None)
+    if close is not None:
+        close()
+
+
+def process_jobs(engine, jobs: List[Tuple[str, str]], max_workers: int = 4,
+                 on_done: Optional[Callable[[Tuple[str, str], str], None]] = None) -> List[str]:
+    """the written output files, in the order of jobs - on_done(job, output_file) is called as each one is written"""
+    if isinstance(engine, TesseractImageProcessor):
+        output_files = engine.process_images(jobs)  # batched through the TesseractBatchRunner
+        if on_done is not None:
+            for job, output_file in zip(jobs, output_files):
+                on_done(job, output_file)
+        return output_files
+    if hasattr(engine, "process_images"):  # HybridOCRRouter, PerceptualReuseEngine
+        return engine.process_images(jobs, max_workers=max_workers, on_done=on_done)
+
+    # the OpenAI client is thread safe - the pool bounds the number of requests in flight.
+    # the results are returned in the same order as jobs, whatever order they finish in
+    output_files = [None] * len(jobs)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(engine.process_image, *job): index for index, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            index = futures[future]
+            output_files[index] = future.result()
+            if on_done is not None:
+                on_done(jobs[index], output_files[index])
+    return output_files
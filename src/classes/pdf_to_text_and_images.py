@@ -2,10 +2,14 @@
 
 import fitz  # PyMuPDF
 import os
+import math
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 from io import BytesIO
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Iterator, Iterable, Optional, Callable
 import logging
+from classes.run_metrics import RunMetrics
 
 """
 This class provides functionality to convert PDF documents into HTML and JPEG images.
@@ -15,22 +19,58 @@ in specified output directories.
 
 main method:
 - convert(pdf_path, output_folder): Converts the PDF document to HTML and JPEG images, saving them to the output folder.
+- extract_images_and_text(pdf_path, output_folder, workers): with workers > 1 the pages are split in ranges
+  over a pool of processes, each with its own fitz.Document. The result is identical to the serial run.
+- iter_pages_elements(pdf_path, output_folder, workers): same as above, but yields one page at a time.
+- generate_html(pages_elements, output_html_path): writes the HTML page by page, feed it iter_pages_elements()
+  to keep memory flat regardless of the number of pages.
 
+Pass a RunMetrics to get the time of the "pdf_extract" and "html_write" stages, pages, images and bytes in the run report.
 
 see also:
 - pdf_to_text_and_images.py - similar class for PDF conversion
 """
 
 class PDFToTextAndImages:
-    def __init__(self, logger: logging.Logger):
+    def __init__(self, logger: logging.Logger, metrics: Optional[RunMetrics] = None):
         self._logger = logger
+        self._metrics = metrics or RunMetrics()
 
-    def _save_image_as_jpeg(self, image_bytes: bytes, output_folder: str, image_filename: str) -> str:
-        image = Image.open(BytesIO(image_bytes))
+    def _needs_transcoding(self, base_image: Dict[str, Any]) -> bool:
+        # a plain gray or RGB JPEG without a soft mask (alpha) can be written as it is stored in the PDF
+        if base_image["ext"] not in ("jpeg", "jpg"):
+            return True
+        if base_image.get("colorspace") not in (1, 3):  # 4 = CMYK, most viewers and the AI handle it badly
+            return True
+        return bool(base_image.get("smask"))
+
+    def _save_image_as_jpeg(self, doc: fitz.Document, base_image: Dict[str, Any], output_folder: str, image_filename: str) -> Tuple[str, bool]:
+        """returns (jpeg_filename, transcoded) - transcoded is False when the JPEG bytes were written untouched"""
         jpeg_filename = os.path.splitext(image_filename)[0] + '.jpeg'
         jpeg_path = os.path.join(output_folder, jpeg_filename)
+
+        if not self._needs_transcoding(base_image):
+            with open(jpeg_path, "wb") as jpeg_file:
+                jpeg_file.write(base_image["image"])
+            return jpeg_filename, False
+
+        image = Image.open(BytesIO(base_image["image"]))
+        if base_image.get("smask"):
+            # the alpha channel is stored as a separate image - put the image on white instead of black
+            mask = Image.open(BytesIO(doc.extract_image(base_image["smask"])["image"])).convert("L")
+            if mask.size != image.size:
+                mask = mask.resize(image.size)
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image.convert("RGB"), mask=mask)
+            image = background
+        elif image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+
         image.convert("RGB").save(jpeg_path, "JPEG")
-        return jpeg_filename
+        return jpeg_filename, True
 
     def _save_vector_as_svg(self, page: fitz.Page, block: Dict[str, Any], output_folder: str, svg_filename: str) -> str:
         self._logger.warning("SVG is not tested. Please double check the result")
@@ -39,43 +79,65 @@ class PDFToTextAndImages:
             svg_file.write(page.get_svg_image(block))
         return svg_filename
 
-    def _find_matching_element(self, elements: List[Dict[str, Any]], y_pos: float, y_tolerance: float) -> Dict[str, Any]:
-        for element in elements:
-            if element["type"] == "text" and abs(element["bbox"][1] - y_pos) <= y_tolerance:
-                return element
-        return None
-
-    def _extract_text_elements_from_page(self, block: Dict[str, Any], elements: List[Dict[str, Any]], y_tolerance: float) -> None:
-        text_lines = block["lines"]
-        for line in text_lines:
+    def _extract_text_elements_from_page(self, block: Dict[str, Any], elements: List[Dict[str, Any]], line_index: "_TextLineIndex") -> None:
+        for line in block["lines"]:
             spans = line["spans"]
-            for span in spans:
-                y_pos = block["bbox"][1]
-                matching_element = self._find_matching_element(elements, y_pos, y_tolerance)
-                if matching_element:
-                    matching_element["content"] += " " + span["text"]
-                else:
-                    elements.append({
-                        "type"      : "text",
-                        "content"   : span["text"],
-                        "bbox"      : block["bbox"],
-                        "font_size" : span["size"],
-                        "font"      : span["font"]
-                    })
-
-    def _extract_image_elements_from_page(self, doc: fitz.Document, page: fitz.Page, page_num: int, output_folder: str, elements: List[Dict[str, Any]]) -> None:
+            if not spans:
+                continue
+
+            # the spans of a line are consecutive pieces of the same text, they carry their own spaces
+            line_text = "".join(span["text"] for span in spans)
+            if not line_text.strip():
+                continue  # whitespace only, would be an empty <p>
+            y_pos = line["bbox"][1]
+            matching_element = line_index.find(y_pos)
+            if matching_element:
+                matching_element["content"] += " " + line_text
+            else:
+                element = {
+                    "type"      : "text",
+                    "content"   : line_text,
+                    "bbox"      : line["bbox"],
+                    "font_size" : spans[0]["size"],
+                    "font"      : spans[0]["font"]
+                }
+                elements.append(element)
+                line_index.add(element)
+
+    def _find_image_owners(self, doc: fitz.Document) -> Dict[int, Tuple[int, int]]:
+        """xref -> (page_num, img_index) of the first occurrence of every image in the document"""
+        image_owners = {}
+        occurrences = 0
+        for page_num in range(len(doc)):
+            for img_index, img in enumerate(doc.get_page_images(page_num, full=True)):
+                image_owners.setdefault(img[0], (page_num, img_index))
+                occurrences += 1
+        if occurrences > len(image_owners):
+            self._logger.info(f"{occurrences} image occurrences, {len(image_owners)} unique images - repeats reuse the first file")
+        return image_owners
+
+    def _extract_image_elements_from_page(self, doc: fitz.Document, page: fitz.Page, page_num: int, output_folder: str, elements: List[Dict[str, Any]], image_owners: Dict[int, Tuple[int, int]]) -> None:
         image_list = page.get_images(full=True)
         for img_index, img in enumerate(image_list):
             xref = img[0]
-            base_image     = doc.extract_image(xref)
-            image_bytes    = base_image["image"]
-            image_filename = f"image_{page_num+1}_{img_index+1}.jpeg"
-            jpeg_filename  = self._save_image_as_jpeg(image_bytes, output_folder, image_filename)
+            owner_page_num, owner_img_index = image_owners.get(xref, (page_num, img_index))
+            image_filename = f"image_{owner_page_num+1}_{owner_img_index+1}.jpeg"
+
+            # the same xref (logo, header banner ...) is decoded and written only once, at its first occurrence
+            if (owner_page_num, owner_img_index) == (page_num, img_index):
+                base_image     = doc.extract_image(xref)
+                jpeg_filename, transcoded = self._save_image_as_jpeg(doc, base_image, output_folder, image_filename)
+                encoding       = "transcoded" if transcoded else "passthrough"
+            else:
+                jpeg_filename  = image_filename
+                encoding       = "reused"
+
             bbox = page.get_image_bbox(img)
             elements.append({
-                "type"    : "image",
-                "content" : jpeg_filename,
-                "bbox"    : [bbox.x0, bbox.y0, bbox.x1, bbox.y1]
+                "type"     : "image",
+                "content"  : jpeg_filename,
+                "bbox"     : [bbox.x0, bbox.y0, bbox.x1, bbox.y1],
+                "encoding" : encoding
             })
 
     def _extract_vector_elements_from_page(self, page: fitz.Page, block: Dict[str, Any], page_num: int, output_folder: str, elements: List[Dict[str, Any]]) -> None:
@@ -87,56 +149,169 @@ class PDFToTextAndImages:
             "bbox"    : block["bbox"]
         })
 
-    def _extract_elements_from_page(self, doc: fitz.Document, page_num: int, output_folder: str) -> List[Dict[str, Any]]:
+    def _extract_elements_from_page(self, doc: fitz.Document, page_num: int, output_folder: str, image_owners: Dict[int, Tuple[int, int]]) -> List[Dict[str, Any]]:
         elements = []
         page = doc.load_page(page_num)
         blocks = page.get_text("dict")["blocks"]
 
         y_tolerance = 2  # Tolerance in y-direction
+        line_index = _TextLineIndex(y_tolerance)
 
         for block in blocks:
             if block["type"] == 0:  # 0 = Text block
-                self._extract_text_elements_from_page(block, elements, y_tolerance)
+                self._extract_text_elements_from_page(block, elements, line_index)
 
             elif block["type"] == 2:  # 2 = Vector block
                 self._extract_vector_elements_from_page(page, block, page_num, output_folder, elements)
 
-        self._extract_image_elements_from_page(doc, page, page_num, output_folder, elements)
+        self._extract_image_elements_from_page(doc, page, page_num, output_folder, elements, image_owners)
 
         sorted_elements = sorted(elements, key=lambda element: element["bbox"][1])
         return sorted_elements
 
-    def extract_images_and_text(self, pdf_path: str, output_folder: str) -> List[List[Dict[str, Any]]]:
+    def _split_page_ranges(self, page_count: int, workers: int, start_page: int = 0) -> List[Tuple[int, int]]:
+        # a few ranges per worker, so one slow range (many images) does not leave the other workers idle
+        chunk_size = max(1, -(-(page_count - start_page) // (workers * 4)))
+        return [(start, min(start + chunk_size, page_count)) for start in range(start_page, page_count, chunk_size)]
+
+    def iter_pages_elements(self, pdf_path: str, output_folder: str, workers: int = 1, start_page: int = 0) -> Iterator[List[Dict[str, Any]]]:
+        """
+        yields the elements of one page at a time, in page order - nothing is kept after it is yielded.
+        start_page skips the pages before it, e.g. to resume an interrupted extraction - the image names
+        do not depend on where the extraction starts.
+        """
+        image_counts = {"transcoded": 0, "passthrough": 0, "reused": 0}
+        self._metrics.add("bytes_read", os.path.getsize(pdf_path))
+
+        pages = self._iter_extracted_pages(pdf_path, output_folder, workers, start_page)
+        while True:
+            with self._metrics.stage("pdf_extract"):  # only the extraction, not what the consumer does between pages
+                page_elements = next(pages, None)
+            if page_elements is None:
+                break
+
+            for element in page_elements:
+                if element["type"] == "image":
+                    image_counts[element["encoding"]] += 1
+                if element["type"] == "vector" or element.get("encoding") in ("transcoded", "passthrough"):
+                    self._metrics.add("bytes_written", os.path.getsize(os.path.join(output_folder, element["content"])))
+            self._metrics.add("pdf_pages")
+            yield page_elements
+
+        for encoding, count in image_counts.items():
+            self._metrics.add(f"pdf_images_{encoding}", count)
+        self._metrics.add("images_extracted", image_counts["transcoded"] + image_counts["passthrough"])
+
+        self._logger.info(f"Images in {pdf_path}: {image_counts['transcoded']} transcoded, "
+                          f"{image_counts['passthrough']} passed through as JPEG, {image_counts['reused']} reused")
+
+    def _iter_extracted_pages(self, pdf_path: str, output_folder: str, workers: int, start_page: int = 0) -> Iterator[List[Dict[str, Any]]]:
         doc = fitz.open(pdf_path)
-        pages_elements = []
+        page_count = len(doc)
+        image_owners = self._find_image_owners(doc)
 
-        for page_num in range(len(doc)):
-            page_elements = self._extract_elements_from_page(doc, page_num, output_folder)
-            pages_elements.append(page_elements)
+        if workers <= 1 or page_count - start_page < 2:
+            try:
+                for page_num in range(start_page, page_count):
+                    yield self._extract_elements_from_page(doc, page_num, output_folder, image_owners)
+            finally:
+                doc.close()
+            return
 
-        return pages_elements
+        doc.close()  # every worker opens its own document, fitz objects can not be shared between processes
+        page_ranges = self._split_page_ranges(page_count, workers, start_page)
+        self._logger.info(f"Extracting {page_count - start_page} pages in {len(page_ranges)} ranges with {workers} processes")
 
-    def generate_html(self, pages_elements: List[List[Dict[str, Any]]], output_html_path: str) -> None:
-        html_content = "<html><body>"
+        # only a window of ranges is in flight, so finished but not yet consumed pages do not pile up
+        max_pending = workers * 2
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for start, stop in page_ranges:
+                pending.append(executor.submit(_extract_page_range, pdf_path, output_folder, start, stop, image_owners))
+                if len(pending) >= max_pending:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
 
-        for page_num, elements in enumerate(pages_elements):
-            html_content += f'<div class="page" id="page_{page_num+1}">'
-            for element in elements:
-                if element["type"] == "text":
-                    font_size        = round(element["font_size"], 1)
-                    font             = "'Helvetica Neue', Helvetica, Arial, sans-serif"
-                    content_fixed_nl = element["content"].replace("\n", "<br>")
-                    html_content    += f'<p style="font-size:{font_size}px; font-family:{font};">{content_fixed_nl}</p>'
+    def extract_images_and_text(self, pdf_path: str, output_folder: str, workers: int = 1) -> List[List[Dict[str, Any]]]:
+        return list(self.iter_pages_elements(pdf_path, output_folder, workers))
 
-                elif element["type"] == "image":
-                    html_content += f'<img src="{element["content"]}" alt="{element["content"]}"><br>'
+    def _page_to_html(self, page_num: int, elements: List[Dict[str, Any]]) -> str:
+        html_parts = [f'<div class="page" id="page_{page_num+1}">']
+        for element in elements:
+            if element["type"] == "text":
+                font_size        = round(element["font_size"], 1)
+                font             = "'Helvetica Neue', Helvetica, Arial, sans-serif"
+                content_fixed_nl = element["content"].replace("\n", "<br>")
+                html_parts.append(f'<p style="font-size:{font_size}px; font-family:{font};">{content_fixed_nl}</p>')
 
-                elif element["type"] == "vector":
-                    html_content += f'<img src="{element["content"]}" alt="vector"><br>'
+            elif element["type"] == "image":
+                html_parts.append(f'<img src="{element["content"]}" alt="{element["content"]}"><br>')
 
-            html_content += '</div><div style="page-break-after: always;"></div>'
+            elif element["type"] == "vector":
+                html_parts.append(f'<img src="{element["content"]}" alt="vector"><br>')
 
-        html_content += "</body></html>"
+        html_parts.append('</div><div style="page-break-after: always;"></div>')
+        return "".join(html_parts)
 
+    def generate_html(self, pages_elements: Iterable[List[Dict[str, Any]]], output_html_path: str,
+                      on_page: Optional[Callable[[int, str], None]] = None) -> None:
+        """
+        pages_elements can be a list or the iter_pages_elements() generator - every page is written as it arrives.
+        on_page(page_num, html) is called after each page is written, e.g. to stream it to a client.
+        """
         with open(output_html_path, "w", encoding="utf-8") as html_file:
-            html_file.write(html_content)
+            html_file.write("<html><body>")
+
+            for page_num, elements in enumerate(pages_elements):
+                with self._metrics.stage("html_write"):
+                    page_html = self._page_to_html(page_num, elements)
+                    html_file.write(page_html)
+                    html_file.flush()
+                if on_page is not None:
+                    on_page(page_num, page_html)
+
+            html_file.write("</body></html>")
+        self._metrics.add("bytes_written", os.path.getsize(output_html_path))
+
+
+def _extract_page_range(pdf_path: str, output_folder: str, start: int, stop: int, image_owners: Dict[int, Tuple[int, int]]) -> List[List[Dict[str, Any]]]:
+    """worker for PDFToTextAndImages.iter_pages_elements(workers > 1) - runs in a separate process"""
+    converter = PDFToTextAndImages(logging.getLogger("pdf_to_html_converter"))
+    doc = fitz.open(pdf_path)
+    try:
+        return [converter._extract_elements_from_page(doc, page_num, output_folder, image_owners) for page_num in range(start, stop)]
+    finally:
+        doc.close()
+
+
+class _TextLineIndex:
+    """
+    Text elements of one page bucketed on y (bucket height = y_tolerance), so finding the element a line
+    belongs to only looks at three buckets instead of every element on the page.
+    find() returns the first added element within y_tolerance - the same one a linear scan would return.
+    """
+    def __init__(self, y_tolerance: float):
+        self._y_tolerance = y_tolerance
+        self._bucket_size = y_tolerance if y_tolerance > 0 else 1
+        self._buckets: Dict[int, List[Tuple[int, Dict[str, Any]]]] = {}
+        self._count = 0
+
+    def _bucket(self, y_pos: float) -> int:
+        return math.floor(y_pos / self._bucket_size)
+
+    def add(self, element: Dict[str, Any]) -> None:
+        self._buckets.setdefault(self._bucket(element["bbox"][1]), []).append((self._count, element))
+        self._count += 1
+
+    def find(self, y_pos: float) -> Optional[Dict[str, Any]]:
+        found_order, found_element = self._count, None
+        bucket = self._bucket(y_pos)
+        for neighbour in (bucket - 1, bucket, bucket + 1):
+            for order, element in self._buckets.get(neighbour, ()):
+                if order >= found_order:
+                    break  # the buckets are in insertion order
+                if abs(element["bbox"][1] - y_pos) <= self._y_tolerance:
+                    found_order, found_element = order, element
+                    break
+        return found_element
@@ -0,0 +1,300 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Any, Callable, List, Optional, Tuple
+import numpy as np
+from PIL import Image, ImageFilter
+
+from classes.ocr_engine import close_engine, process_jobs
+
+"""
+Reuses the OCR result of a near duplicate image: the same screenshot recompressed, rescaled or saved
+under another name or Content-ID. The exact byte cache (ai_result_cache.py) misses those. Off unless
+--phash-index is given.
+
+Every image gets a dHash: the image in grayscale, downscaled to (hash_size+1) x hash_size, one bit
+per pixel for "brighter than the right neighbour". Two images are candidates when the Hamming
+distance of their hashes is at most max_distance and the aspect ratios are about the same.
+
+A 64 bit dHash only sees the layout, not the text: two screens of the same dialog with another label
+are at distance 0. So every candidate is confirmed on the pixels before its result is reused: both
+images in full size grayscale, the larger one downscaled to the smaller, a 3x3 blur against JPEG
+noise - and no pixel may differ by more than max_pixel_difference. Recompression (JPEG quality 40)
+and rescaling stay below ~20, one changed character in a small font is 40+. A candidate whose image
+is gone (moved, deleted temp folder) can not be confirmed and is not reused.
+
+Lookup is a multi-index: the hash is split in max_distance + 1 chunks, and every chunk value points
+to the entries that have it. Two hashes within max_distance bits must have at least one chunk in
+common (pigeonhole), so only the entries in those buckets are compared - about 1% of them with
+the defaults, a lookup in 100k images takes ~2ms.
+
+The hashes and the markdown are stored in SQLite, the index is built in memory when it is opened.
+Results are only reused within the same scope: the engine and the settings that decide its answer
+(model, prompt, upload settings - see ocr_fingerprint() in app.py), so a Tesseract text is not
+reused for the AI and a gpt-4o answer not for another model. Near duplicates within one batch (the
+same screenshot twice in a document) are sent to the engine once.
+
+The exact byte cache comes first: an image the engine has cached (engine.is_cached) goes to the
+engine. A reused result is written as <image>___reused_from_<original>.md - no model and no token
+count, none were spent on it.
+
+main methods:
+- dhash(image_path, hash_size): the hash and the size of an image
+- pixel_difference(image_path, other_path): the largest gray value difference of two images
+- PerceptualHashIndex.find(scope, image_hash, width, height, confirm): the nearest confirmed entry within max_distance, or None
+- PerceptualHashIndex.add(scope, image_hash, width, height, source_image, markdown)
+- PerceptualReuseEngine: an OCR engine wrapper, see ocr_engine.py - reuses or delegates and indexes
+"""
+
+MAX_ASPECT_DIFFERENCE = 0.05  # 5% - a rescale with rounding, not another screen format
+MAX_PIXEL_DIFFERENCE = 32      # gray values 0-255, after the blur
+
+
+def dhash(image_path: str, hash_size: int = 8) -> Tuple[int, int, int]:
+    """returns (hash, width, height)"""
+    with Image.open(image_path) as image:
+        width, height = image.size
+        image.draft("L", (hash_size * 4, hash_size * 4))
+        small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big"), width, height
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _blurred_gray(image_path: str, size: Tuple[int, int]) -> np.ndarray:
+    with Image.open(image_path) as image:
+        gray = image.convert("L")
+    if gray.size != size:
+        gray = gray.resize(size, Image.LANCZOS)
+    return np.asarray(gray.filter(ImageFilter.BoxBlur(1)), dtype=np.int16)
+
+
+def pixel_difference(image_path: str, other_path: str) -> int:
+    """the largest gray value difference, compared at the size of the smaller image"""
+    with Image.open(image_path) as image, Image.open(other_path) as other:
+        size = min(image.size, other.size, key=lambda s: s[0] * s[1])
+    return int(np.abs(_blurred_gray(image_path, size) - _blurred_gray(other_path, size)).max())
+
+
+class PerceptualHashIndex:
+    def __init__(self, index_path: str, max_distance: int = 6, hash_size: int = 8,
+                 max_pixel_difference: int = MAX_PIXEL_DIFFERENCE):
+        self.index_path = index_path
+        self.max_distance = max_distance
+        self.max_pixel_difference = max_pixel_difference
+        self.hash_size = hash_size
+        hash_bits = hash_size * hash_size
+        chunk_count = max_distance + 1
+        bounds = [round(i * hash_bits / chunk_count) for i in range(chunk_count + 1)]
+        self._chunks = [(start, (1 << (stop - start)) - 1) for start, stop in zip(bounds, bounds[1:])]  # (shift, mask)
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in self._chunks]
+        self._entries: Dict[int, Tuple[str, int, float]] = {}  # id -> (scope, hash, aspect ratio)
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(index_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                id           INTEGER PRIMARY KEY,
+                engine       TEXT NOT NULL,
+                hash         TEXT NOT NULL,
+                width        INTEGER NOT NULL,
+                height       INTEGER NOT NULL,
+                source_image TEXT NOT NULL,
+                markdown     TEXT NOT NULL,
+                added_at     REAL NOT NULL
+            );
+        """)
+        for row in self._db.execute("SELECT id, engine, hash, width, height FROM images"):
+            self._index(row["id"], row["engine"], int(row["hash"], 16), row["width"] / row["height"])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _chunk_values(self, image_hash: int):
+        return [(image_hash >> shift) & mask for shift, mask in self._chunks]
+
+    def _index(self, entry_id: int, engine: str, image_hash: int, aspect: float) -> None:
+        self._entries[entry_id] = (engine, image_hash, aspect)
+        for bucket, value in zip(self._buckets, self._chunk_values(image_hash)):
+            bucket.setdefault(value, []).append(entry_id)
+
+    def find(self, engine: str, image_hash: int, width: int, height: int,
+             confirm: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Optional[Dict[str, Any]]:
+        """the nearest entry within max_distance that confirm(entry) accepts - ties go to the oldest, same answer every run"""
+        aspect = width / height
+        with self._lock:
+            candidates = set()
+            for bucket, value in zip(self._buckets, self._chunk_values(image_hash)):
+                candidates.update(bucket.get(value, ()))
+            near = []
+            for entry_id in candidates:
+                entry_engine, entry_hash, entry_aspect = self._entries[entry_id]
+                if entry_engine != engine or abs(entry_aspect - aspect) > MAX_ASPECT_DIFFERENCE * aspect:
+                    continue
+                distance = hamming_distance(image_hash, entry_hash)
+                if distance <= self.max_distance:
+                    near.append((distance, entry_id))
+
+        for distance, entry_id in sorted(near):
+            with self._lock:
+                row = self._db.execute("SELECT * FROM images WHERE id = ?", (entry_id,)).fetchone()
+            entry = dict(row)
+            entry["distance"] = distance
+            if confirm is None or confirm(entry):
+                return entry
+        return None
+
+    def same_pixels(self, source_image: str, other_image: str) -> bool:
+        """the pixel check of a candidate - False when one of the images can not be read"""
+        try:
+            return pixel_difference(source_image, other_image) <= self.max_pixel_difference
+        except OSError:
+            return False
+
+    def add(self, engine: str, image_hash: int, width: int, height: int, source_image: str, markdown: str) -> None:
+        """engine: the scope of the result"""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO images (engine, hash, width, height, source_image, markdown, added_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (engine, format(image_hash, "x"), width, height, os.path.abspath(source_image), markdown, time.time()))
+            self._db.commit()
+            self._index(cursor.lastrowid, engine, image_hash, width / height)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class PerceptualReuseEngine:
+    """wraps an OCR engine: confirmed near duplicates of indexed images get the stored markdown, the rest goes to the engine"""
+
+    def __init__(self, engine, index: PerceptualHashIndex, logger: logging.Logger, scope: Optional[str] = None):
+        self.engine = engine
+        self.name = engine.name
+        self.scope = f"{engine.name}:{scope}" if scope else engine.name  # results are only reused within the scope
+        self.index = index
+        self._logger = logger
+        self._lock = threading.Lock()
+        self.reused = 0
+
+    def _hash(self, source_image: str) -> Optional[Tuple[int, int, int]]:
+        try:
+            return dhash(source_image, self.index.hash_size)
+        except OSError:
+            return None  # not readable by PIL - the engine decides what to do with it
+
+    def _exact_cached(self, source_image: str) -> bool:
+        is_cached = getattr(self.engine, "is_cached", None)
+        return is_cached is not None and is_cached(source_image)
+
+    def _lookup(self, source_image: str):
+        if self._exact_cached(source_image):
+            return None, None  # the engine answers from its own cache, with its own naming
+        image_hash = self._hash(source_image)
+        if image_hash is None:
+            return None, None
+        entry = self.index.find(self.scope, *image_hash,
+                                confirm=lambda candidate: self.index.same_pixels(source_image, candidate["source_image"]))
+        return image_hash, entry
+
+    def _count_reuse(self, source_image: str, entry: Dict[str, Any]) -> None:
+        with self._lock:  # process_jobs and the hybrid router call in from several threads
+            self.reused += 1
+        self._logger.info(f"Reusing the OCR of {entry['source_image']} for {source_image} (distance {entry['distance']})")
+
+    def _save_reused(self, source_image: str, output_file: str, entry: Dict[str, Any]) -> str:
+        if not output_file:
+            output_file = os.path.splitext(os.path.basename(source_image))[0] + ".md"
+        name, ext = os.path.splitext(output_file)
+        original = os.path.splitext(os.path.basename(entry["source_image"]))[0]
+        output_file = f"{name}___reused_from_{original}{ext}"
+        with open(output_file, "w") as file:
+            file.write(entry["markdown"])
+
+        self._count_reuse(source_image, entry)
+        return output_file
+
+    def _add(self, source_image: str, image_hash, output_file: str) -> None:
+        if image_hash is None:
+            return
+        with open(output_file, "r") as file:
+            self.index.add(self.scope, *image_hash, source_image, file.read())
+
+    def recognize(self, source_image: str) -> Dict[str, Any]:
+        image_hash, entry = self._lookup(source_image)
+        if entry is not None:
+            self._count_reuse(source_image, entry)
+            return {"markdown": entry["markdown"], "model": "phash", "tokens": 0, "bytes_uploaded": 0, "cached": True,
+                    "distance": entry["distance"], "reused_from": entry["source_image"]}
+
+        result = self.engine.recognize(source_image)
+        if image_hash is not None:
+            self.index.add(self.scope, *image_hash, source_image, result["markdown"])
+        return result
+
+    def process_image(self, source_image: str, output_file: str) -> str:
+        image_hash, entry = self._lookup(source_image)
+        if entry is not None:
+            return self._save_reused(source_image, output_file, entry)
+
+        written_file = self.engine.process_image(source_image, output_file)
+        self._add(source_image, image_hash, written_file)
+        return written_file
+
+    def close(self) -> None:
+        """closes the wrapped engine - the index belongs to the caller"""
+        close_engine(self.engine)
+
+    def _near(self, a, b) -> Optional[int]:
+        """the distance of two (hash, width, height), None when they are not near duplicates"""
+        distance = hamming_distance(a[0], b[0])
+        aspect_a, aspect_b = a[1] / a[2], b[1] / b[2]
+        if distance > self.index.max_distance or abs(aspect_a - aspect_b) > MAX_ASPECT_DIFFERENCE * aspect_a:
+            return None
+        return distance
+
+    def process_images(self, jobs: List[Tuple[str, str]], max_workers: int = 4,
+                       on_done: Optional[Callable[[Tuple[str, str], str], None]] = None) -> List[str]:
+        output_files = [None] * len(jobs)
+        misses = []     # (index, image_hash) sent to the engine
+        followers = []  # (index, index of the near duplicate miss, distance) - reuse once the miss is done
+        for index, (source_image, output_file) in enumerate(jobs):
+            image_hash, entry = self._lookup(source_image)
+            if entry is not None:
+                output_files[index] = self._save_reused(source_image, output_file, entry)
+                if on_done is not None:
+                    on_done(jobs[index], output_files[index])
+                continue
+
+            # the same screenshot twice in one document: only the first one goes to the engine
+            leader = None
+            if image_hash is not None:
+                for miss_index, miss_hash in misses:
+                    distance = self._near(image_hash, miss_hash) if miss_hash is not None else None
+                    if distance is not None and self.index.same_pixels(source_image, jobs[miss_index][0]):
+                        leader = (miss_index, distance)
+                        break
+            if leader is None:
+                misses.append((index, image_hash))
+            else:
+                followers.append((index, *leader))
+
+        miss_files = process_jobs(self.engine, [jobs[index] for index, _ in misses], max_workers, on_done=on_done)
+        for (index, image_hash), output_file in zip(misses, miss_files):
+            self._add(jobs[index][0], image_hash, output_file)
+            output_files[index] = output_file
+
+        for index, leader_index, distance in followers:
+            with open(output_files[leader_index], "r") as file:
+                entry = {"markdown": file.read(), "source_image": jobs[leader_index][0], "distance": distance}
+            output_files[index] = self._save_reused(jobs[index][0], jobs[index][1], entry)
+            if on_done is not None:
+                on_done(jobs[index], output_files[index])
+        return output_files
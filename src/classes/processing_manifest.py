@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+"""
+A persistent manifest of processed input files, so process_directory only redoes what changed.
+
+Per input path it records the sha256 of the content, mtime, size, the output folder, the
+files in it and the settings fingerprint of the run (engine, model, prompt, triage, upload
+settings - see settings_fingerprint() in app.py). On the next run:
+- recorded with other settings         -> "reconfigured", the outputs are stale
+- same mtime and size as recorded      -> "unchanged" (not even hashed)
+- else same sha256 as recorded         -> "unchanged" (touched, not modified)
+- same sha256 as another recorded file -> "duplicate", the outputs of that file can be reused
+  (only when it was recorded with the same settings)
+- else                                 -> "new" or "modified"
+
+It is a SQLite file, so recording one file does not rewrite the whole manifest.
+
+main methods:
+- check(file_path): returns (status, sha256, entry of the file or of the duplicate)
+- claim_output_folder(file_path, base_name): an output folder no other input is using
+- record(file_path, sha256, output_folder): store the result of a processed file
+"""
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ProcessingManifest:
+    def __init__(self, manifest_path: str, settings: str = ""):
+        self.manifest_path = manifest_path
+        self.settings = settings  # fingerprint of what produced the outputs, an entry with another one is redone
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(manifest_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path          TEXT PRIMARY KEY,
+                sha256        TEXT NOT NULL,
+                mtime         REAL NOT NULL,
+                size          INTEGER NOT NULL,
+                output_folder TEXT NOT NULL,
+                outputs       TEXT NOT NULL,
+                processed_at  REAL NOT NULL,
+                settings      TEXT NOT NULL DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+            CREATE INDEX IF NOT EXISTS files_output_folder ON files (output_folder);
+        """)
+        columns = [row["name"] for row in self._db.execute("PRAGMA table_info(files)")]
+        if "settings" not in columns:  # a manifest from before the fingerprint, all its entries are redone once
+            self._db.execute("ALTER TABLE files ADD COLUMN settings TEXT NOT NULL DEFAULT ''")
+            self._db.commit()
+
+    def _entry(self, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["outputs"] = json.loads(entry["outputs"])
+        return entry
+
+    def _outputs_exist(self, entry: Dict[str, Any]) -> bool:
+        return all(os.path.exists(os.path.join(entry["output_folder"], output)) for output in entry["outputs"])
+
+    def check(self, file_path: str) -> Tuple[str, Optional[str], Optional[Dict[str, Any]]]:
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entry(self._db.execute("SELECT * FROM files WHERE path = ?", (path,)).fetchone())
+
+        if entry and entry["settings"] != self.settings:
+            return "reconfigured", file_sha256(path), entry
+
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size and self._outputs_exist(entry):
+            return "unchanged", entry["sha256"], entry
+
+        sha256 = file_sha256(path)
+        if entry and entry["sha256"] == sha256 and self._outputs_exist(entry):
+            return "unchanged", sha256, entry
+
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM files WHERE sha256 = ? AND path != ? AND settings = ?",
+                                    (sha256, path, self.settings)).fetchall()
+        for row in rows:
+            duplicate = self._entry(row)
+            if self._outputs_exist(duplicate):
+                return "duplicate", sha256, duplicate
+
+        return ("modified" if entry else "new"), sha256, entry
+
+    def claim_output_folder(self, file_path: str, base_name: str) -> str:
+        """base_name, or base_name_2, _3 ... if another input with the same basename already owns the folder"""
+        path = os.path.abspath(file_path)
+        counter = 1
+        output_folder = base_name
+        with self._lock:
+            while True:
+                owner = self._db.execute("SELECT path FROM files WHERE output_folder = ?", (output_folder,)).fetchone()
+                if owner is None or owner["path"] == path:
+                    return output_folder
+                counter += 1
+                output_folder = f"{base_name}_{counter}"
+
+    def record(self, file_path: str, sha256: str, output_folder: str) -> None:
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        outputs = []
+        for root, _, files in os.walk(output_folder):
+            for file in files:
+                outputs.append(os.path.relpath(os.path.join(root, file), output_folder))
+
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (path, sha256, stat.st_mtime, stat.st_size, output_folder, json.dumps(sorted(outputs)), time.time(),
+                              self.settings))
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
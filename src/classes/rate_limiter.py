@@ -0,0 +1,174 @@
+import time
+import random
+import threading
+from typing import Any, Callable, Optional
+
+from openai import APIConnectionError
+from classes.run_metrics import RunMetrics
+
+"""
+The request layer in front of the OpenAI API: rate limits, retries and adaptive concurrency.
+
+- requests/min and tokens/min are token buckets, a request waits until both have room. The tokens of
+  a request are not known before the answer, so the mean of the answers so far is taken and the
+  bucket is corrected with the real usage afterwards.
+- 429, 408, 409, 5xx and connection errors are retried with exponential backoff and full jitter,
+  a Retry-After (or retry-after-ms) header from the server wins over the computed delay.
+- the number of requests in flight is adapted AIMD style, like TCP: +1 per limit successful
+  requests, halved on throttling (at most once per cooldown, a burst of 429s is one signal).
+
+main methods:
+- call(function): runs function() within the limits, with retries - returns its result
+- record_tokens(tokens): the real usage of a request, see call(usage=...)
+"""
+RETRY_STATUS = (408, 409, 429)
+
+
+class TokenBucket:
+    """rate per minute, holds at most capacity (default one minute worth) - take() blocks until there is room"""
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, amount: float) -> float:
+        """returns the seconds waited"""
+        amount = min(amount, self.capacity)  # a request larger than the bucket must still be possible
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._level >= amount:
+                    self._level -= amount
+                    return waited
+                delay = (amount - self._level) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount: float) -> None:
+        """take (positive) or give back (negative) without waiting, the level may go below zero"""
+        with self._lock:
+            self._refill()
+            self._level = min(self.capacity, self._level - amount)
+
+
+class AdaptiveConcurrency:
+    def __init__(self, maximum: int, minimum: int = 1, cooldown: float = 2.0):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.cooldown = cooldown
+        self.limit = float(self.maximum)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, throttled: bool) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, APIConnectionError):  # also APITimeoutError
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status in RETRY_STATUS or status >= 500)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass  # an HTTP date - use the computed backoff
+    return None
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 max_in_flight: int = 4, max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0,
+                 initial_tokens: int = 4096, metrics: Optional[RunMetrics] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrency(max_in_flight)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = metrics or RunMetrics()
+        self._token_total = 0
+        self._token_count = 0
+        self._initial_tokens = initial_tokens
+        self._lock = threading.Lock()
+
+    def expected_tokens(self) -> int:
+        with self._lock:
+            if self._token_count == 0:
+                return self._initial_tokens
+            return self._token_total // self._token_count
+
+    def record_tokens(self, tokens: int, expected: int) -> None:
+        with self._lock:
+            self._token_total += tokens
+            self._token_count += 1
+        if self.tokens is not None:
+            self.tokens.adjust(tokens - expected)
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))  # full jitter
+        return delay
+
+    def call(self, function: Callable[[], Any], usage: Optional[Callable[[Any], int]] = None) -> Any:
+        """usage(result) -> the real tokens of the request, to correct the tokens/min bucket"""
+        for attempt in range(self.max_retries + 1):
+            expected = self.expected_tokens()
+            if self.requests is not None:
+                self.metrics.observe("ai_rate_limit_wait_seconds", self.requests.take(1))
+            if self.tokens is not None:
+                self.metrics.observe("ai_rate_limit_wait_seconds", self.tokens.take(expected))
+
+            self.concurrency.acquire()
+            try:
+                result = function()
+            except Exception as e:
+                throttled = getattr(e, "status_code", None) == 429
+                self.concurrency.release(throttled=throttled)
+                if self.tokens is not None:
+                    self.tokens.adjust(-expected)  # nothing was used
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+                self.metrics.add("ai_throttled" if throttled else "ai_retried_errors")
+                self.metrics.set_info("ai_concurrency_limit", int(self.concurrency.limit))
+                time.sleep(delay)
+                continue
+
+            self.concurrency.release(throttled=False)
+            if usage is not None:
+                self.record_tokens(usage(result), expected)
+            return result
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List
+
+"""
+Collects the metrics of one run: wall time per stage, counters (bytes, images, tokens, cache hits)
+and observed values like API latency. Thread safe, cheap enough to use on every image.
+
+The run is written as run_report.json, and optionally as Prometheus text exposition format for
+the node exporter textfile collector (or anything else that scrapes files).
+
+main methods:
+- stage(name): context manager, adds the wall time of the block to the stage
+- add(name, value): increase a counter
+- observe(name, value): record one value of e.g. a latency, reported as count/sum/min/max/p50/p95
+- set_info(name, value): anything else for the report, e.g. the engine or the cache stats
+- write_json(path), write_prometheus(path)
+"""
+class RunMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._stages: Dict[str, Dict[str, float]] = {}
+        self._counters: Dict[str, float] = {}
+        self._observations: Dict[str, List[float]] = {}
+        self._info: Dict[str, Any] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stage = self._stages.setdefault(name, {"seconds": 0.0, "count": 0})
+                stage["seconds"] += elapsed
+                stage["count"] += 1
+
+    def add(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            self._observations.setdefault(name, []).append(value)
+
+    def set_info(self, name: str, value: Any) -> None:
+        with self._lock:
+            self._info[name] = value
+
+    def _summary(self, values: List[float]) -> Dict[str, float]:
+        ordered = sorted(values)
+        def percentile(fraction):
+            return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+        return {"count": len(ordered), "sum": sum(ordered), "min": ordered[0], "max": ordered[-1],
+                "p50": percentile(0.50), "p95": percentile(0.95)}
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "started"      : self._started,
+                "wall_seconds" : time.time() - self._started,
+                "stages"       : {name: dict(stage) for name, stage in self._stages.items()},
+                "counters"     : dict(self._counters),
+                "observations" : {name: self._summary(values) for name, values in self._observations.items() if values},
+                "info"         : dict(self._info)
+            }
+
+    def write_json(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def to_prometheus(self, prefix: str = "ocr") -> str:
+        report = self.to_dict()
+        lines = [f"# TYPE {prefix}_run_wall_seconds gauge", f"{prefix}_run_wall_seconds {report['wall_seconds']:.6f}",
+                 f"# TYPE {prefix}_stage_seconds_total counter", f"# TYPE {prefix}_stage_runs_total counter"]
+        for name, stage in sorted(report["stages"].items()):
+            lines.append(f'{prefix}_stage_seconds_total{{stage="{name}"}} {stage["seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_runs_total{{stage="{name}"}} {stage["count"]}')
+
+        for name, value in sorted(report["counters"].items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+
+        for name, summary in sorted(report["observations"].items()):
+            lines.append(f"# TYPE {prefix}_{name} summary")
+            lines.append(f'{prefix}_{name}{{quantile="0.5"}} {summary["p50"]:.6f}')
+            lines.append(f'{prefix}_{name}{{quantile="0.95"}} {summary["p95"]:.6f}')
+            lines.append(f"{prefix}_{name}_sum {summary['sum']:.6f}")
+            lines.append(f"{prefix}_{name}_count {summary['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"  # the textfile collector must never read a half written file
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
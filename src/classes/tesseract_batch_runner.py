@@ -0,0 +1,87 @@
+import os
+import shutil
+import logging
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+from classes.tesseract_image_processor import parse_tesseract_tsv
+
+"""
+Runs Tesseract over a list of images with one process per batch instead of one process per image.
+
+pytesseract starts a new tesseract process per image, writes temp files and loads the language
+model every time. This runner uses the tesseract list-file mode instead: one process gets a text
+file with up to batch_size image paths, loads the model once and writes one TSV with a page per
+image. The processes do not outlive the call - tesseract has no mode that takes more images after
+it started - so the gain is per batch: a single image (analyze_images([path])) still costs a
+process with its model load, like pytesseract.
+
+Up to workers such processes run at the same time, each with OMP_THREAD_LIMIT=1 so they do not
+fight over the cores with their own threads. See benchmark/tesseract_batch_benchmark.py to measure
+it against pytesseract on your images.
+
+When tesseract fails on a batch (e.g. an image it can not read), the images of that batch are run
+one at a time, so a bad image only loses its own result - it gets an empty result with "error".
+
+main method:
+- analyze_images(paths): [{"text", "mean_confidence", "word_count"}, ...] in the same order as paths
+"""
+
+EMPTY_RESULT = {"text": "", "mean_confidence": 0.0, "word_count": 0}
+
+
+class TesseractBatchRunner:
+    def __init__(self, lang: str, workers: Optional[int] = None, batch_size: int = 200, tesseract_cmd: Optional[str] = None,
+                 logger: Optional[logging.Logger] = None):
+        self.lang = lang
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.tesseract_cmd = tesseract_cmd or os.getenv("TESSERACT_CMD") or shutil.which("tesseract") or "tesseract"
+        self._logger = logger or logging.getLogger("tesseract_batch_runner")
+        self._env = dict(os.environ, OMP_THREAD_LIMIT="1")
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)  # threads only wait for the tesseract processes
+
+    def _run_tesseract(self, paths: List[str]) -> Dict[int, Dict[str, Any]]:
+        with tempfile.TemporaryDirectory(prefix="tesseract_batch_") as work_dir:
+            list_file = os.path.join(work_dir, "images.txt")
+            with open(list_file, "w", encoding="utf-8") as f:
+                f.write("\n".join(os.path.abspath(path) for path in paths) + "\n")
+
+            output_base = os.path.join(work_dir, "result")
+            completed = subprocess.run([self.tesseract_cmd, list_file, output_base, "-l", self.lang, "tsv"],
+                                       env=self._env, capture_output=True, text=True)
+            if completed.returncode != 0 or not os.path.exists(f"{output_base}.tsv"):
+                raise RuntimeError(f"tesseract failed ({completed.returncode}): {completed.stderr.strip()}")
+
+            with open(f"{output_base}.tsv", "r", encoding="utf-8") as f:
+                return parse_tesseract_tsv(f.read())
+
+    def _run_batch(self, paths: List[str]) -> List[Dict[str, Any]]:
+        try:
+            pages = self._run_tesseract(paths)
+        except RuntimeError as e:
+            if len(paths) == 1:
+                self._logger.warning(f"No OCR result for {paths[0]}: {e}")
+                return [dict(EMPTY_RESULT, error=str(e))]
+            self._logger.warning(f"Batch of {len(paths)} images failed, running them one at a time: {e}")
+            return [self._run_batch([path])[0] for path in paths]
+
+        # page n in the TSV is line n in the list file
+        return [pages.get(page_num, dict(EMPTY_RESULT)) for page_num in range(1, len(paths) + 1)]
+
+    def analyze_images(self, paths: List[str]) -> List[Dict[str, Any]]:
+        if not paths:
+            return []
+
+        # spread evenly over the workers, but never more than batch_size images per tesseract process
+        batch_size = max(1, min(self.batch_size, -(-len(paths) // self.workers)))
+        batches = [paths[start:start + batch_size] for start in range(0, len(paths), batch_size)]
+
+        results = []
+        for batch_results in self._executor.map(self._run_batch, batches):
+            results.extend(batch_results)
+        return results
+
+    def close(self) -> None:
+        self._executor.shutdown()
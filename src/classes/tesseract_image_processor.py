@@ -0,0 +1,113 @@
+import os
+import pytesseract
+from PIL import Image
+from typing import Dict, Any, Optional, List, Tuple
+
+"""
+Local OCR with Tesseract, with the same process_image interface as AIImageProcessor.
+
+Uses image_to_data instead of image_to_string, so every word comes with a confidence (0-100).
+The mean confidence and the word count tell HybridOCRRouter if the result is good enough or
+if the image has to go to the AI.
+
+With a TesseractBatchRunner (tesseract_batch_runner.py) analyze_images() handles the images in
+batches, one tesseract process per batch instead of one pytesseract process per image.
+
+main methods:
+- analyze_image(source_image): {"text", "mean_confidence", "word_count"}
+- analyze_images(source_images): the same for many images, batched through the runner if there is one
+- process_image(source_image, output_file): writes the text to <output_file>__<infix>.md
+- process_images(jobs): process_image for a list of (source_image, output_file), returns the written files
+"""
+
+
+def parse_tesseract_tsv(tsv: str) -> Dict[int, Dict[str, Any]]:
+    """page_num -> {"text", "mean_confidence", "word_count"} from tesseract TSV output (one page per image)"""
+    pages = {}
+    lines = tsv.splitlines()
+    if not lines:
+        return pages
+
+    columns = lines[0].split("\t")
+    for row in lines[1:]:
+        values = row.split("\t")
+        if len(values) < len(columns):
+            continue
+        word = dict(zip(columns, values))
+        page = pages.setdefault(int(word["page_num"]), {"lines": {}, "confidences": []})
+        if word["level"] != "5" or not word["text"].strip():
+            continue  # only level 5 rows are words, the others are page/block/paragraph/line boxes
+
+        line_key = (int(word["block_num"]), int(word["par_num"]), int(word["line_num"]))
+        page["lines"].setdefault(line_key, []).append(word["text"])
+        confidence = float(word["conf"])
+        if confidence >= 0:
+            page["confidences"].append(confidence)
+
+    results = {}
+    for page_num, page in pages.items():
+        text_lines = []
+        previous_paragraph = None
+        for (block_num, par_num, _), words in sorted(page["lines"].items()):
+            if previous_paragraph is not None and previous_paragraph != (block_num, par_num):
+                text_lines.append("")  # blank line between paragraphs
+            text_lines.append(" ".join(words))
+            previous_paragraph = (block_num, par_num)
+
+        confidences = page["confidences"]
+        results[page_num] = {
+            "text"            : "\n".join(text_lines),
+            "mean_confidence" : sum(confidences) / len(confidences) if confidences else 0.0,
+            "word_count"      : len(confidences)
+        }
+    return results
+
+
+class TesseractImageProcessor:
+    name = "tesseract"
+
+    def __init__(self, lang: Optional[str] = None, runner=None):
+        self.lang = lang or os.getenv("TESSERACT_LANG", "swe+eng")
+        self.runner = runner  # optional TesseractBatchRunner, used by analyze_images()
+
+    def analyze_image(self, source_image: str) -> Dict[str, Any]:
+        # a single image is one process either way, pytesseract does not need the list file
+        with Image.open(source_image) as image:
+            tsv = pytesseract.image_to_data(image, lang=self.lang)
+        pages = parse_tesseract_tsv(tsv)
+        return pages.get(1, {"text": "", "mean_confidence": 0.0, "word_count": 0})
+
+    def analyze_images(self, source_images: List[str]) -> List[Dict[str, Any]]:
+        if self.runner is not None:
+            return self.runner.analyze_images(source_images)
+        return [self.analyze_image(source_image) for source_image in source_images]
+
+    def recognize(self, source_image: str) -> Dict[str, Any]:
+        """the OCREngine interface (see ocr_engine.py)"""
+        result = self.analyze_image(source_image)
+        return {"markdown": result["text"], "model": "tesseract", "tokens": 0, "bytes_uploaded": 0,
+                "mean_confidence": result["mean_confidence"], "word_count": result["word_count"]}
+
+    def format_infix(self, result: Dict[str, Any]) -> str:
+        return f"_model_tesseract_conf_{round(result['mean_confidence'])}_words_{result['word_count']}"
+
+    def save_result(self, source_image: str, output_file: str, result: Dict[str, Any]) -> str:
+        if not output_file:
+            output_file = os.path.splitext(os.path.basename(source_image))[0] + ".md"
+        name, ext = os.path.splitext(output_file)
+        output_file = f"{name}__{self.format_infix(result)}{ext}"
+
+        with open(output_file, "w") as file:
+            file.write(result["text"])
+        return output_file
+
+    def process_image(self, source_image: str, output_file: str) -> str:
+        return self.save_result(source_image, output_file, self.analyze_image(source_image))
+
+    def process_images(self, jobs: List[Tuple[str, str]]) -> List[str]:
+        results = self.analyze_images([source_image for source_image, _ in jobs])
+        return [self.save_result(source_image, output_file, result) for (source_image, output_file), result in zip(jobs, results)]
+
+    def close(self) -> None:
+        if self.runner is not None:
+            self.runner.close()
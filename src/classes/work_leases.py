@@ -0,0 +1,193 @@
+import os
+import json
+import hashlib
+import time
+import socket
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+"""
+Shares the documents of one folder between N worker processes, on one host or on several hosts
+that mount the same folder - without a coordinator. Every document is claimed with a lease file
+in the shared lease folder:
+
+    <lease_dir>/<file name>.<hash>.lease   {"worker", "host", "pid", "expires", ...} - being processed
+    <lease_dir>/<file name>.<hash>.done    {"worker", "size", "mtime", "output_folder", ...} - finished
+
+(<hash>: 8 hex digits of the file name, so doc1.pdf and doc1.PDF do not share a lease on a case
+insensitive share)
+
+- claim:    create the .lease file with O_CREAT | O_EXCL, only one worker can succeed
+- renew:    a heartbeat thread moves "expires" forward every lease_seconds / 3 while the worker
+            is alive, a worker that dies (kill -9, OOM, host down) stops renewing
+- steal:    an expired lease is renamed away - rename is atomic, only one worker wins - and the
+            document is claimed again by the winner
+- complete: the .done file is written (tmp + rename), then the lease is removed. A .done file of
+            another size or mtime than the document is ignored, the changed document is redone
+
+Works on local disks and on NFS/SMB shares, where O_EXCL and rename are atomic but SQLite locking
+is not reliable. The expiry is compared to the local clock, so lease_seconds must be well above the
+clock difference between the hosts. A worker that was paused longer than lease_seconds can lose
+its lease - the heartbeat notices, logs it and the document may be processed twice (same output).
+
+main methods:
+- claim(file_path): True when this worker holds the lease now
+- is_done(file_path)
+- complete(file_path, output_folder) / release(file_path)
+- close(): stops the heartbeat, releases what is still held
+"""
+
+LEASE_SUFFIX = ".lease"
+DONE_SUFFIX = ".done"
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkLeases:
+    def __init__(self, lease_dir: str, logger: logging.Logger, worker_id: Optional[str] = None,
+                 lease_seconds: float = 300.0, metrics=None):
+        if lease_seconds <= 0:
+            raise ValueError(f"lease_seconds must be positive, got {lease_seconds}")
+        self.lease_dir = lease_dir
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self._logger = logger
+        self._metrics = metrics
+        self._held: Dict[str, str] = {}  # lease path -> file path
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        os.makedirs(lease_dir, exist_ok=True)
+        self._heartbeat = threading.Thread(target=self._renew_loop, name="lease-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def _path(self, file_path: str, suffix: str) -> str:
+        file_name = os.path.basename(file_path)
+        name_hash = hashlib.sha1(file_name.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.lease_dir, f"{file_name}.{name_hash}{suffix}")
+
+    def _count(self, name: str) -> None:
+        if self._metrics is not None:
+            self._metrics.add(name)
+
+    def _read(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            return {}  # being written by its owner right now - O_EXCL created it empty, treat it as held
+
+    def _write(self, path: str, content: Dict[str, Any]) -> None:
+        tmp_path = f"{path}.{self.worker_id}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(content, f)
+        os.replace(tmp_path, path)
+
+    def _lease_content(self, file_path: str) -> Dict[str, Any]:
+        now = time.time()
+        return {"path": os.path.abspath(file_path), "worker": self.worker_id, "host": socket.gethostname(),
+                "pid": os.getpid(), "renewed": now, "expires": now + self.lease_seconds}
+
+    def is_done(self, file_path: str) -> bool:
+        done = self._read(self._path(file_path, DONE_SUFFIX))
+        if not done:
+            return False
+        stat = os.stat(file_path)
+        return done.get("size") == stat.st_size and done.get("mtime") == stat.st_mtime
+
+    def claim(self, file_path: str) -> bool:
+        if self.is_done(file_path):
+            return False
+        lease_path = self._path(file_path, LEASE_SUFFIX)
+        lease = self._read(lease_path)
+        if lease is not None:
+            if self._expires(lease_path, lease) > time.time():
+                return False  # held by a live worker
+            if not self._steal(lease_path, lease):
+                return False
+
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False  # another worker was faster
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self._lease_content(file_path), f)
+        with self._lock:
+            self._held[lease_path] = file_path
+        self._count("leases_claimed")
+        return True
+
+    def _expires(self, lease_path: str, lease: Dict[str, Any]) -> float:
+        if "expires" in lease:
+            return lease["expires"]
+        try:
+            return os.path.getmtime(lease_path) + self.lease_seconds  # empty: the owner died between create and write
+        except FileNotFoundError:
+            return 0.0
+
+    def _steal(self, lease_path: str, expired: Dict[str, Any]) -> bool:
+        """moves an expired lease away - of all workers that try, only one rename succeeds"""
+        stale_path = f"{lease_path}.{self.worker_id}.stale"
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return False  # stolen or completed by another worker
+        lease = self._read(stale_path)
+        expired_at = self._expires(stale_path, lease if lease is not None else expired)
+        if expired_at > time.time():
+            # renewed between reading and renaming, the owner is alive after all - put it back
+            try:
+                os.link(stale_path, lease_path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+
+        os.remove(stale_path)
+        self._logger.warning(f"Taking over {os.path.basename(lease_path)} from {expired.get('worker', 'a dead worker')}, "
+                             f"its lease expired {time.time() - expired_at:.0f}s ago")
+        self._count("leases_stolen")
+        return True
+
+    def _renew_loop(self) -> None:
+        while not self._stopped.wait(self.lease_seconds / 3):
+            with self._lock:  # not while a lease is being released, that would bring it back
+                for lease_path, file_path in list(self._held.items()):
+                    lease = self._read(lease_path)
+                    if not lease or lease.get("worker") != self.worker_id:  # stolen while this worker was paused
+                        self._logger.warning(f"Lost the lease of {file_path} to {(lease or {}).get('worker')}")
+                        self._count("leases_lost")
+                        del self._held[lease_path]
+                        continue
+                    self._write(lease_path, self._lease_content(file_path))
+
+    def complete(self, file_path: str, output_folder: str) -> None:
+        stat = os.stat(file_path)
+        self._write(self._path(file_path, DONE_SUFFIX),
+                    {"path": os.path.abspath(file_path), "worker": self.worker_id, "size": stat.st_size,
+                     "mtime": stat.st_mtime, "output_folder": os.path.abspath(output_folder), "finished": time.time()})
+        self.release(file_path)
+
+    def release(self, file_path: str) -> None:
+        lease_path = self._path(file_path, LEASE_SUFFIX)
+        with self._lock:
+            if self._held.pop(lease_path, None) is None:
+                return
+            lease = self._read(lease_path)
+            if lease and lease.get("worker") == self.worker_id:  # not when it was lost to another worker
+                try:
+                    os.remove(lease_path)
+                except FileNotFoundError:
+                    pass
+
+    def close(self) -> None:
+        self._stopped.set()
+        with self._lock:
+            held = list(self._held.values())
+        for file_path in held:
+            self.release(file_path)
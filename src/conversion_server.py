@@ -0,0 +1,373 @@
+import os
+import json
+import time
+import uuid
+import queue
+import signal
+import shutil
+import logging
+import mimetypes
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import app
+
+"""
+A local HTTP service around the conversion pipeline of app.py: upload a PDF or MHTML, get a job id
+back at once, and follow the job while it runs - every HTML page and every image markdown is sent
+as soon as it is written, as server-sent events.
+
+usage:
+    python conversion_server.py --port 8090 --workers 2 --queue-size 16 --engine fake
+    curl --data-binary @manual.pdf "http://127.0.0.1:8090/jobs?name=manual.pdf"
+    curl -N http://127.0.0.1:8090/jobs/<job_id>/events
+
+All options of app.py apply (--engine, --max-in-flight, --rpm, --phash-index, ...). The engine, the
+caches and the rate limiter are created once and shared by all jobs. --engine fake, or the AI with
+OPENAI_BASE_URL pointing at fake_openai_server.py, runs without network access and without cost.
+
+The upload is queued for a pool of --workers threads. The queue holds at most --queue-size jobs,
+when it is full the upload is answered with 503 and a Retry-After header instead of piling up.
+Every job gets its own folder in --jobs-dir: the upload and its outputs.
+
+endpoints:
+- POST /jobs?name=<file name>             body = the file, answers 202 {"job_id", "status", "events"}
+- GET  /jobs/<job_id>                     state, timings and output files of the job
+- GET  /jobs/<job_id>/events              text/event-stream: page, html, image, then done or failed.
+                                          Reconnect with Last-Event-ID to continue after an event
+- GET  /jobs/<job_id>/files/<path>        an output file
+- GET  /metrics                           Prometheus text: the run metrics, queue depth, job latency
+- GET  /health
+"""
+
+KEEP_ALIVE_SECONDS = 15  # a comment line on quiet event streams, so proxies do not close them
+
+
+class ConversionJob:
+    def __init__(self, job_id: str, file_name: str, job_folder: str):
+        self.job_id = job_id
+        self.file_name = file_name
+        self.job_folder = job_folder
+        self.upload_path = os.path.join(job_folder, file_name)
+        self.output_folder = os.path.join(job_folder, os.path.splitext(file_name)[0])
+        self.state = "queued"  # queued -> running -> done | failed
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._events: List[Dict[str, Any]] = []
+        self._changed = threading.Condition()
+
+    @property
+    def finished_state(self) -> bool:
+        return self.state in ("done", "failed")
+
+    def relative(self, path: str) -> str:
+        return os.path.relpath(path, self.job_folder)
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        """the listener of app.process_file - called from the OCR threads"""
+        event = dict(event)
+        for key in ("file", "image"):
+            if key in event:
+                event[key] = self.relative(event[key])
+        with self._changed:
+            self._events.append(event)
+            self._changed.notify_all()
+
+    def set_state(self, state: str, **event) -> None:
+        with self._changed:
+            self.state = state
+            if state == "running":
+                self.started = time.time()
+            elif self.finished_state:
+                self.finished = time.time()
+                self._events.append({"event": state, **event})
+            self._changed.notify_all()
+
+    def events_after(self, start: int, timeout: float) -> Tuple[List[Tuple[int, Dict[str, Any]]], bool]:
+        """(event id, event) after the first start events - waits up to timeout for new ones. True when nothing more will come"""
+        with self._changed:
+            if len(self._events) <= start and not self.finished_state:
+                self._changed.wait(timeout)
+            return list(enumerate(self._events[start:], start)), self.finished_state
+
+    def output_files(self) -> List[str]:
+        files = []
+        for root, dirs, names in os.walk(self.output_folder):
+            dirs.sort()
+            files.extend(self.relative(os.path.join(root, name)) for name in sorted(names))
+        return files
+
+    def status(self) -> Dict[str, Any]:
+        status = {
+            "job_id"   : self.job_id,
+            "file"     : self.file_name,
+            "state"    : self.state,
+            "error"    : self.error,
+            "created"  : self.created,
+            "started"  : self.started,
+            "finished" : self.finished,
+            "events"   : f"/jobs/{self.job_id}/events"
+        }
+        if self.finished_state:
+            status["files"] = self.output_files()
+        return status
+
+
+class ConversionService:
+    """the bounded job queue and the worker threads that run app.process_file"""
+
+    def __init__(self, jobs_dir: str, logger: logging.Logger, workers: int = 2, queue_size: int = 16,
+                 keep_jobs: int = 1000):
+        self.jobs_dir = jobs_dir
+        self.keep_jobs = keep_jobs
+        self._logger = logger
+        self._queue: "queue.Queue[ConversionJob]" = queue.Queue(maxsize=queue_size)
+        self._jobs: "OrderedDict[str, ConversionJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._running = 0
+
+        os.makedirs(jobs_dir, exist_ok=True)
+        for number in range(max(1, workers)):
+            threading.Thread(target=self._work, name=f"conversion-worker-{number}", daemon=True).start()
+
+    def submit(self, file_name: str, body, length: int) -> ConversionJob:
+        """raises queue.Full when the queue is full - nothing is stored then"""
+        if self._queue.full():
+            raise queue.Full()
+
+        job_id = uuid.uuid4().hex
+        job = ConversionJob(job_id, file_name, os.path.join(self.jobs_dir, job_id))
+        os.makedirs(job.job_folder)
+        try:
+            with open(job.upload_path, "wb") as upload:
+                remaining = length
+                while remaining > 0:
+                    chunk = body.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        raise ValueError(f"Upload ended after {length - remaining} of {length} bytes")
+                    upload.write(chunk)
+                    remaining -= len(chunk)
+            job.created = time.time()  # queue latency starts now, not when the upload started
+            self._queue.put_nowait(job)  # Full: another upload took the last place while this one was written
+        except (ValueError, queue.Full):
+            shutil.rmtree(job.job_folder, ignore_errors=True)
+            raise
+
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._forget_old_jobs()
+        app.metrics.add("jobs_submitted")
+        self._logger.info(f"Job {job.job_id}: {file_name} queued, {self._queue.qsize()} in the queue")
+        return job
+
+    def _forget_old_jobs(self) -> None:
+        """only the last keep_jobs finished jobs are kept in memory - their folders stay on disk"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_state]
+        for job_id in finished[:max(0, len(finished) - self.keep_jobs)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[ConversionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _convert(self, job: ConversionJob) -> None:
+        try:
+            app.process_file(job.upload_path, job.output_folder, listener=job.emit)
+        finally:
+            if app.journal is not None:
+                app.journal.forget(job.upload_path)  # an upload is never resumed, its rows would only pile up
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                self._running += 1
+            job.set_state("running")
+            app.metrics.observe("job_queue_seconds", job.started - job.created)
+            try:
+                self._convert(job)
+                job.set_state("done", files=job.output_files(), seconds=round(time.time() - job.started, 3))
+                app.metrics.add("jobs_done")
+            except Exception as e:  # also BudgetExhausted - the job fails, the service keeps running
+                self._logger.exception(f"Job {job.job_id}: {job.file_name} failed")
+                job.error = str(e)
+                job.set_state("failed", error=job.error)
+                app.metrics.add("jobs_failed")
+            finally:
+                app.metrics.observe("job_seconds", time.time() - job.started)
+                with self._lock:
+                    self._running -= 1
+                self._queue.task_done()
+
+    def to_prometheus(self, prefix: str = "ocr") -> str:
+        with self._lock:
+            running = self._running
+        lines = [f"# TYPE {prefix}_server_queue_depth gauge", f"{prefix}_server_queue_depth {self._queue.qsize()}",
+                 f"# TYPE {prefix}_server_queue_capacity gauge", f"{prefix}_server_queue_capacity {self._queue.maxsize}",
+                 f"# TYPE {prefix}_server_jobs_running gauge", f"{prefix}_server_jobs_running {running}"]
+        return app.metrics.to_prometheus(prefix) + "\n".join(lines) + "\n"
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    service: ConversionService = None
+    max_upload_bytes = 200 * 1024 * 1024
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status, text, content_type="text/plain; charset=utf-8"):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            self._send_json(404, {"error": f"unknown path {url.path}"})
+            return
+
+        file_name = os.path.basename(parse_qs(url.query).get("name", [""])[0] or self.headers.get("X-File-Name", ""))
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self.close_connection = True  # the body can not be read without its length
+            self._send_json(400, {"error": f"Content-Length must be a number of bytes, not {self.headers['Content-Length']!r}"})
+            return
+        if not app.is_supported_file(file_name):
+            self._send_json(400, {"error": "name must be a .pdf, .mhtml or .mht file name, e.g. /jobs?name=manual.pdf"})
+            return
+        if length <= 0:
+            self.close_connection = True
+            self._send_json(400, {"error": "empty upload, send the file as the request body"})
+            return
+        if length > self.max_upload_bytes:
+            self._send_json(413, {"error": f"upload of {length} bytes is larger than {self.max_upload_bytes}"})
+            return
+
+        try:
+            job = self.service.submit(file_name, self.rfile, length)
+        except queue.Full:
+            app.metrics.add("jobs_rejected")
+            self.close_connection = True  # the body was not read
+            self._send_json(503, {"error": "the job queue is full, try again later"}, {"Retry-After": "5"})
+            return
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(202, job.status(), {"Location": f"/jobs/{job.job_id}"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        if parts == ["health"]:
+            self._send_json(200, {"status": "ok"})
+        elif parts == ["metrics"]:
+            self._send_text(200, self.service.to_prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+        elif len(parts) >= 2 and parts[0] == "jobs":
+            job = self.service.get(parts[1])
+            if job is None:
+                self._send_json(404, {"error": f"unknown job {parts[1]}"})
+            elif len(parts) == 2:
+                self._send_json(200, job.status())
+            elif parts[2:] == ["events"]:
+                self._stream_events(job)
+            elif len(parts) > 3 and parts[2] == "files":
+                self._send_file(job, "/".join(parts[3:]))
+            else:
+                self._send_json(404, {"error": f"unknown path {url.path}"})
+        else:
+            self._send_json(404, {"error": f"unknown path {url.path}"})
+
+    def _stream_events(self, job: ConversionJob):
+        try:
+            start = max(0, int(self.headers.get("Last-Event-ID", -1)) + 1)
+        except ValueError:
+            start = 0  # not one of our ids - the whole stream
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()  # HTTP/1.0: the stream ends when the connection is closed
+        try:
+            while True:
+                events, finished = job.events_after(start, KEEP_ALIVE_SECONDS)
+                if not events and not finished:
+                    self.wfile.write(b": keep-alive\n\n")
+                for event_id, event in events:
+                    self.wfile.write(f"id: {event_id}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n".encode("utf-8"))
+                    start = event_id + 1
+                self.wfile.flush()
+                if finished and not events:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client went away, the job goes on
+
+    def _send_file(self, job: ConversionJob, relative_path: str):
+        root = os.path.realpath(job.job_folder)
+        path = os.path.realpath(os.path.join(root, relative_path))
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            self._send_json(404, {"error": f"no file {relative_path} in job {job.job_id}"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, "rb") as file:
+            while chunk := file.read(1024 * 1024):
+                self.wfile.write(chunk)
+
+    def log_message(self, format, *args):
+        logging.getLogger("conversion_server").debug(format, *args)
+
+
+def main():
+    logger = app.init_logger()
+    parser = app.build_parser("Local HTTP service: upload a PDF or MHTML, stream the HTML pages and image markdown back.")
+    parser.add_argument("--host", default=os.getenv('OCR_SERVER_HOST', '127.0.0.1'), help="Interface to listen on.")
+    parser.add_argument("--port", type=int, default=int(os.getenv('OCR_SERVER_PORT', 8090)), help="Port to listen on.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv('OCR_SERVER_WORKERS', 2)),
+                        help="Number of documents converted at the same time (env OCR_SERVER_WORKERS).")
+    parser.add_argument("--queue-size", type=int, default=int(os.getenv('OCR_SERVER_QUEUE_SIZE', 16)),
+                        help="Max number of waiting jobs, uploads above it get 503 (env OCR_SERVER_QUEUE_SIZE).")
+    parser.add_argument("--jobs-dir", default=os.getenv('OCR_SERVER_JOBS_DIR', 'jobs'),
+                        help="Folder for the uploads and the outputs, one folder per job (env OCR_SERVER_JOBS_DIR).")
+    parser.add_argument("--max-upload-mb", type=int, default=int(os.getenv('OCR_SERVER_MAX_UPLOAD_MB', 200)),
+                        help="Larger uploads are refused with 413.")
+    args = parser.parse_args()
+    app.configure(args)
+    app.metrics.set_info("engine", args.engine)
+    app.get_ocr_processor()  # connect and start the workers now, not with the first upload
+
+    ConversionHandler.service = ConversionService(args.jobs_dir, logger, workers=args.workers, queue_size=args.queue_size)
+    ConversionHandler.max_upload_bytes = args.max_upload_mb * 1024 * 1024
+    server = ThreadingHTTPServer((args.host, args.port), ConversionHandler)
+    server.daemon_threads = True  # open event streams must not keep the process alive on shutdown
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+
+    logger.warning(f"Listening on http://{args.host}:{args.port}, {args.workers} workers, engine {args.engine}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        app.write_run_report(args.report)
+        app.close_ocr_processor()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import os
+import re
+import argparse
+from classes.image_upload_optimizer import ImageUploadOptimizer
+
+"""
+Offline report of what ImageUploadOptimizer saves per image - no API key or network needed.
+
+usage:
+    python estimate_upload_savings.py --path test1 --max-edge 1024 --detail high
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate bytes and image tokens saved by the upload optimizer.")
+    parser.add_argument("--path", required=True, help="Folder with images (searched recursively).")
+    parser.add_argument("--max-edge", type=int, default=2048, help="Longest edge after downscaling. 0 = no downscaling.")
+    parser.add_argument("--detail", choices=["low", "high", "auto"], default=None, help="Detail level that would be sent.")
+    parser.add_argument("--quality", type=int, default=85, help="JPEG/WebP quality.")
+    parser.add_argument("--webp", action="store_true", help="Use WebP instead of JPEG for photo like images.")
+    args = parser.parse_args()
+
+    optimizer = ImageUploadOptimizer(max_edge=args.max_edge, detail=args.detail, jpeg_quality=args.quality, use_webp=args.webp)
+    image_pattern = re.compile(r'^.*\.(jpe?g|png|gif|webp)$', re.IGNORECASE)
+
+    totals = {"bytes_before": 0, "bytes_after": 0, "tokens_before": 0, "tokens_after": 0}
+    for root, dirs, files in os.walk(args.path):
+        dirs.sort()
+        for file in sorted(files):
+            if not image_pattern.match(file):
+                continue
+            image_path = os.path.join(root, file)
+            with open(image_path, "rb") as image_file:
+                _, _, stats = optimizer.prepare(image_file.read())
+
+            for key in totals:
+                totals[key] += stats[key]
+            print(f"{image_path}: {stats['size_before'][0]}x{stats['size_before'][1]} -> "
+                  f"{stats['size_after'][0]}x{stats['size_after'][1]} {stats['mime_type']}, "
+                  f"{stats['bytes_before']} -> {stats['bytes_after']} bytes, "
+                  f"~{stats['tokens_before']} -> ~{stats['tokens_after']} tokens")
+
+    print(f"total: {totals['bytes_before']} -> {totals['bytes_after']} bytes "
+          f"(saved {totals['bytes_before'] - totals['bytes_after']}), "
+          f"~{totals['tokens_before']} -> ~{totals['tokens_after']} tokens "
+          f"(saved ~{totals['tokens_before'] - totals['tokens_after']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import argparse
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+A local fake of the OpenAI chat completions endpoint. Used to test the AI pipeline
+(concurrency, ordering etc.) without network access and without paying for tokens.
+
+usage:
+    python fake_openai_server.py --port 8085 --latency 2.0
+    OPENAI_BASE_URL=http://127.0.0.1:8085/v1 OPENAI_API_KEY=sk-fake OPENAI_ORGID=org-fake python app.py --path ...
+
+Every request sleeps for latency (+/- jitter) seconds and returns a small markdown
+containing a hash of the image, so the answers are deterministic per image.
+
+To test retries and rate limiting, errors can be injected:
+    python fake_openai_server.py --error-rate 0.2 --error-status 429 --retry-after 1 --rpm 60
+--error-rate answers that fraction of the requests with --error-status, --rpm answers 429 to the
+requests above the limit in the last 60 seconds - both with a Retry-After header when set.
+--fail-first N answers the first N requests with --error-status, for tests that need to know
+exactly which requests fail.
+"""
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    jitter = 0.0
+    model = "gpt-4o-fake"
+    error_rate = 0.0
+    error_status = 429
+    retry_after = None
+    rpm = None
+    fail_first = 0
+    _failed = 0  # of fail_first so far
+    _recent = deque()  # start times of the requests in the last minute, for --rpm
+    _recent_lock = threading.Lock()
+
+    def _send_error(self, status, message):
+        body = json.dumps({"error": {"message": message, "type": "rate_limit_exceeded" if status == 429 else "server_error"}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.retry_after is not None:
+            self.send_header("Retry-After", str(self.retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _over_rate_limit(self):
+        if not self.rpm:
+            return False
+        now = time.monotonic()
+        with self._recent_lock:
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            if len(self._recent) >= self.rpm:
+                return True
+            self._recent.append(now)
+            return False
+
+    def _inject_error(self):
+        with self._recent_lock:
+            if FakeOpenAIHandler._failed < self.fail_first:
+                FakeOpenAIHandler._failed += 1
+                return True
+        return random.random() < self.error_rate
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _image_digest(self, request):
+        for message in request.get("messages", []):
+            content = message.get("content")
+            if not isinstance(content, list):
+                continue
+            for item in content:
+                if item.get("type") == "image_url":
+                    url = item["image_url"]["url"]
+                    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        return "no-image"
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if self._over_rate_limit():
+            self._send_error(429, f"Rate limit reached: {self.rpm} requests per min")
+            return
+
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        if self._inject_error():
+            self._send_error(self.error_status, f"Injected error {self.error_status}")
+            return
+
+        digest = self._image_digest(request)
+        content = f"| fake ocr |\n|---|\n| image {digest} |\n"
+        completion_tokens = len(content.split())
+        self._send_json(200, {
+            "id"      : f"chatcmpl-{digest}",
+            "object"  : "chat.completion",
+            "created" : int(time.time()),
+            "model"   : self.model,
+            "choices" : [{
+                "index"         : 0,
+                "message"       : {"role": "assistant", "content": content},
+                "finish_reason" : "stop"
+            }],
+            "usage"   : {
+                "prompt_tokens"     : 100,
+                "completion_tokens" : completion_tokens,
+                "total_tokens"      : 100 + completion_tokens
+            }
+        })
+
+    def log_message(self, format, *args):
+        logging.getLogger("fake_openai_server").debug(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake of the OpenAI chat completions endpoint.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on.")
+    parser.add_argument("--port", type=int, default=8085, help="Port to listen on.")
+    parser.add_argument("--latency", type=float, default=1.0, help="Seconds to sleep per request.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to the latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of the requests answered with --error-status.")
+    parser.add_argument("--error-status", type=int, default=429, help="HTTP status of the injected errors, e.g. 429 or 503.")
+    parser.add_argument("--retry-after", type=float, help="Retry-After header (seconds) sent with the errors.")
+    parser.add_argument("--rpm", type=int, help="Answer 429 to the requests above this many per minute.")
+    parser.add_argument("--fail-first", type=int, default=0, help="Answer the first N requests with --error-status.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    FakeOpenAIHandler.latency = args.latency
+    FakeOpenAIHandler.jitter = args.jitter
+    FakeOpenAIHandler.error_rate = args.error_rate
+    FakeOpenAIHandler.error_status = args.error_status
+    FakeOpenAIHandler.retry_after = args.retry_after
+    FakeOpenAIHandler.rpm = args.rpm
+    FakeOpenAIHandler.fail_first = args.fail_first
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeOpenAIHandler)
+    logging.getLogger("fake_openai_server").info(f"Listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import os
+import re
+import json
+import time
+import logging
+import argparse
+from dotenv import load_dotenv
+from classes.ocr_engine import create_ocr_engine, ENGINE_NAMES
+
+"""
+Runs OCR engines over a fixed corpus and compares throughput and quality.
+
+Per engine: images/s, p50/p95 latency, bytes uploaded, tokens and the character error rate
+(CER = edit distance / length of the golden text) against golden .md files. The golden file
+of image_1_1.jpeg is image_1_1.md, or else the first image_1_1_*.md in the golden folder -
+like the earlier results in result/ and test1/.
+
+Markdown syntax (table pipes, bold, headers) and whitespace are normalized away before the
+CER is computed, so a table and plain text with the same words compare as equal.
+
+usage:
+    python ocr_benchmark.py --engines fake,tesseract,ai --corpus ../test1 --golden ../test1 --out ocr_benchmark.json
+"""
+
+
+def find_images(corpus):
+    return sorted(os.path.join(corpus, file) for file in os.listdir(corpus)
+                  if re.match(r'^.*\.(jpe?g|png)$', file, re.IGNORECASE))
+
+
+def find_golden(golden_folder, source_image):
+    stem = os.path.splitext(os.path.basename(source_image))[0]
+    candidates = sorted(file for file in os.listdir(golden_folder) if file.endswith(".md"))
+    if f"{stem}.md" in candidates:
+        return os.path.join(golden_folder, f"{stem}.md")
+    for file in candidates:
+        if file.startswith(f"{stem}_"):
+            return os.path.join(golden_folder, file)
+    return None
+
+
+def normalize(text):
+    text = re.sub(r"-{3,}|[|*#`]", " ", text)
+    return " ".join(text.split()).lower()
+
+
+def edit_distance(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def character_error_rate(text, golden):
+    text, golden = normalize(text), normalize(golden)
+    if not golden:
+        return 0.0 if not text else 1.0
+    return edit_distance(text, golden) / len(golden)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def benchmark_engine(engine, images, golden_folder):
+    latencies, error_rates = [], []
+    bytes_uploaded, tokens = 0, 0
+
+    start = time.perf_counter()
+    for source_image in images:
+        image_start = time.perf_counter()
+        result = engine.recognize(source_image)
+        latencies.append(time.perf_counter() - image_start)
+        bytes_uploaded += result.get("bytes_uploaded", 0)
+        tokens += result.get("tokens", 0)
+
+        golden_file = find_golden(golden_folder, source_image) if golden_folder else None
+        if golden_file:
+            with open(golden_file, "r", encoding="utf-8") as f:
+                error_rates.append(character_error_rate(result["markdown"], f.read()))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "engine"         : engine.name,
+        "images"         : len(images),
+        "images_per_s"   : len(images) / elapsed if elapsed else None,
+        "p50_latency_s"  : percentile(latencies, 0.50),
+        "p95_latency_s"  : percentile(latencies, 0.95),
+        "bytes_uploaded" : bytes_uploaded,
+        "tokens"         : tokens,
+        "golden_images"  : len(error_rates),
+        "mean_cer"       : sum(error_rates) / len(error_rates) if error_rates else None
+    }
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Benchmark OCR engines on a fixed corpus.")
+    parser.add_argument("--engines", default="fake,tesseract", help=f"Comma separated, any of {', '.join(ENGINE_NAMES)}.")
+    parser.add_argument("--corpus", default="../test1", help="Folder with the images.")
+    parser.add_argument("--golden", default="../test1", help="Folder with the golden .md files. Empty = no CER.")
+    parser.add_argument("--tesseract-workers", type=int, default=0, help="0 = pytesseract per image, else batches of images per tesseract process.")
+    parser.add_argument("--out", default="ocr_benchmark.json", help="Where the JSON report is written.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger("ocr_benchmark")
+    images = find_images(args.corpus)
+
+    reports = []
+    for name in args.engines.split(","):
+        engine = create_ocr_engine(name.strip(), logger, tesseract_workers=args.tesseract_workers)
+        report = benchmark_engine(engine, images, args.golden or None)
+        reports.append(report)
+        cer = f"{report['mean_cer']:.3f}" if report["mean_cer"] is not None else "-"
+        print(f"{report['engine']:10s} {report['images_per_s']:8.2f} images/s  p50 {report['p50_latency_s']:6.2f}s  "
+              f"p95 {report['p95_latency_s']:6.2f}s  {report['bytes_uploaded']:10d} bytes  {report['tokens']:7d} tokens  CER {cer}")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"corpus": args.corpus, "golden": args.golden, "engines": reports}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,7 @@ def main() -> None:
     # parse arguments, there is a default file set
     parser = argparse.ArgumentParser(description="Convert PDF to HTML with extracted images.")
     parser.add_argument("--pdf", default="../images/test1.pdf", help="Path to the PDF file.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes extracting pages. 1 = serial.")
     args   = parser.parse_args()
 
     # process file
@@ -36,9 +37,9 @@ def main() -> None:
 
     converter = PDFToTextAndImages(logger)
 
-    # do it in two steps
+    # do it in two steps - the pages are extracted lazily while the HTML is written
     logger.info(f"Starting PDF to HTML conversion of {pdf_path} in folder: {os.getcwd()}")
-    pages_elements   = converter.extract_images_and_text(pdf_path, output_folder)
+    pages_elements   = converter.iter_pages_elements(pdf_path, output_folder, workers=args.workers)
     output_html_path = os.path.join(output_folder, f"{base_name}.html")
 
     converter.generate_html(pages_elements, output_html_path)
@@ -0,0 +1,76 @@
+import os
+import sys
+import shutil
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)  # the scripts import classes.* from src/, like the benchmarks
+
+import app
+import classes.ai_image_processor
+from fake_openai_server import FakeOpenAIHandler
+
+"""
+Shared fixtures: the fake OpenAI endpoint, an app.py configured for the fake OCR engine and the
+example documents. Nothing here needs network access or an API key.
+
+run (from the repository root):
+    python -m pytest -q
+"""
+
+SAMPLE_PDF = os.path.join(os.path.dirname(SRC), "images", "test1.pdf")
+
+# configure() replaces these, the fixture puts the originals back after every test
+APP_STATE = ("max_in_flight", "ai_cache", "pdf_workers", "upload_optimizer", "ai_batch", "manifest", "html_backend",
+             "ocr_settings", "ocr_processor", "metrics", "metrics_file", "budget", "rate_limiter", "image_triage",
+             "phash_index", "journal", "resume", "file_order")
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """a FakeOpenAIHandler on a free port - returns the handler class, set latency, fail_first ... on it"""
+    for name in ("latency", "jitter", "error_rate", "error_status", "retry_after", "rpm", "fail_first"):
+        monkeypatch.setattr(FakeOpenAIHandler, name, getattr(FakeOpenAIHandler, name))
+    monkeypatch.setattr(FakeOpenAIHandler, "latency", 0.0)
+    monkeypatch.setattr(FakeOpenAIHandler, "_failed", 0)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(classes.ai_image_processor, "load_dotenv", lambda **_: None)  # a developer .env must not win
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-fake")
+    monkeypatch.setenv("OPENAI_ORGID", "org-fake")
+    yield FakeOpenAIHandler
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def configured_app(tmp_path, monkeypatch):
+    """app.py configured like `app.py --engine fake --force --no-cache --no-phash` in an empty working dir"""
+    monkeypatch.chdir(tmp_path)
+    for name in APP_STATE:
+        monkeypatch.setattr(app, name, getattr(app, name))
+    monkeypatch.setattr(app, "ocr_settings", dict(app.ocr_settings))
+    monkeypatch.setattr(app, "metrics", app.RunMetrics())
+    if app.logger is None:
+        app.init_logger()
+
+    def configure(*extra_args):
+        args = app.build_parser().parse_args(["--engine", "fake", "--force", "--no-cache", "--no-phash", *extra_args])
+        app.configure(args)
+        return args
+    return configure
+
+
+@pytest.fixture
+def sample_pdf(tmp_path):
+    path = tmp_path / "in" / "test1.pdf"
+    path.parent.mkdir()
+    shutil.copy(SAMPLE_PDF, path)
+    return str(path)
@@ -0,0 +1,126 @@
+import os
+import json
+import logging
+
+import pytest
+from PIL import Image
+
+import app
+from classes.ai_batch import AIBatch
+from classes.ai_image_processor import AIImageProcessor
+from classes.ai_result_cache import AIResultCache
+
+"""
+Batch mode offline: the request JSONL, a results JSONL as the Batch API returns it, the .md files
+and the documents that are done - split request files, and cached images that are not sent again.
+"""
+
+logger = logging.getLogger("test_ai_batch")
+
+
+def make_images(folder, count):
+    paths = []
+    for number in range(count):
+        path = os.path.join(folder, f"image_{number}.jpeg")
+        Image.new("RGB", (64, 48), (number * 40 % 256, 80, 160)).save(path, "JPEG")
+        paths.append(path)
+    return paths
+
+
+def read_requests(batch):
+    requests = []
+    for part in batch.parts:
+        with open(part["file"]) as f:
+            requests += [json.loads(line) for line in f]
+    return requests
+
+
+def write_results(path, requests, failing=()):
+    """a results JSONL like the Batch API's: one answer per custom_id, a 500 for the failing ones"""
+    with open(path, "w") as f:
+        for request in requests:
+            custom_id = request["custom_id"]
+            if custom_id in failing:
+                f.write(json.dumps({"custom_id": custom_id, "response": {"status_code": 500, "body": {}}, "error": None}) + "\n")
+                continue
+            body = {"model": "gpt-4o-batch", "usage": {"total_tokens": 100},
+                    "choices": [{"message": {"content": f"| {custom_id} |"}}]}
+            f.write(json.dumps({"custom_id": custom_id, "response": {"status_code": 200, "body": body}, "error": None}) + "\n")
+    return path
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # jobs without an output file write next to the cwd
+    return AIImageProcessor(cache=AIResultCache(str(tmp_path / "cache")), connect=False)
+
+
+def test_ingest_writes_markdown_and_completes_documents(tmp_path, processor):
+    batch = AIBatch(processor, str(tmp_path / "ocr_batch.jsonl"), logger)
+    images = make_images(str(tmp_path), 3)
+    batch.add_document("doc.pdf", "sha", str(tmp_path))
+    assert batch.add_requests([(image, os.path.splitext(image)[0] + ".md") for image in images], document="doc.pdf") == 3
+    requests = read_requests(batch)
+    assert [request["body"]["model"] for request in requests] == ["gpt-4o"] * 3
+
+    failing = requests[2]["custom_id"]
+    assert batch.ingest_results(write_results(str(tmp_path / "first.jsonl"), requests, failing={failing})) == [failing]
+    assert os.path.exists(tmp_path / "image_0___model_gpt-4o-batch_tokens_100.md")
+    assert not os.path.exists(tmp_path / "image_2___model_gpt-4o-batch_tokens_100.md")
+    assert batch.completed_documents() == []  # one answer is missing
+
+    batch.ingest_results(write_results(str(tmp_path / "retry.jsonl"), requests[2:]))
+    documents = AIBatch(processor, batch.batch_file, logger).completed_documents()  # also after a restart
+    assert [document["path"] for document in documents] == ["doc.pdf"]
+    assert sorted(os.path.basename(result_file) for _, result_file in documents[0]["results"]) == \
+           [f"image_{number}___model_gpt-4o-batch_tokens_100.md" for number in range(3)]
+    with open(tmp_path / "image_1___model_gpt-4o-batch_tokens_100.md") as f:
+        assert f.read() == f"| {requests[1]['custom_id']} |"
+
+
+def test_full_request_files_continue_in_the_next_part(tmp_path, processor):
+    batch = AIBatch(processor, str(tmp_path / "ocr_batch.jsonl"), logger, max_requests=2)
+    images = make_images(str(tmp_path), 5)
+    batch.add_requests([(image, "") for image in images])
+
+    assert [os.path.basename(part["file"]) for part in batch.parts] == ["ocr_batch.jsonl", "ocr_batch.2.jsonl", "ocr_batch.3.jsonl"]
+    assert [part["requests"] for part in batch.parts] == [2, 2, 1]
+
+    largest = max(len(json.dumps(request)) + 1 for request in read_requests(batch))
+    by_size = AIBatch(processor, str(tmp_path / "by_size.jsonl"), logger, max_bytes=largest * 2)
+    by_size.add_requests([(image, "") for image in images])
+    assert [part["requests"] for part in by_size.parts] == [2, 2, 1]
+    assert all(os.path.getsize(part["file"]) <= largest * 2 for part in by_size.parts)
+
+
+def test_cached_images_are_not_sent_again(tmp_path, processor):
+    images = make_images(str(tmp_path), 3)
+    first = AIBatch(processor, str(tmp_path / "first.jsonl"), logger)
+    first.add_requests([(image, "") for image in images[:2]])
+    first.ingest_results(write_results(str(tmp_path / "results.jsonl"), read_requests(first)))
+
+    second = AIBatch(processor, str(tmp_path / "second.jsonl"), logger)
+    second.add_document("doc.pdf", "sha", str(tmp_path))
+    jobs = [(image, os.path.join(str(tmp_path), f"again_{number}.md")) for number, image in enumerate(images)]
+    assert second.add_requests(jobs, document="doc.pdf") == 1
+
+    assert [request["custom_id"] for request in read_requests(second)] == [second._make_custom_id(images[2])]
+    assert os.path.exists(tmp_path / "again_0___model_gpt-4o-batch_tokens_100.md")
+    second.ingest_results(write_results(str(tmp_path / "results2.jsonl"), read_requests(second)))
+    assert [document["path"] for document in second.completed_documents()] == ["doc.pdf"]
+
+
+def test_a_document_is_done_once_its_answers_are_ingested(configured_app, sample_pdf, monkeypatch):
+    configured_app("--no-triage")
+    batch = AIBatch(AIImageProcessor(connect=False), "ocr_batch.jsonl", app.logger)
+    monkeypatch.setattr(app, "ai_batch", batch)
+
+    assert app.process_file(sample_pdf, "test1")
+    sha256 = app.file_sha256(sample_pdf)
+    assert app.journal.begin(sample_pdf, sha256, "test1", resume=True)["state"] == "extracted"
+
+    batch.ingest_results(write_results("results.jsonl", read_requests(batch)))
+    app.record_ingested_documents(batch)
+
+    assert app.journal.begin(sample_pdf, sha256, "test1", resume=True)["state"] == "done"
+    assert len([name for name in os.listdir("test1") if name.endswith("_tokens_100.md")]) == 3
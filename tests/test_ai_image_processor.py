@@ -0,0 +1,33 @@
+import pytest
+
+import classes.ai_image_processor
+from classes.ai_image_processor import AIImageProcessor
+
+"""
+The organization check of create_client: skipped for a local endpoint like fake_openai_server.py,
+kept for OpenAI and for any other OPENAI_BASE_URL.
+"""
+
+
+@pytest.fixture
+def environment(monkeypatch):
+    monkeypatch.setattr(classes.ai_image_processor, "load_dotenv", lambda **_: None)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("OPENAI_ORGID", "org-wrong")
+    return monkeypatch
+
+
+@pytest.mark.parametrize("base_url", ["http://127.0.0.1:8085/v1", "http://localhost:8085/v1"])
+def test_local_endpoint_skips_the_organization_check(environment, base_url):
+    environment.setenv("OPENAI_BASE_URL", base_url)
+    assert AIImageProcessor().client is not None
+
+
+@pytest.mark.parametrize("base_url", [None, "https://openai-proxy.example.com/v1", "http://127.0.0.1.example.com/v1"])
+def test_other_endpoints_check_the_organization(environment, base_url):
+    if base_url:
+        environment.setenv("OPENAI_BASE_URL", base_url)
+    else:
+        environment.delenv("OPENAI_BASE_URL", raising=False)
+    with pytest.raises(Exception, match="wrong orgid"):
+        AIImageProcessor()
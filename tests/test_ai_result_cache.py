@@ -0,0 +1,62 @@
+import os
+import time
+
+from classes.ai_result_cache import AIResultCache
+
+"""
+The AI result cache: hits and misses, least recently used entries evicted first, down to the low
+water mark - also in the order of the file times after a restart.
+"""
+
+
+def entry(number):
+    return {"markdown": f"| entry {number:02d} |" + " " * 80, "model": "gpt-4o", "total_tokens": 100 + number}  # all the same size
+
+
+def entry_size(cache):
+    return cache.stats()["bytes"] // cache.stats()["entries"]
+
+
+def test_hit_and_miss(tmp_path):
+    cache = AIResultCache(str(tmp_path))
+    key = AIResultCache.make_key(b"image", "instructions", "gpt-4o", 4096)
+
+    assert cache.get(key) is None
+    cache.put(key, entry(1))
+    assert cache.get(key) == entry(1)
+    assert key in cache and AIResultCache.make_key(b"image", "other", "gpt-4o", 4096) not in cache
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert AIResultCache(str(tmp_path)).get(key) == entry(1)  # persistent
+
+
+def test_least_recently_used_is_evicted_to_the_low_water_mark(tmp_path):
+    cache = AIResultCache(str(tmp_path / "cache"), max_bytes=10_000)
+    cache.put("k0", entry(0))
+    size = entry_size(cache)
+    cache.max_bytes = size * 10  # room for exactly 10 entries, evicted down to 9
+    for number in range(1, 10):
+        cache.put(f"k{number}", entry(number))
+    cache.get("k0")  # now the most recently used
+
+    cache.put("k10", entry(10))  # 11 entries: over the limit
+
+    keys = [f"k{number}" for number in range(11)]
+    assert [key for key in keys if key not in cache] == ["k1", "k2"]
+    assert cache.stats()["bytes"] <= cache.max_bytes * cache.low_water
+    assert not os.path.exists(cache._entry_path("k1"))
+
+    cache.put("k11", entry(11))  # below the limit again: nothing evicted
+    assert cache.stats()["evicted"] == 2
+
+
+def test_order_after_a_restart_follows_the_file_times(tmp_path):
+    cache = AIResultCache(str(tmp_path), max_bytes=10_000)
+    for number in range(3):
+        cache.put(f"k{number}", entry(number))
+    now = time.time()
+    for age, key in enumerate(["k1", "k2", "k0"]):  # k1 oldest
+        os.utime(cache._entry_path(key), (now - 100 + age, now - 100 + age))
+
+    reopened = AIResultCache(str(tmp_path), max_bytes=entry_size(cache) * 3)
+    reopened.put("k3", entry(3))
+    assert [key for key in ("k0", "k1", "k2", "k3") if key in reopened] == ["k0", "k3"]
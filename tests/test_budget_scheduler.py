@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+import app
+from classes.budget_scheduler import BudgetScheduler, BudgetExhausted
+
+"""
+The budget: without one nothing waits, with one the first request goes alone and the run stops
+before it overshoots - and the spend of an earlier run only counts with resume.
+"""
+
+
+def test_without_a_budget_requests_do_not_wait():
+    budget = BudgetScheduler()
+    reservations = [budget.acquire() for _ in range(4)]  # the first one is not charged yet - nothing blocks
+    assert reservations == [0, 0, 0, 0]
+
+
+def test_first_request_goes_alone_then_the_budget_stops_the_run():
+    budget = BudgetScheduler(max_tokens=250)
+    first = budget.acquire()
+    second_acquired = threading.Event()
+
+    def second():
+        budget.acquire()
+        second_acquired.set()
+    threading.Thread(target=second, daemon=True).start()
+    assert not second_acquired.wait(0.2)  # the cost of a request is not known yet
+
+    budget.charge(80, 20, first)
+    assert second_acquired.wait(5)
+    budget.charge(80, 20, 100)
+    with pytest.raises(BudgetExhausted):
+        budget.acquire()  # 200 spent, another 100 does not fit in 250
+
+
+def test_spend_carries_over_only_with_resume(tmp_path):
+    checkpoint_path = str(tmp_path / "budget_checkpoint.json")
+    budget = BudgetScheduler(max_tokens=1000, checkpoint_path=checkpoint_path)
+    budget.charge(600, 300, budget.acquire())
+    budget.checkpoint(["a.pdf"], ["b.pdf"])
+
+    assert BudgetScheduler(max_tokens=1000, checkpoint_path=checkpoint_path).summary()["prompt_tokens"] == 0
+    assert BudgetScheduler(max_tokens=1000, checkpoint_path=checkpoint_path, resume=True).summary()["prompt_tokens"] == 600
+
+
+def test_no_budget_scheduler_without_a_budget_flag(configured_app):
+    configured_app()
+    assert app.budget is None
+    configured_app("--budget-tokens", "1000")
+    assert app.budget is not None and app.budget.max_tokens == 1000
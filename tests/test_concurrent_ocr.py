@@ -0,0 +1,82 @@
+import os
+import time
+import threading
+
+from PIL import Image
+
+import app
+from classes.ai_image_processor import AIImageProcessor
+from classes.ocr_engine import FakeOCREngine, process_jobs
+
+"""
+The bounded OCR pool of jpeg_to_markdown (process_jobs): results in the order of the jobs, whatever
+order they finish in, and the requests really in flight at the same time.
+"""
+
+
+class SlowFirstEngine(FakeOCREngine):
+    """the first job is the slowest, so the jobs finish in reverse order"""
+
+    def __init__(self, jobs):
+        super().__init__()
+        self._latency = {source_image: 0.05 * (len(jobs) - index) for index, (source_image, _) in enumerate(jobs)}
+        self.finished = []
+        self._lock = threading.Lock()
+
+    def recognize(self, source_image):
+        time.sleep(self._latency[source_image])
+        with self._lock:
+            self.finished.append(source_image)
+        return super().recognize(source_image)
+
+
+def make_images(folder, count):
+    paths = []
+    for number in range(count):
+        path = os.path.join(folder, f"image_{number}.jpeg")
+        Image.new("RGB", (64, 48), (number * 30 % 256, 80, 160)).save(path, "JPEG")
+        paths.append(path)
+    return paths
+
+
+def test_results_are_in_job_order(tmp_path):
+    jobs = [(path, os.path.splitext(path)[0] + ".md") for path in make_images(str(tmp_path), 6)]
+    engine = SlowFirstEngine(jobs)
+    done = []
+
+    output_files = process_jobs(engine, jobs, max_workers=6, on_done=lambda job, output_file: done.append(job))
+
+    assert engine.finished == [source_image for source_image, _ in reversed(jobs)]
+    assert output_files == [f"{os.path.splitext(output_file)[0]}___model_fake_tokens_0.md" for _, output_file in jobs]
+    assert sorted(done) == sorted(jobs)
+    for (source_image, _), output_file in zip(jobs, output_files):
+        with open(output_file) as file:
+            assert os.path.basename(source_image) in file.read()
+
+
+def test_ai_requests_are_concurrent(tmp_path, fake_openai):
+    fake_openai.latency = 0.3
+    jobs = [(path, os.path.splitext(path)[0] + ".md") for path in make_images(str(tmp_path), 8)]
+
+    start = time.perf_counter()
+    output_files = process_jobs(AIImageProcessor(), jobs, max_workers=4)
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 8 * 0.3 * 0.6  # 4 in flight: ~2 rounds of 0.3s, one at a time would be 2.4s
+    assert [os.path.basename(output_file).split("___")[0] for output_file in output_files] == \
+           [f"image_{number}" for number in range(8)]
+    answers = set()
+    for output_file in output_files:
+        with open(output_file) as file:
+            answers.add(file.read())
+    assert len(answers) == 8  # every image got its own answer, not a neighbour's
+
+
+def test_process_file_writes_a_markdown_per_image(configured_app, sample_pdf):
+    configured_app("--no-triage", "--max-in-flight", "3")
+
+    assert app.process_file(sample_pdf, "test1")
+
+    images = sorted(name for name in os.listdir("test1") if name.endswith(".jpeg"))
+    markdowns = sorted(name for name in os.listdir("test1") if name.endswith(".md"))
+    assert images and markdowns == [f"{os.path.splitext(name)[0]}___model_fake_tokens_0.md" for name in images]
@@ -0,0 +1,153 @@
+import json
+import socket
+import sqlite3
+import threading
+import http.client
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import app
+from conversion_server import ConversionHandler, ConversionService
+
+"""
+The conversion service end to end over HTTP, with the fake OCR engine: upload, the job's server-sent
+events until it is done, the output files - and the bounded queue answering 503 when it is full.
+"""
+
+
+@pytest.fixture
+def start_server(tmp_path, monkeypatch):
+    servers = []
+
+    def start(workers=1, queue_size=4):
+        service = ConversionService(str(tmp_path / "jobs"), app.logger, workers=workers, queue_size=queue_size)
+        monkeypatch.setattr(ConversionHandler, "service", service)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), ConversionHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_address[1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def request(port, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.request(method, path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    return response.status, dict(response.getheaders()), response.read()
+
+
+def upload(port, pdf_path):
+    with open(pdf_path, "rb") as pdf:
+        return request(port, "POST", "/jobs?name=test1.pdf", body=pdf.read())
+
+
+def read_events(port, job_id, last_event_id=None):
+    """all events of the stream, it ends when the job is finished"""
+    headers = {"Last-Event-ID": str(last_event_id)} if last_event_id is not None else {}
+    status, _, body = request(port, "GET", f"/jobs/{job_id}/events", headers=headers)
+    assert status == 200
+    events = []
+    for block in body.decode("utf-8").split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if line and not line.startswith(":"))
+        if fields:
+            events.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_upload_streams_every_image_then_done(configured_app, start_server, sample_pdf):
+    configured_app("--no-triage")
+    port = start_server()
+
+    status, headers, body = upload(port, sample_pdf)
+    assert status == 202
+    job_id = json.loads(body)["job_id"]
+    assert headers["Location"] == f"/jobs/{job_id}"
+
+    events = read_events(port, job_id)
+    assert [event_id for event_id, _, _ in events] == list(range(len(events)))
+    assert events[-1][1] == "done"
+    images = [data for _, name, data in events if name == "image"]
+    assert len(images) == 3
+
+    status, _, body = request(port, "GET", f"/jobs/{job_id}")
+    job = json.loads(body)
+    assert job["state"] == "done"
+    for image in images:
+        assert image["file"] in job["files"]
+        status, _, content = request(port, "GET", f"/jobs/{job_id}/files/{image['file']}")
+        assert status == 200 and content.decode("utf-8") == image["markdown"]
+
+    # a client that reconnects after the second last event only gets the last one
+    assert read_events(port, job_id, last_event_id=len(events) - 2) == events[-1:]
+
+
+def test_files_outside_the_job_are_refused(configured_app, start_server, sample_pdf):
+    configured_app("--no-triage")
+    port = start_server()
+    job_id = json.loads(upload(port, sample_pdf)[2])["job_id"]
+    read_events(port, job_id)
+
+    status, _, _ = request(port, "GET", f"/jobs/{job_id}/files/../../../../etc/passwd")
+    assert status == 404
+
+
+def test_full_queue_answers_503(configured_app, start_server, sample_pdf, monkeypatch):
+    configured_app()
+    release = threading.Event()
+    running = threading.Event()
+
+    def blocked_process_file(file_path, output_folder=None, listener=None):
+        running.set()
+        release.wait(30)
+        return True
+    monkeypatch.setattr(app, "process_file", blocked_process_file)
+    port = start_server(workers=1, queue_size=1)
+
+    first = json.loads(upload(port, sample_pdf)[2])["job_id"]
+    assert running.wait(10)  # the worker has the first job, the queue is empty again
+    second_status = upload(port, sample_pdf)[0]
+    status, headers, _ = upload(port, sample_pdf)
+
+    assert second_status == 202
+    assert status == 503 and headers["Retry-After"] == "5"
+    _, _, metrics = request(port, "GET", "/metrics")
+    assert "ocr_server_queue_depth 1" in metrics.decode("utf-8")
+
+    release.set()
+    assert read_events(port, first)[-1][1] == "done"
+
+
+def raw_request(port, head):
+    """a request http.client would not send - returns the status code, or None when the connection was dropped"""
+    with socket.create_connection(("127.0.0.1", port), timeout=30) as connection:
+        connection.sendall(head.encode("latin-1"))
+        answer = connection.makefile("rb").readline()
+    return int(answer.split()[1]) if answer else None
+
+
+def test_bad_headers_are_answered(configured_app, start_server, sample_pdf):
+    configured_app("--no-triage")
+    port = start_server()
+
+    assert raw_request(port, "POST /jobs?name=test1.pdf HTTP/1.1\r\nHost: x\r\nContent-Length: ten\r\n\r\n") == 400
+    assert raw_request(port, "POST /jobs?name=test1.pdf HTTP/1.1\r\nHost: x\r\n\r\n") == 400
+
+    job_id = json.loads(upload(port, sample_pdf)[2])["job_id"]
+    events = read_events(port, job_id)
+    assert read_events(port, job_id, last_event_id="abc") == events  # not one of ours: the whole stream
+
+
+def test_finished_jobs_leave_no_journal_rows(configured_app, start_server, sample_pdf):
+    configured_app("--no-triage")
+    port = start_server()
+    job_id = json.loads(upload(port, sample_pdf)[2])["job_id"]
+    assert read_events(port, job_id)[-1][1] == "done"
+
+    with sqlite3.connect(app.journal.journal_path) as db:
+        assert [db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("documents", "pages", "images")] == [0, 0, 0]
@@ -0,0 +1,69 @@
+import logging
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from classes.image_triage import ImageTriage
+
+"""
+The triage rules on made up images: a solid color is blank, an icon is tiny, a gradient is
+decorative, a screenshot with text is kept - and the overrides file wins over the scores.
+"""
+
+logger = logging.getLogger("test_image_triage")
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = {}
+
+    solid = Image.new("RGB", (400, 300), (30, 90, 200))
+    paths["solid"] = str(tmp_path / "solid.jpeg")
+    solid.save(paths["solid"], "JPEG")
+
+    icon = Image.fromarray(np.random.default_rng(1).integers(0, 255, (16, 16, 3), dtype=np.uint8))
+    paths["icon"] = str(tmp_path / "icon.png")
+    icon.save(paths["icon"])
+
+    gradient = np.tile(np.linspace(0, 255, 400, dtype=np.uint8), (300, 1))
+    paths["gradient"] = str(tmp_path / "gradient.jpeg")
+    Image.fromarray(gradient).convert("RGB").save(paths["gradient"], "JPEG", quality=95)
+
+    text = Image.new("RGB", (800, 600), "white")
+    draw = ImageDraw.Draw(text)
+    for line in range(20):
+        draw.text((20, 20 + line * 28), f"Line {line}: press Settings > Network > Advanced and choose OK", fill="black")
+    paths["text"] = str(tmp_path / "text.jpeg")
+    text.save(paths["text"], "JPEG")
+    return paths
+
+
+def reasons(triage, images):
+    _, decisions = triage.triage(list(images.values()))
+    return {name: (decision["skip"], decision["reason"]) for name, decision in zip(images, decisions)}
+
+
+def test_rules(images):
+    keep, _ = ImageTriage(logger).triage(list(images.values()))
+    assert keep == [images["text"]]
+    assert reasons(ImageTriage(logger), images) == {"solid": (True, "blank"), "icon": (True, "tiny"),
+                                                    "gradient": (True, "decorative"), "text": (False, None)}
+
+
+def test_overrides_win(images, tmp_path):
+    overrides_file = tmp_path / "overrides.txt"
+    overrides_file.write_text("# always read the banners\nocr solid*.jpeg\nskip text.jpeg\n")
+    triage = ImageTriage(logger, overrides=ImageTriage.load_overrides(str(overrides_file)))
+
+    decided = reasons(triage, images)
+    assert decided["solid"] == (False, "blank")  # still scored as blank, but sent to OCR
+    assert decided["text"] == (True, "override")
+    assert decided["icon"] == (True, "tiny")
+
+
+def test_bad_override_line(tmp_path):
+    overrides_file = tmp_path / "overrides.txt"
+    overrides_file.write_text("keep *.jpeg\n")
+    with pytest.raises(ValueError, match="Bad triage override"):
+        ImageTriage.load_overrides(str(overrides_file))
@@ -0,0 +1,79 @@
+import os
+import logging
+
+import pytest
+from PIL import Image, ImageDraw
+
+import app
+from classes.ocr_engine import FakeOCREngine
+from classes.perceptual_hash_index import PerceptualHashIndex, PerceptualReuseEngine, dhash, hamming_distance
+
+"""
+Near duplicate reuse: a recompressed screenshot gets the stored markdown under its own ___reused_from_
+name, a screenshot of the same dialog with another text is at dHash distance 0 but goes to the engine.
+"""
+
+
+def screenshot(path, text, quality=95, size=None):
+    image = Image.new("RGB", (800, 600), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 800, 60), fill=(40, 90, 200))
+    draw.text((20, 20), "Settings", fill="white")
+    draw.text((40, 120), text, fill="black")
+    for number in range(5):
+        draw.text((40, 200 + 40 * number), f"Option {number}", fill=(60, 60, 60))
+    if size:
+        image = image.resize(size, Image.LANCZOS)
+    image.save(path, "JPEG", quality=quality)
+    return path
+
+
+@pytest.fixture
+def reuse_engine(tmp_path):
+    index = PerceptualHashIndex(str(tmp_path / "phash.sqlite"))
+    yield PerceptualReuseEngine(FakeOCREngine(), index, logging.getLogger("test_phash"))
+    index.close()
+
+
+def test_other_text_is_not_reused(tmp_path, reuse_engine):
+    wifi = screenshot(str(tmp_path / "wifi.jpeg"), "Settings > WiFi > Advanced")
+    bluetooth = screenshot(str(tmp_path / "bluetooth.jpeg"), "Settings > Bluetooth > Pair")
+    assert hamming_distance(dhash(wifi)[0], dhash(bluetooth)[0]) <= reuse_engine.index.max_distance
+
+    reuse_engine.process_image(wifi, str(tmp_path / "wifi.md"))
+    written = reuse_engine.process_image(bluetooth, str(tmp_path / "bluetooth.md"))
+
+    assert os.path.basename(written) == "bluetooth___model_fake_tokens_0.md"
+    assert reuse_engine.reused == 0
+
+
+def test_recompressed_copy_is_reused_under_its_own_name(tmp_path, reuse_engine):
+    original = screenshot(str(tmp_path / "original.jpeg"), "Settings > WiFi > Advanced")
+    copies = [screenshot(str(tmp_path / "copy_q40.jpeg"), "Settings > WiFi > Advanced", quality=40),
+              screenshot(str(tmp_path / "copy_small.jpeg"), "Settings > WiFi > Advanced", size=(640, 480))]
+
+    first = reuse_engine.process_image(original, str(tmp_path / "original.md"))
+    written = [reuse_engine.process_image(copy, os.path.splitext(copy)[0] + ".md") for copy in copies]
+
+    assert [os.path.basename(name) for name in written] == ["copy_q40___reused_from_original.md",
+                                                           "copy_small___reused_from_original.md"]
+    assert reuse_engine.reused == 2
+    with open(first) as f, open(written[0]) as g:
+        assert f.read() == g.read()
+
+
+def test_a_batch_sends_only_confirmed_duplicates_once(tmp_path, reuse_engine):
+    jobs = [(screenshot(str(tmp_path / f"{name}.jpeg"), text, quality=quality), str(tmp_path / f"{name}.md"))
+            for name, text, quality in (("a", "Version 1.2.5", 95), ("b", "Version 1.2.5", 50), ("c", "Version 1.2.6", 95))]
+
+    written = reuse_engine.process_images(jobs)
+
+    assert [os.path.basename(name) for name in written] == ["a___model_fake_tokens_0.md", "b___reused_from_a.md",
+                                                           "c___model_fake_tokens_0.md"]
+
+
+def test_reuse_is_off_by_default(configured_app, monkeypatch):
+    monkeypatch.delenv("OCR_PHASH_INDEX", raising=False)
+    args = app.build_parser().parse_args(["--engine", "fake", "--force", "--no-cache"])
+    app.configure(args)
+    assert app.phash_index is None
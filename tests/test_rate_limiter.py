@@ -0,0 +1,79 @@
+import time
+
+import pytest
+from openai import RateLimitError
+from PIL import Image
+
+from classes.ai_image_processor import AIImageProcessor
+from classes.rate_limiter import RateLimiter, TokenBucket
+from classes.run_metrics import RunMetrics
+
+"""
+The RateLimiter against the fake OpenAI endpoint: 429 answers are retried after the server's
+Retry-After, throttling halves the concurrency, and the retries end at max_retries.
+"""
+
+
+class NoHeaderError(Exception):
+    status_code = 503
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = str(tmp_path / "image.jpeg")
+    Image.new("RGB", (64, 48), (20, 120, 220)).save(path, "JPEG")
+    return path
+
+
+def create_processor(max_retries=3, base_delay=30.0):
+    # a base_delay this long would time the test out - only Retry-After can make it pass
+    limiter = RateLimiter(max_in_flight=4, max_retries=max_retries, base_delay=base_delay, metrics=RunMetrics())
+    return AIImageProcessor(limiter=limiter, metrics=limiter.metrics), limiter
+
+
+def test_429_waits_for_retry_after(fake_openai, image):
+    fake_openai.fail_first, fake_openai.error_status, fake_openai.retry_after = 2, 429, 0.2
+    processor, limiter = create_processor()
+
+    start = time.perf_counter()
+    result = processor.recognize(image)
+    elapsed = time.perf_counter() - start
+
+    assert result["model"] == "gpt-4o-fake"
+    assert 0.4 <= elapsed < 3.0
+    assert limiter.metrics.to_dict()["counters"]["ai_throttled"] == 2
+    assert 2 <= limiter.concurrency.limit < 3  # 4 halved once - two 429s within the cooldown are one signal - +1/2 for the success
+
+
+def test_retries_end_at_max_retries(fake_openai, image):
+    fake_openai.fail_first, fake_openai.error_status, fake_openai.retry_after = 10, 429, 0.05
+    processor, limiter = create_processor(max_retries=2)
+
+    with pytest.raises(RateLimitError):
+        processor.recognize(image)
+    assert fake_openai._failed == 3  # the first attempt and two retries
+
+
+def test_5xx_is_retried_too(fake_openai, image):
+    fake_openai.fail_first, fake_openai.error_status, fake_openai.retry_after = 1, 503, 0.05
+    processor, limiter = create_processor()
+
+    assert processor.recognize(image)["markdown"]
+    assert limiter.metrics.to_dict()["counters"]["ai_retried_errors"] == 1
+    assert limiter.concurrency.limit == 4  # only 429 is throttling
+
+
+def test_backoff_without_retry_after_is_full_jitter():
+    limiter = RateLimiter(base_delay=1.0, max_delay=5.0)
+    delays = [limiter.backoff(attempt, NoHeaderError()) for attempt in range(6) for _ in range(50)]
+    assert all(0 <= delay <= 5.0 for delay in delays)
+    assert max(limiter.backoff(0, NoHeaderError()) for _ in range(50)) <= 1.0
+
+
+def test_token_bucket_waits_for_room():
+    bucket = TokenBucket(per_minute=600, capacity=1)  # 10 per second
+    bucket.take(1)
+    start = time.perf_counter()
+    waited = bucket.take(1)
+    assert 0.05 <= time.perf_counter() - start < 0.5
+    assert waited > 0
@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import threading
+import subprocess
+
+import pytest
+
+import app
+from classes.run_metrics import RunMetrics
+from classes.work_leases import WorkLeases, LEASE_SUFFIX
+from conftest import SRC
+
+"""
+Coordinator-free sharding: a document is claimed by exactly one worker, a lease that is renewed is
+kept, an expired one is taken over - and N app.py workers on one folder do every document once.
+"""
+
+logger = logging.getLogger("test_work_leases")
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / "in" / "doc1.pdf"
+    path.parent.mkdir()
+    path.write_bytes(b"%PDF-1.4 not really")
+    return str(path)
+
+
+@pytest.fixture
+def workers(tmp_path):
+    created = []
+
+    def create(worker_id, lease_seconds=300.0):
+        leases = WorkLeases(str(tmp_path / "leases"), logger, worker_id=worker_id, lease_seconds=lease_seconds,
+                            metrics=RunMetrics())
+        created.append(leases)
+        return leases
+
+    yield create
+    for leases in created:
+        leases.close()
+
+
+def kill(leases):
+    """like kill -9: the heartbeat stops, the lease file stays"""
+    leases._stopped.set()
+    leases._heartbeat.join()
+
+
+def counters(leases):
+    return leases._metrics.to_dict()["counters"]
+
+
+def test_only_one_of_many_workers_claims(workers, document):
+    all_leases = [workers(f"w{number}") for number in range(8)]
+    results = [None] * len(all_leases)
+    start = threading.Barrier(len(all_leases))
+
+    def claim(index):
+        start.wait()
+        results[index] = all_leases[index].claim(document)
+    threads = [threading.Thread(target=claim, args=(index,)) for index in range(len(all_leases))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 1
+
+
+def test_done_is_not_claimed_until_the_document_changes(workers, document, tmp_path):
+    first, second = workers("w1"), workers("w2")
+    assert first.claim(document)
+    first.complete(document, str(tmp_path / "out"))
+
+    assert first.is_done(document) and second.is_done(document)
+    assert not second.claim(document)
+
+    with open(document, "ab") as f:
+        f.write(b" changed")
+    assert not second.is_done(document)
+    assert second.claim(document)
+
+
+def test_renewed_lease_is_kept(workers, document):
+    owner, other = workers("owner", lease_seconds=0.3), workers("other", lease_seconds=0.3)
+    assert owner.claim(document)
+    time.sleep(0.8)  # more than twice the lease, the heartbeat renews it every 0.1s
+    assert not other.claim(document)
+
+
+def test_expired_lease_is_stolen_once(workers, document):
+    dead = workers("dead", lease_seconds=0.3)
+    assert dead.claim(document)
+    kill(dead)
+    thieves = [workers(f"thief{number}", lease_seconds=0.3) for number in range(4)]
+    assert not thieves[0].claim(document)  # not expired yet
+
+    time.sleep(0.5)
+    results = [thief.claim(document) for thief in thieves]
+
+    assert results.count(True) == 1
+    winner = thieves[results.index(True)]
+    assert counters(winner)["leases_stolen"] == 1
+    with open(winner._path(document, LEASE_SUFFIX)) as f:
+        assert json.load(f)["worker"] == winner.worker_id
+
+
+def test_empty_lease_expires_by_its_mtime(workers, document):
+    """the owner died between creating the lease file and writing it"""
+    worker = workers("w1", lease_seconds=0.3)
+    open(worker._path(document, LEASE_SUFFIX), "w").close()
+    assert not worker.claim(document)
+
+    time.sleep(0.5)
+    assert worker.claim(document)
+
+
+def test_shared_output_folders_do_not_collide(tmp_path):
+    names = ["doc1.pdf", "doc1.PDF", "doc1.mhtml", "doc2.pdf"]
+    file_paths = [str(tmp_path / name) for name in names]
+    folders = [app.shared_output_folder(file_path, file_paths, "out") for file_path in file_paths]
+
+    assert len({folder.lower() for folder in folders}) == len(folders)  # also on a case insensitive share
+    assert folders[2] == os.path.join("out", "doc1_mhtml")
+    assert folders[3] == os.path.join("out", "doc2")
+
+
+def test_two_workers_do_every_document_once(tmp_path, sample_pdf):
+    for number in range(2, 6):
+        shutil.copy(sample_pdf, os.path.join(os.path.dirname(sample_pdf), f"test{number}.pdf"))
+    command = [sys.executable, os.path.join(SRC, "app.py"), "--path", "in", "--engine", "fake", "--no-cache",
+               "--lease-dir", "leases", "--output-dir", "out", "--report", "run_report.json"]
+    environment = dict(os.environ, LOG_LEVEL="WARNING")
+
+    processes = [subprocess.Popen(command + ["--worker-id", worker_id], cwd=tmp_path, env=environment)
+                 for worker_id in ("w1", "w2")]
+    assert [process.wait(timeout=120) for process in processes] == [0, 0]
+
+    processed = 0
+    for worker_id in ("w1", "w2"):
+        with open(tmp_path / f"run_report_{worker_id}.json") as f:
+            processed += json.load(f)["counters"].get("files_processed", 0)
+    assert processed == 5
+    assert len([name for name in os.listdir(tmp_path / "leases") if name.endswith(".done")]) == 5
+    assert sorted(os.listdir(tmp_path / "out")) == [f"test{number}" for number in range(1, 6)]
+    assert not (tmp_path / ".ocr_manifest.sqlite").exists()